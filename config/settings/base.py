@@ -359,3 +359,49 @@ SPECTACULAR_SETTINGS = {
     "SERVE_PERMISSIONS": ["rest_framework.permissions.IsAdminUser"],
     "SCHEMA_PATH_PREFIX": "/api/",
 }
+
+# Catalog
+# ------------------------------------------------------------------------------
+# Max number of medicine ids accepted by /api/medicines/prices/
+MEDICINE_PRICE_LOOKUP_MAX_IDS = env.int("MEDICINE_PRICE_LOOKUP_MAX_IDS", default=500)
+# Seconds to cache rows served by /api/medicines/prices/ (0 disables caching)
+MEDICINE_PRICE_CACHE_TIMEOUT = env.int("MEDICINE_PRICE_CACHE_TIMEOUT", default=60)
+# Seconds to cache "frequently bought together" lookups (0 disables caching)
+MEDICINE_RECOMMENDATION_CACHE_TIMEOUT = env.int(
+    "MEDICINE_RECOMMENDATION_CACHE_TIMEOUT", default=300
+)
+
+# Cart
+# ------------------------------------------------------------------------------
+# "db" writes every cart change to the database, "redis" keeps active carts in
+# Redis and writes them back with `manage.py flush_cart_store` and at checkout
+CART_STORE = env("CART_STORE", default="db")
+# Seconds an idle cart stays in Redis; keep well above the flush interval
+CART_STORE_TIMEOUT = env.int("CART_STORE_TIMEOUT", default=60 * 60 * 24 * 7)
+# Cart lines repriced per UPDATE when medicine prices change
+CART_REPRICE_CHUNK_SIZE = env.int("CART_REPRICE_CHUNK_SIZE", default=1000)
+
+# Background tasks
+# ------------------------------------------------------------------------------
+# Run docatho_backend.masters.background jobs inline instead of on the worker
+# thread
+BACKGROUND_TASKS_EAGER = env.bool("BACKGROUND_TASKS_EAGER", default=False)
+
+# Orders
+# ------------------------------------------------------------------------------
+# Attempts at an outbox side effect (e.g. creating the Razorpay order) before
+# it is marked failed; retries back off exponentially
+ORDER_OUTBOX_MAX_ATTEMPTS = env.int("ORDER_OUTBOX_MAX_ATTEMPTS", default=5)
+# Hours an Idempotency-Key response is replayed before the key can be reused
+ORDER_IDEMPOTENCY_KEY_TTL_HOURS = env.int("ORDER_IDEMPOTENCY_KEY_TTL_HOURS", default=24)
+# Seconds after which a request holding an Idempotency-Key without finishing
+# is presumed dead and its retry recovers or re-runs it (checkout takes at
+# most the 15s gateway timeout)
+ORDER_IDEMPOTENCY_LEASE_SECONDS = env.int("ORDER_IDEMPOTENCY_LEASE_SECONDS", default=60)
+# OrderLog rows are buffered per process and bulk-inserted once this many are
+# waiting, and at least every ORDER_LOG_FLUSH_SECONDS (see orders/eventlog.py)
+ORDER_LOG_BATCH_SIZE = env.int("ORDER_LOG_BATCH_SIZE", default=100)
+ORDER_LOG_FLUSH_SECONDS = env.float("ORDER_LOG_FLUSH_SECONDS", default=1.0)
+# Flushes a row may fail (database unreachable) before it is dropped and
+# logged as an error
+ORDER_LOG_MAX_ATTEMPTS = env.int("ORDER_LOG_MAX_ATTEMPTS", default=5)
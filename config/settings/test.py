@@ -34,5 +34,8 @@ TEMPLATES[0]["OPTIONS"]["debug"] = True  # type: ignore[index]
 # ------------------------------------------------------------------------------
 # https://docs.djangoproject.com/en/dev/ref/settings/#media-url
 MEDIA_URL = "http://media.testserver/"
+# BACKGROUND TASKS
+# ------------------------------------------------------------------------------
+BACKGROUND_TASKS_EAGER = True
 # Your stuff...
 # ------------------------------------------------------------------------------
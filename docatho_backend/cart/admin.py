@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 
-from docatho_backend.cart.models import Cart, CartItem
+from docatho_backend.cart.models import ArchivedCart, Cart, CartItem
 
 
 @admin.register(Cart)
@@ -17,3 +17,10 @@ class CartItemAdmin(admin.ModelAdmin):
     list_display = ("id", "cart", "medicine", "quantity", "unit_price", "line_total")
     search_fields = ("cart__id", "medicine__name")
     ordering = ("-id",)
+
+
+@admin.register(ArchivedCart)
+class ArchivedCartAdmin(admin.ModelAdmin):
+    list_display = ("cart_id", "user", "item_count", "total", "last_activity_at")
+    search_fields = ("user__email", "cart_id")
+    ordering = ("-last_activity_at",)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CartConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "docatho_backend.cart"
+
+    def ready(self):
+        import docatho_backend.cart.signals  # noqa: F401, PLC0415
@@ -0,0 +1,103 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from docatho_backend.cart.models import ArchivedCart, Cart, CartItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Move carts untouched for --days into ArchivedCart (or just delete them "
+        "with --delete). Carts are walked in id order in small batches, each in "
+        "its own transaction that skips rows locked by live requests, with a "
+        "pause between batches. Empty carts are deleted without an archive row."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=30)
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.2,
+            help="Seconds to pause between batches",
+        )
+        parser.add_argument(
+            "--delete", action="store_true", help="Delete without archiving"
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        if (
+            settings.CART_STORE == "redis"
+            and timedelta(days=options["days"]).total_seconds()
+            <= settings.CART_STORE_TIMEOUT
+        ):
+            # a cart idle in the database may still be live in Redis
+            raise CommandError("--days must exceed CART_STORE_TIMEOUT")
+
+        archived = 0
+        deleted = 0
+        last_id = 0
+        while True:
+            ids = list(
+                Cart.objects.filter(pk__gt=last_id, updated_at__lt=cutoff)
+                .order_by("pk")
+                .values_list("pk", flat=True)[: options["batch_size"]]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            with transaction.atomic():
+                batch_archived, batch_deleted = self._archive(
+                    ids, cutoff, keep=not options["delete"]
+                )
+            archived += batch_archived
+            deleted += batch_deleted
+            time.sleep(options["sleep"])
+
+        self.stdout.write(
+            f"Abandoned carts removed. deleted={deleted} archived={archived}"
+        )
+
+    def _archive(self, ids, cutoff, keep) -> tuple[int, int]:
+        # re-check the age under the lock: the cart may have been used since
+        carts = list(
+            Cart.objects.select_for_update(skip_locked=True)
+            .filter(pk__in=ids, updated_at__lt=cutoff)
+            .order_by("pk")
+        )
+        if not carts:
+            return 0, 0
+        cart_ids = [cart.pk for cart in carts]
+        archives = []
+        if keep:
+            lines = {}
+            for cart_id, medicine_id, quantity, unit_price in CartItem.objects.filter(
+                cart_id__in=cart_ids
+            ).values_list("cart_id", "medicine_id", "quantity", "unit_price"):
+                lines.setdefault(cart_id, []).append(
+                    [medicine_id, quantity, str(unit_price)]
+                )
+            archives = [
+                ArchivedCart(
+                    user_id=cart.user_id,
+                    cart_id=cart.pk,
+                    subtotal=cart.subtotal,
+                    total=cart.total,
+                    item_count=cart.item_count,
+                    total_quantity=cart.total_quantity,
+                    lines=lines[cart.pk],
+                    last_activity_at=cart.updated_at,
+                )
+                for cart in carts
+                if cart.pk in lines
+            ]
+            ArchivedCart.objects.bulk_create(archives)
+        CartItem.objects.filter(cart_id__in=cart_ids).delete()
+        Cart.objects.filter(pk__in=cart_ids).delete()
+        return len(archives), len(cart_ids)
@@ -0,0 +1,67 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from docatho_backend.cart.models import Cart, CartItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Check stored cart totals and counts against their items and optionally "
+        "repair them. Carts are scanned in id order, one grouped SUM query per "
+        "batch. Repairs skip carts that keep changing while they are recomputed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix", action="store_true", help="Recalculate mismatched carts"
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        checked = 0
+        mismatched = 0
+        fixed = 0
+        last_id = 0
+        while True:
+            carts = list(
+                Cart.objects.filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list(
+                    "pk", "subtotal", "total_mrp", "item_count", "total_quantity"
+                )[:batch_size]
+            )
+            if not carts:
+                break
+            last_id = carts[-1][0]
+            ids = [cart[0] for cart in carts]
+            totals = {
+                row["cart_id"]: row
+                for row in CartItem.objects.filter(cart_id__in=ids)
+                .values("cart_id")
+                .annotate(**CartItem.totals())
+            }
+            bad = []
+            for pk, *stored in carts:
+                row = totals.get(pk, {})
+                expected = [
+                    row.get("subtotal") or Decimal("0.00"),
+                    row.get("total_mrp") or Decimal("0.00"),
+                    row.get("item_count") or 0,
+                    row.get("total_quantity") or 0,
+                ]
+                if stored != expected:
+                    bad.append(pk)
+                    self.stdout.write(
+                        f"cart={pk} stored={stored} expected={expected}"
+                    )
+            checked += len(carts)
+            mismatched += len(bad)
+            if bad and options["fix"]:
+                fixed += Cart.recalculate_many(bad)
+
+        self.stdout.write(
+            f"Cart totals audited. checked={checked} mismatched={mismatched} "
+            f"fixed={fixed}"
+        )
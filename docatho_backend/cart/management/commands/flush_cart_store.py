@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from docatho_backend.cart.storage import get_cart_store
+
+
+class Command(BaseCommand):
+    help = (
+        "Write carts changed in the Redis cart store back to the database. "
+        "Run periodically when CART_STORE = 'redis'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        if settings.CART_STORE != "redis":
+            raise CommandError("CART_STORE is not 'redis'; nothing to flush.")
+        store = get_cart_store()
+        flushed = 0
+        while True:
+            count = store.flush(batch_size=options["batch_size"])
+            if not count:
+                break
+            flushed += count
+        self.stdout.write(f"Cart store flushed. carts={flushed}")
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from docatho_backend.cart.pricing import reprice_carts
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresh cart line prices from the current medicine price/mrp and "
+        "recalculate the affected carts. Prices changed with Medicine.save() are "
+        "repriced automatically; run this after bulk updates or to catch up."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--medicine",
+            type=int,
+            action="append",
+            dest="medicine_ids",
+            help="Only reprice lines of this medicine id (repeatable)",
+        )
+        parser.add_argument("--chunk-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        lines, carts = reprice_carts(
+            options["medicine_ids"], chunk_size=options["chunk_size"]
+        )
+        self.stdout.write(f"Carts repriced. lines={lines} carts={carts}")
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.9 on 2026-10-19 05:01
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def delete_duplicate_carts(apps, schema_editor):
+    # keep the most recently updated cart of each user
+    Cart = apps.get_model("cart", "Cart")
+    duplicated = (
+        Cart.objects.values("user_id")
+        .annotate(n=Count("id"))
+        .filter(n__gt=1)
+        .values_list("user_id", flat=True)
+    )
+    for user_id in duplicated:
+        keep = (
+            Cart.objects.filter(user_id=user_id)
+            .order_by("-updated_at", "-id")
+            .values_list("id", flat=True)
+            .first()
+        )
+        Cart.objects.filter(user_id=user_id).exclude(id=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cart", "0001_initial"),
+        ("users", "0007_alter_user_email_alter_user_phone"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_carts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="cart",
+            constraint=models.UniqueConstraint(
+                fields=("user",), name="cart_one_per_user"
+            ),
+        ),
+    ]
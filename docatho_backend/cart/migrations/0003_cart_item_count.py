@@ -0,0 +1,47 @@
+# Generated by Django 5.2.9 on 2026-10-19 05:03
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_counts(apps, schema_editor):
+    Cart = apps.get_model("cart", "Cart")
+    CartItem = apps.get_model("cart", "CartItem")
+    counts = CartItem.objects.values("cart_id").annotate(
+        item_count=Count("id"), total_quantity=Sum("quantity")
+    )
+    carts = []
+    for row in counts.iterator():
+        carts.append(
+            Cart(
+                pk=row["cart_id"],
+                item_count=row["item_count"],
+                total_quantity=row["total_quantity"],
+            )
+        )
+        if len(carts) >= 500:
+            Cart.objects.bulk_update(carts, ["item_count", "total_quantity"])
+            carts = []
+    if carts:
+        Cart.objects.bulk_update(carts, ["item_count", "total_quantity"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cart", "0002_cart_one_per_user"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="cart",
+            name="item_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="cart",
+            name="total_quantity",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counts, migrations.RunPython.noop),
+    ]
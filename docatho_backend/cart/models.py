@@ -2,13 +2,19 @@ from decimal import Decimal
 from typing import Optional
 
 from django.conf import settings
-from django.db import models, transaction
+from django.db import connection, models, transaction
+from django.db.models import Case, Count, F, Sum, When
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from docatho_backend.masters.models import BaseModel
 from docatho_backend.medicines.models import Medicine
 
 
+class CartVersionConflict(Exception):
+    """The cart was changed by another request since it was loaded."""
+
+
 class Cart(BaseModel):
 
     user = models.ForeignKey(
@@ -36,6 +42,11 @@ class Cart(BaseModel):
     total = models.DecimalField(
         max_digits=12, decimal_places=2, default=Decimal("0.00")
     )
+    # denormalized for the badge endpoint; kept in step with every mutation
+    item_count = models.PositiveIntegerField(default=0)
+    total_quantity = models.PositiveIntegerField(default=0)
+    # bumped by every change to the cart; writes are compare-and-swap on it
+    version = models.PositiveIntegerField(default=0)
 
     # discount_type: 'fixed' applies absolute amount, 'percent' applies percent to subtotal
     DISCOUNT_FIXED = "fixed"
@@ -47,34 +58,72 @@ class Cart(BaseModel):
 
     notes = models.TextField(blank=True, null=True)
 
+    # operations accepted by apply_operations
+    OP_ADD = "add"
+    OP_SET = "set"
+    OP_REMOVE = "remove"
+    OP_CHOICES = ((OP_ADD, "Add"), (OP_SET, "Set quantity"), (OP_REMOVE, "Remove"))
+
+    # passes of recalculate_many over carts changed while it ran
+    RECALCULATE_ATTEMPTS = 3
+
     class Meta:
         ordering = ("-updated_at",)
+        constraints = [
+            # one cart per user; lets concurrent first adds race safely in
+            # get_or_create instead of creating duplicate carts
+            models.UniqueConstraint(fields=["user"], name="cart_one_per_user"),
+        ]
 
     def __str__(self) -> str:
-        return f"Cart<{self.pk}> user={self.user_id} status={self.status}"
+        return f"Cart<{self.pk}> user={self.user_id}"
 
     @transaction.atomic
     def add_item(self, medicine: Medicine, quantity: int = 1) -> "CartItem":
-        print(medicine, quantity)
-        if int(quantity) < 1:
+        """
+        Add ``quantity`` of ``medicine`` with a single upsert:
+        INSERT ... ON CONFLICT (cart_id, medicine_id) DO UPDATE SET
+        quantity = quantity + excluded.quantity. The line's price snapshot is
+        refreshed from the medicine, so totals are re-summed afterwards.
+        """
+        quantity = int(quantity)
+        if quantity < 1:
             raise ValueError("quantity must be >= 1")
-        item, created = CartItem.objects.get_or_create(
+        unit_price = getattr(medicine, "price", None) or Decimal("0.00")
+        mrp = getattr(medicine, "mrp", None) or unit_price
+        now = timezone.now()
+
+        qn = connection.ops.quote_name
+        table = qn(CartItem._meta.db_table)
+        sql = (
+            f"INSERT INTO {table} ({qn('created_at')}, {qn('updated_at')}, "
+            f"{qn('cart_id')}, {qn('medicine_id')}, {qn('quantity')}, "
+            f"{qn('unit_price')}, {qn('mrp')}) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s) "
+            f"ON CONFLICT ({qn('cart_id')}, {qn('medicine_id')}) DO UPDATE SET "
+            f"{qn('quantity')} = {table}.{qn('quantity')} + EXCLUDED.{qn('quantity')}, "
+            f"{qn('unit_price')} = EXCLUDED.{qn('unit_price')}, "
+            f"{qn('mrp')} = EXCLUDED.{qn('mrp')}, "
+            f"{qn('updated_at')} = EXCLUDED.{qn('updated_at')} "
+            f"RETURNING {qn('id')}, {qn('quantity')}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                sql, [now, now, self.pk, medicine.pk, quantity, unit_price, mrp]
+            )
+            item_id, new_quantity = cursor.fetchone()
+
+        self.recalculate()
+        item = CartItem(
+            id=item_id,
             cart=self,
             medicine=medicine,
-            defaults={
-                "quantity": quantity,
-                "unit_price": getattr(medicine, "price", Decimal("0.00")),
-                "mrp": getattr(
-                    medicine, "mrp", getattr(medicine, "price", Decimal("0.00"))
-                ),
-            },
+            quantity=new_quantity,
+            unit_price=unit_price,
+            mrp=mrp,
+            updated_at=now,
         )
-        item.quantity = item.quantity + quantity
-        # refresh unit prices from medicine snapshot
-        item.unit_price = getattr(medicine, "price", item.unit_price) or Decimal("0.00")
-        item.mrp = getattr(medicine, "mrp", item.mrp) or item.unit_price
-        item.save()
-        self.recalculate()
+        item._state.adding = False
         return item
 
     @transaction.atomic
@@ -85,33 +134,196 @@ class Cart(BaseModel):
             item = CartItem.objects.get(cart=self, medicine=medicine)
         except CartItem.DoesNotExist:
             return None
+        old_subtotal, old_mrp = item.line_totals
+        old_quantity = item.quantity
         if quantity <= 0:
             item.delete()
+            new_subtotal, new_mrp = Decimal("0.00"), Decimal("0.00")
+            count_delta, quantity_delta = -1, -old_quantity
         else:
             item.quantity = quantity
             item.save()
-        self.recalculate()
+            new_subtotal, new_mrp = item.line_totals
+            count_delta, quantity_delta = 0, quantity - old_quantity
+        self.apply_line_delta(
+            new_subtotal - old_subtotal,
+            new_mrp - old_mrp,
+            count_delta=count_delta,
+            quantity_delta=quantity_delta,
+        )
         return item
 
     @transaction.atomic
     def remove_item(self, medicine: Medicine) -> None:
-        CartItem.objects.filter(cart=self, medicine=medicine).delete()
+        item = CartItem.objects.filter(cart=self, medicine=medicine).first()
+        if item is None:
+            return
+        old_subtotal, old_mrp = item.line_totals
+        item.delete()
+        self.apply_line_delta(
+            -old_subtotal, -old_mrp, count_delta=-1, quantity_delta=-item.quantity
+        )
+
+    @transaction.atomic
+    def apply_operations(self, operations) -> None:
+        """
+        Apply a list of {op, medicine_id, quantity} operations in order, then
+        write the net result with set-based queries and recalculate once.
+
+        - add:    increase quantity (refreshes the price snapshot, like add_item)
+        - set:    set quantity, creating the line if needed; <= 0 removes it
+        - remove: remove the line
+        Raises ValueError before writing anything if an operation is invalid.
+        """
+        medicine_ids = {op["medicine_id"] for op in operations}
+        medicines = Medicine.objects.in_bulk(medicine_ids)
+        missing = sorted(medicine_ids - medicines.keys())
+        if missing:
+            raise ValueError(f"unknown medicine_id(s): {missing}")
+
+        items = {
+            it.medicine_id: it
+            for it in CartItem.objects.filter(cart=self, medicine_id__in=medicine_ids)
+        }
+        quantities = {mid: it.quantity for mid, it in items.items()}
+        refresh = set()
+        for op in operations:
+            mid = op["medicine_id"]
+            quantity = int(op.get("quantity", 1))
+            if op["op"] == self.OP_ADD:
+                if quantity < 1:
+                    raise ValueError("quantity must be >= 1")
+                quantities[mid] = quantities.get(mid, 0) + quantity
+                refresh.add(mid)
+            elif op["op"] == self.OP_SET:
+                quantities[mid] = max(quantity, 0)
+            elif op["op"] == self.OP_REMOVE:
+                quantities[mid] = 0
+            else:
+                raise ValueError(f"unknown op '{op['op']}'")
+
+        self._write_lines(items, quantities, medicines, refresh)
         self.recalculate()
 
+    def _write_lines(self, items, quantities, medicines, refresh) -> None:
+        """Persist the target quantity of each line with bulk create/update/delete."""
+        now = timezone.now()
+        to_create, to_update, to_delete = [], [], []
+        for mid, quantity in quantities.items():
+            item = items.get(mid)
+            if quantity <= 0:
+                if item is not None:
+                    to_delete.append(item.pk)
+                continue
+            medicine = medicines[mid]
+            unit_price = medicine.price or Decimal("0.00")
+            if item is None:
+                to_create.append(
+                    CartItem(
+                        cart=self,
+                        medicine=medicine,
+                        quantity=quantity,
+                        unit_price=unit_price,
+                        mrp=medicine.mrp or unit_price,
+                    )
+                )
+            elif item.quantity != quantity or mid in refresh:
+                item.quantity = quantity
+                if mid in refresh:
+                    item.unit_price = unit_price
+                    item.mrp = medicine.mrp or unit_price
+                item.updated_at = now
+                to_update.append(item)
+
+        if to_delete:
+            CartItem.objects.filter(pk__in=to_delete).delete()
+        if to_create:
+            CartItem.objects.bulk_create(to_create)
+        if to_update:
+            CartItem.objects.bulk_update(
+                to_update, ["quantity", "unit_price", "mrp", "updated_at"]
+            )
+
     @transaction.atomic
     def clear(self) -> None:
         CartItem.objects.filter(cart=self).delete()
-        self.recalculate()
+        self._set_totals({})
+        self._apply_discount()
+        self._save_totals()
+
+    def apply_line_delta(
+        self,
+        subtotal_delta: Decimal,
+        mrp_delta: Decimal,
+        count_delta: int = 0,
+        quantity_delta: int = 0,
+    ) -> None:
+        """Adjust totals by the change of one line instead of re-reading every item."""
+        self.subtotal = (self.subtotal + subtotal_delta).quantize(Decimal("0.01"))
+        self.total_mrp = (self.total_mrp + mrp_delta).quantize(Decimal("0.01"))
+        self.item_count += count_delta
+        self.total_quantity += quantity_delta
+        self._apply_discount()
+        self._save_totals()
 
     def recalculate(self) -> None:
-        items = CartItem.objects.filter(cart=self)
-        subtotal = Decimal("0.00")
-        total_mrp = Decimal("0.00")
-        for it in items:
-            subtotal += it.line_total
-            total_mrp += (it.mrp or it.unit_price) * it.quantity
-        self.subtotal = subtotal.quantize(Decimal("0.01"))
-        self.total_mrp = total_mrp.quantize(Decimal("0.01"))
+        """Recompute totals from the items with a single SUM aggregate."""
+        self._set_totals(
+            CartItem.objects.filter(cart=self).aggregate(**CartItem.totals())
+        )
+        self._apply_discount()
+        self._save_totals()
+
+    @classmethod
+    def recalculate_many(cls, cart_ids) -> int:
+        """
+        Recompute totals of many carts with one grouped aggregate per pass.
+        The carts are locked before their items are summed, and each is
+        written only if still at the version read, so totals a concurrent
+        mutation saved are never replaced by stale sums. Carts changed in
+        between are recomputed, up to RECALCULATE_ATTEMPTS passes. Returns the
+        number of carts updated.
+        """
+        pending = set(cart_ids)
+        updated = 0
+        for _attempt in range(cls.RECALCULATE_ATTEMPTS):
+            if not pending:
+                break
+            with transaction.atomic():
+                # in id order, so concurrent recalculations cannot deadlock
+                carts = list(
+                    cls.objects.select_for_update()
+                    .filter(pk__in=pending)
+                    .order_by("pk")
+                )
+                totals = {
+                    row["cart_id"]: row
+                    for row in CartItem.objects.filter(cart_id__in=pending)
+                    .values("cart_id")
+                    .annotate(**CartItem.totals())
+                }
+                pending = set()
+                for cart in carts:
+                    cart._set_totals(totals.get(cart.pk, {}))
+                    cart._apply_discount()
+                    if cart._write_totals():
+                        updated += 1
+                    else:
+                        pending.add(cart.pk)
+        return updated
+
+    def _set_totals(self, row) -> None:
+        """Set line-derived totals from a ``CartItem.totals()`` aggregate row."""
+        self.subtotal = (row.get("subtotal") or Decimal("0.00")).quantize(
+            Decimal("0.01")
+        )
+        self.total_mrp = (row.get("total_mrp") or Decimal("0.00")).quantize(
+            Decimal("0.01")
+        )
+        self.item_count = row.get("item_count") or 0
+        self.total_quantity = row.get("total_quantity") or 0
+
+    def _apply_discount(self) -> None:
         # compute discount
         if self.discount_type == self.DISCOUNT_PERCENT:
             # discount_amount field is used as percent value (0-100)
@@ -131,16 +343,35 @@ class Cart(BaseModel):
             discount = self.subtotal
         self.discount_amount = discount
         self.total = (self.subtotal - discount).quantize(Decimal("0.01"))
-        # persist totals
-        self.save(
-            update_fields=[
-                "subtotal",
-                "total_mrp",
-                "discount_amount",
-                "total",
-                "updated_at",
-            ]
+
+    def _save_totals(self) -> None:
+        """
+        Persist the totals if the cart is still at the version it was loaded
+        with, otherwise raise CartVersionConflict (rolling back the caller's
+        atomic block). No row lock is taken before this final UPDATE.
+        """
+        if not self._write_totals():
+            raise CartVersionConflict(
+                f"cart {self.pk} was changed after version {self.version}"
+            )
+
+    def _write_totals(self) -> bool:
+        """The compare-and-swap of _save_totals; False if the version moved."""
+        now = timezone.now()
+        updated = Cart.objects.filter(pk=self.pk, version=self.version).update(
+            subtotal=self.subtotal,
+            total_mrp=self.total_mrp,
+            discount_amount=self.discount_amount,
+            total=self.total,
+            item_count=self.item_count,
+            total_quantity=self.total_quantity,
+            version=F("version") + 1,
+            updated_at=now,
         )
+        if updated:
+            self.version += 1
+            self.updated_at = now
+        return bool(updated)
 
 
 class CartItem(BaseModel):
@@ -167,6 +398,26 @@ class CartItem(BaseModel):
     def line_total(self) -> Decimal:
         return (self.unit_price or Decimal("0.00")) * Decimal(self.quantity)
 
+    @property
+    def line_totals(self) -> tuple[Decimal, Decimal]:
+        """(line subtotal, line mrp total) as summed into the cart totals."""
+        return self.line_total, (self.mrp or self.unit_price) * self.quantity
+
+    @staticmethod
+    def totals() -> dict:
+        """Aggregate expressions matching ``line_totals``, for SUM queries."""
+        amount = models.DecimalField(max_digits=12, decimal_places=2)
+        return {
+            "subtotal": Sum(F("unit_price") * F("quantity"), output_field=amount),
+            "total_mrp": Sum(
+                Case(When(mrp=0, then=F("unit_price")), default=F("mrp"))
+                * F("quantity"),
+                output_field=amount,
+            ),
+            "item_count": Count("id"),
+            "total_quantity": Sum("quantity"),
+        }
+
     @property
     def is_out_of_stock(self) -> bool:
         stock = getattr(self.medicine, "stock", None)
@@ -182,3 +433,33 @@ class CartItem(BaseModel):
         if self.quantity < 1:
             raise ValueError("quantity must be >= 1")
         super().save(*args, **kwargs)
+
+
+class ArchivedCart(BaseModel):
+    """
+    Compact copy of a cart removed by the archive_carts command, kept for
+    analytics. ``lines`` holds [medicine_id, quantity, unit_price] triples.
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="archived_carts",
+    )
+    cart_id = models.PositiveBigIntegerField()
+    subtotal = models.DecimalField(
+        max_digits=12, decimal_places=2, default=Decimal("0.00")
+    )
+    total = models.DecimalField(
+        max_digits=12, decimal_places=2, default=Decimal("0.00")
+    )
+    item_count = models.PositiveIntegerField(default=0)
+    total_quantity = models.PositiveIntegerField(default=0)
+    lines = models.JSONField(default=list)
+    last_activity_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ("-last_activity_at",)
+
+    def __str__(self) -> str:
+        return f"ArchivedCart<{self.cart_id}> user={self.user_id}"
@@ -0,0 +1,122 @@
+"""
+Checkout preflight: validate every line of a cart against the live catalog
+with one CartItem JOIN Medicine query, or none for lines already loaded.
+"""
+from decimal import Decimal
+
+from .models import CartItem
+
+INACTIVE = "inactive"
+OUT_OF_STOCK = "out_of_stock"
+PRICE_CHANGED = "price_changed"
+MRP_CHANGED = "mrp_changed"
+
+
+def preflight_cart(cart, lines=None) -> dict:
+    """
+    Returns::
+
+        {
+            "ok": bool,              # False if empty or any line has issues
+            "item_count": int,
+            "issues": [              # only lines with at least one issue
+                {"medicine_id", "name", "quantity", "stock", "is_active",
+                 "unit_price", "current_unit_price", "mrp", "current_mrp",
+                 "issues": [INACTIVE | OUT_OF_STOCK | PRICE_CHANGED | MRP_CHANGED]},
+            ],
+            "totals": {"subtotal", "total_mrp", "total",
+                       "current_subtotal", "current_total_mrp"},
+        }
+
+    ``subtotal``/``total_mrp``/``total`` are the stored cart totals; the
+    ``current_*`` totals price the active lines at today's catalog prices.
+    Amounts are decimal strings, as in the cart serializers.
+
+    ``lines`` are CartItem instances with their medicine loaded, checked
+    instead of the saved rows of ``cart`` (for carts held by a cart store).
+    """
+    if lines is None:
+        rows = CartItem.objects.filter(cart=cart).values_list(
+            "medicine_id",
+            "medicine__name",
+            "quantity",
+            "unit_price",
+            "mrp",
+            "medicine__price",
+            "medicine__mrp",
+            "medicine__stock",
+            "medicine__is_active",
+        )
+    else:
+        rows = [
+            (
+                it.medicine_id,
+                it.medicine.name,
+                it.quantity,
+                it.unit_price,
+                it.mrp,
+                it.medicine.price,
+                it.medicine.mrp,
+                it.medicine.stock,
+                it.medicine.is_active,
+            )
+            for it in lines
+        ]
+    issues = []
+    item_count = 0
+    current_subtotal = Decimal("0.00")
+    current_total_mrp = Decimal("0.00")
+    for (
+        medicine_id,
+        name,
+        quantity,
+        unit_price,
+        mrp,
+        price,
+        medicine_mrp,
+        stock,
+        is_active,
+    ) in rows:
+        item_count += 1
+        # same snapshot rule as Cart.add_item
+        current_mrp = medicine_mrp or price
+        line_issues = []
+        if not is_active:
+            line_issues.append(INACTIVE)
+        else:
+            current_subtotal += price * quantity
+            current_total_mrp += current_mrp * quantity
+        if stock < quantity:
+            line_issues.append(OUT_OF_STOCK)
+        if unit_price != price:
+            line_issues.append(PRICE_CHANGED)
+        if (mrp or unit_price) != current_mrp:
+            line_issues.append(MRP_CHANGED)
+        if line_issues:
+            issues.append(
+                {
+                    "medicine_id": medicine_id,
+                    "name": name,
+                    "quantity": quantity,
+                    "stock": stock,
+                    "is_active": is_active,
+                    "unit_price": str(unit_price),
+                    "current_unit_price": str(price),
+                    "mrp": str(mrp),
+                    "current_mrp": str(current_mrp),
+                    "issues": line_issues,
+                }
+            )
+
+    return {
+        "ok": bool(item_count) and not issues,
+        "item_count": item_count,
+        "issues": issues,
+        "totals": {
+            "subtotal": str(cart.subtotal),
+            "total_mrp": str(cart.total_mrp),
+            "total": str(cart.total),
+            "current_subtotal": str(current_subtotal),
+            "current_total_mrp": str(current_total_mrp),
+        },
+    }
@@ -0,0 +1,99 @@
+"""
+Repricing of cart lines after medicine price/mrp changes.
+
+Saving a Medicine with a new price or mrp queues ``reprice_carts`` on the
+background worker (see signals.py). Changes made with QuerySet.update() are
+not seen; run ``manage.py reprice_carts`` after those.
+"""
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from docatho_backend.masters.background import run_in_background
+from docatho_backend.medicines.models import Medicine
+
+from .models import Cart, CartItem
+
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def schedule_reprice(medicine_ids) -> None:
+    """
+    Queue repricing of ``medicine_ids``. Ids queued while a job is waiting
+    are merged into it, so an import saving many medicines runs few jobs.
+    """
+    with _pending_lock:
+        queued = bool(_pending)
+        _pending.update(medicine_ids)
+    if not queued:
+        run_in_background(_reprice_pending)
+
+
+def _reprice_pending() -> None:
+    with _pending_lock:
+        medicine_ids = sorted(_pending)
+        _pending.clear()
+    reprice_carts(medicine_ids)
+
+
+def reprice_carts(
+    medicine_ids=None, chunk_size=None, cart_ids=None
+) -> tuple[int, int]:
+    """
+    Copy the current price/mrp of ``medicine_ids`` (all medicines if None) into
+    the cart lines holding a different snapshot, then recalculate the affected
+    carts. ``cart_ids`` limits the work to those carts. Lines are walked in id
+    order, one UPDATE ... FROM and one cart recalculation per chunk, each in
+    its own short transaction.
+
+    Returns (lines repriced, carts recalculated).
+    """
+    chunk_size = chunk_size or settings.CART_REPRICE_CHUNK_SIZE
+    qn = connection.ops.quote_name
+    item_table = qn(CartItem._meta.db_table)
+    medicine_table = qn(Medicine._meta.db_table)
+    # same snapshot rule as Cart.add_item: mrp falls back to the price
+    sql = (
+        f"UPDATE {item_table} SET "
+        f"{qn('unit_price')} = m.{qn('price')}, "
+        f"{qn('mrp')} = CASE WHEN m.{qn('mrp')} = 0 THEN m.{qn('price')} "
+        f"ELSE m.{qn('mrp')} END, "
+        f"{qn('updated_at')} = %s "
+        f"FROM {medicine_table} AS m "
+        f"WHERE m.{qn('id')} = {item_table}.{qn('medicine_id')} "
+        f"AND {item_table}.{qn('id')} IN ({{ids}}) "
+        f"AND ({item_table}.{qn('unit_price')} <> m.{qn('price')} "
+        f"OR {item_table}.{qn('mrp')} <> CASE WHEN m.{qn('mrp')} = 0 "
+        f"THEN m.{qn('price')} ELSE m.{qn('mrp')} END) "
+        f"RETURNING {item_table}.{qn('cart_id')}"
+    )
+    items = CartItem.objects.order_by("pk")
+    if medicine_ids is not None:
+        items = items.filter(medicine_id__in=medicine_ids)
+    if cart_ids is not None:
+        items = items.filter(cart_id__in=cart_ids)
+
+    lines = 0
+    carts = 0
+    last_id = 0
+    while True:
+        ids = list(
+            items.filter(pk__gt=last_id).values_list("pk", flat=True)[:chunk_size]
+        )
+        if not ids:
+            break
+        last_id = ids[-1]
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    sql.format(ids=", ".join(["%s"] * len(ids))),
+                    [timezone.now(), *ids],
+                )
+                touched = [row[0] for row in cursor.fetchall()]
+            if touched:
+                lines += len(touched)
+                carts += Cart.recalculate_many(set(touched))
+    return lines, carts
@@ -10,6 +10,21 @@ class MedicineLiteSerializer(serializers.ModelSerializer):
         fields = ("id", "name", "image_url")
 
 
+def serialize_address(address):
+    if address is None:
+        return None
+    return {
+        "id": address.id,
+        "address_line1": address.address_line1,
+        "address_line2": address.address_line2,
+        "landmark": address.landmark,
+        "city": address.city,
+        "postal_code": address.postal_code,
+        "state": address.state,
+        "country": address.country,
+    }
+
+
 class CartItemSerializer(serializers.ModelSerializer):
     medicine = MedicineLiteSerializer(read_only=True)
     medicine_id = serializers.IntegerField(write_only=True, required=False)
@@ -38,7 +53,7 @@ class CartItemSerializer(serializers.ModelSerializer):
 
 
 class CartSerializer(serializers.ModelSerializer):
-    items = CartItemSerializer(many=True, read_only=True)
+    items = serializers.SerializerMethodField()
     user_name = serializers.CharField(source="user.name", read_only=True)
     address = serializers.SerializerMethodField(required=False)
 
@@ -54,22 +69,42 @@ class CartSerializer(serializers.ModelSerializer):
             "discount_amount",
             "discount_type",
             "total",
+            "item_count",
+            "total_quantity",
+            "version",
+            "items",
+        )
+        read_only_fields = (
+            "total_mrp",
+            "subtotal",
+            "total",
+            "item_count",
+            "total_quantity",
+            "version",
             "items",
         )
-        read_only_fields = ("total_mrp", "subtotal", "total", "items")
+
+    def get_items(self, obj):
+        # carts served from the Redis store are not backed by CartItem rows and
+        # pass their lines in the context instead
+        items = self.context.get("items")
+        if items is None:
+            items = obj.items.all()
+        return CartItemSerializer(items, many=True, context=self.context).data
 
     def get_address(self, obj):
-        address = obj.user.addresses.all()
-        print(address)
-        if address.first():
-            return {
-                "id": address.first().id,
-                "address_line1": address.first().address_line1,
-                "address_line2": address.first().address_line2,
-                "landmark": address.first().landmark,
-                "city": address.first().city,
-                "postal_code": address.first().postal_code,
-                "state": address.first().state,
-                "country": address.first().country,
-            }
-        return None
+        # single query; the cart has no address of its own yet, so the user's
+        # most recently updated address is shown
+        return serialize_address(obj.user.addresses.first())
+
+
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=Cart.OP_CHOICES)
+    medicine_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(required=False, default=1)
+
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = serializers.ListField(
+        child=CartOperationSerializer(), allow_empty=False, max_length=200
+    )
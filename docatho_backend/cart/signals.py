@@ -0,0 +1,20 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from docatho_backend.cart.pricing import schedule_reprice
+from docatho_backend.medicines.models import Medicine
+
+
+@receiver(post_save, sender=Medicine)
+def reprice_carts_on_price_change(sender, instance, created, update_fields, **kwargs):
+    if created:
+        return
+    if update_fields is not None and not {"price", "mrp"} & set(update_fields):
+        return
+    prices = (instance.price, instance.mrp)
+    if getattr(instance, "_loaded_prices", None) == prices:
+        return
+    instance._loaded_prices = prices
+    # after commit, so the job reads the new price; off the request thread
+    transaction.on_commit(lambda: schedule_reprice([instance.pk]))
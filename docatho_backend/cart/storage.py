@@ -0,0 +1,399 @@
+"""
+Cart storage backends used by ``CartViewSet``.
+
+``DatabaseCartStore`` (the default) writes every change straight to the
+``Cart``/``CartItem`` tables. ``RedisCartStore`` keeps the quantities of active
+carts in a Redis hash and writes them back to the tables later: from the
+``flush_cart_store`` command (run periodically) and always at checkout, so
+database writes follow orders rather than quantity taps.
+
+Select the backend with ``settings.CART_STORE`` ("db" or "redis").
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils.module_loading import import_string
+
+from docatho_backend.medicines.models import Medicine
+
+from .models import Cart, CartItem, CartVersionConflict
+from .preflight import preflight_cart
+
+CART_STORES = {
+    "db": "docatho_backend.cart.storage.DatabaseCartStore",
+    "redis": "docatho_backend.cart.storage.RedisCartStore",
+}
+
+
+def get_cart_store():
+    return import_string(CART_STORES[settings.CART_STORE])()
+
+
+class DatabaseCartStore:
+    """
+    Every mutation is a database transaction on the user's cart row.
+
+    Mutations take an optional ``expected_version``: if the cart is at another
+    version CartVersionConflict is raised. Without it, a mutation that loses a
+    race is retried on the reloaded cart.
+    """
+
+    MAX_ATTEMPTS = 3
+
+    def get_cart(self, user) -> Cart:
+        cart, _ = Cart.objects.select_related("user").get_or_create(user=user)
+        return cart
+
+    def items(self, cart) -> list:
+        """Lines of ``cart`` with their medicines, loaded with one query."""
+        prefetch_related_objects(
+            [cart],
+            Prefetch("items", queryset=CartItem.objects.select_related("medicine")),
+        )
+        return list(cart.items.all())
+
+    def counts(self, user) -> tuple[int, int]:
+        # single indexed read of the denormalized counters; never creates a cart
+        counts = (
+            Cart.objects.filter(user=user)
+            .values_list("item_count", "total_quantity")
+            .first()
+        )
+        return counts or (0, 0)
+
+    def _mutate(self, user, expected_version, change):
+        """Run ``change(cart)``; returns (cart, result of change)."""
+
+        def attempt():
+            cart = self.get_cart(user)
+            if expected_version is not None and cart.version != expected_version:
+                raise CartVersionConflict(
+                    f"cart is at version {cart.version}, not {expected_version}"
+                )
+            return cart, change(cart)
+
+        for _attempt in range(self.MAX_ATTEMPTS - 1):
+            try:
+                return attempt()
+            except CartVersionConflict:
+                if expected_version is not None:
+                    raise
+        return attempt()
+
+    def add(self, user, medicine, quantity, expected_version=None) -> Cart:
+        cart, _ = self._mutate(
+            user, expected_version, lambda cart: cart.add_item(medicine, quantity)
+        )
+        return cart
+
+    def update(self, user, medicine, quantity, expected_version=None) -> Cart | None:
+        """Returns None if the medicine is not in the cart."""
+        cart, item = self._mutate(
+            user,
+            expected_version,
+            lambda cart: cart.update_item_quantity(medicine, quantity),
+        )
+        return None if item is None else cart
+
+    def remove(self, user, medicine, expected_version=None) -> Cart:
+        cart, _ = self._mutate(
+            user, expected_version, lambda cart: cart.remove_item(medicine)
+        )
+        return cart
+
+    def apply(self, user, operations, expected_version=None) -> Cart:
+        cart, _ = self._mutate(
+            user, expected_version, lambda cart: cart.apply_operations(operations)
+        )
+        return cart
+
+    def persist(self, user) -> Cart | None:
+        """Make sure the tables hold the user's latest cart (no-op here)."""
+        return Cart.objects.filter(user=user).first()
+
+    def preflight(self, user) -> dict:
+        """preflight_cart of the user's latest cart; writes nothing."""
+        cart = Cart.objects.filter(user=user).first()
+        if cart is None:
+            return {"ok": False, "item_count": 0, "issues": [], "totals": None}
+        return preflight_cart(cart)
+
+    def clear(self, user) -> None:
+        cart = Cart.objects.filter(user=user).first()
+        if cart is not None and cart.item_count:
+            # clear() also resets the totals and badge counters
+            cart.clear()
+
+
+class RedisCartStore(DatabaseCartStore):
+    """
+    Quantities live in the hash ``cart:<user id>:lines`` (medicine id ->
+    quantity). ``cart:<user id>:meta`` marks the hash as loaded from the
+    database and holds the cart id. Users with unsaved changes are kept in the
+    ``cart:dirty`` set until ``persist`` writes them back.
+
+    The version is the counter ``cart:<user id>:version``, which has no expiry
+    and is never deleted, so it keeps growing across expiry and ``clear``; a
+    load raises it to at least the database version.
+
+    Prices are not cached: lines are priced from the current medicine rows
+    when rendered and when persisted, like ``add_item`` refreshes them.
+    """
+
+    DIRTY_KEY = "cart:dirty"
+
+    def __init__(self, client=None):
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+        self.client = client
+        self.timeout = settings.CART_STORE_TIMEOUT
+
+    def _keys(self, user) -> tuple[str, str]:
+        return f"cart:{user.pk}:lines", f"cart:{user.pk}:meta"
+
+    def _version_key(self, user) -> str:
+        return f"cart:{user.pk}:version"
+
+    def _version(self, user) -> int:
+        return int(self.client.get(self._version_key(user)) or 0)
+
+    def _load(self, user) -> str:
+        """Copy the user's cart from the database into Redis unless present."""
+        import redis
+
+        lines_key, meta_key = self._keys(user)
+        if self.client.exists(meta_key):
+            return meta_key
+        version_key = self._version_key(user)
+        cart = super().get_cart(user)
+        quantities = dict(cart.items.values_list("medicine_id", "quantity"))
+        with self.client.pipeline() as pipe:
+            try:
+                # another request may load (and then change) the cart meanwhile
+                pipe.watch(meta_key, version_key)
+                if pipe.exists(meta_key):
+                    return meta_key
+                # the lines may differ from the ones last seen: move past every
+                # version handed out so far and past the database's
+                version = max(int(pipe.get(version_key) or 0), cart.version) + 1
+                pipe.multi()
+                pipe.delete(lines_key)
+                if quantities:
+                    pipe.hset(lines_key, mapping=quantities)
+                pipe.hset(meta_key, mapping={"cart_id": cart.pk})
+                pipe.set(version_key, version)
+                pipe.expire(lines_key, self.timeout)
+                pipe.expire(meta_key, self.timeout)
+                pipe.execute()
+            except redis.WatchError:
+                pass
+        return meta_key
+
+    def _quantities(self, user) -> dict[int, int]:
+        self._load(user)
+        lines_key, _ = self._keys(user)
+        return {
+            int(mid): int(qty) for mid, qty in self.client.hgetall(lines_key).items()
+        }
+
+    def _write(self, user, commands, expected_version=None) -> None:
+        """
+        Run ``commands(pipe, lines_key)`` in a MULTI block guarded by WATCH on
+        the version, bump the version and mark the cart dirty.
+        """
+        import redis
+
+        self._load(user)
+        lines_key, meta_key = self._keys(user)
+        version_key = self._version_key(user)
+        with self.client.pipeline() as pipe:
+            for attempt in range(1, self.MAX_ATTEMPTS + 1):
+                try:
+                    pipe.watch(meta_key, version_key)
+                    version = int(pipe.get(version_key) or 0)
+                    if expected_version is not None and version != expected_version:
+                        raise CartVersionConflict(
+                            f"cart is at version {version}, not {expected_version}"
+                        )
+                    pipe.multi()
+                    commands(pipe, lines_key)
+                    pipe.incr(version_key)
+                    pipe.expire(lines_key, self.timeout)
+                    pipe.expire(meta_key, self.timeout)
+                    pipe.sadd(self.DIRTY_KEY, user.pk)
+                    pipe.execute()
+                    return
+                except redis.WatchError as exc:
+                    if expected_version is not None or attempt == self.MAX_ATTEMPTS:
+                        raise CartVersionConflict(
+                            "cart was changed concurrently"
+                        ) from exc
+
+    def get_cart(self, user) -> Cart:
+        """
+        The user's cart with totals computed from the Redis lines; the
+        instance is not saved. Its lines are available from ``items()``.
+        """
+        cart = super().get_cart(user)
+        quantities = self._quantities(user)
+        cart.version = self._version(user)
+        medicines = Medicine.objects.in_bulk(quantities)
+        lines = [
+            CartItem(
+                cart=cart,
+                medicine=medicine,
+                quantity=quantities[mid],
+                unit_price=medicine.price or Decimal("0.00"),
+                mrp=medicine.mrp or medicine.price or Decimal("0.00"),
+            )
+            for mid, medicine in medicines.items()
+        ]
+        cart._set_totals(
+            {
+                "subtotal": sum((it.line_totals[0] for it in lines), Decimal("0.00")),
+                "total_mrp": sum((it.line_totals[1] for it in lines), Decimal("0.00")),
+                "item_count": len(lines),
+                "total_quantity": sum(it.quantity for it in lines),
+            }
+        )
+        cart._apply_discount()
+        cart._store_lines = lines
+        return cart
+
+    def items(self, cart) -> list:
+        return cart._store_lines
+
+    def counts(self, user) -> tuple[int, int]:
+        # read-only: carts not loaded into Redis are counted from the table
+        lines_key, meta_key = self._keys(user)
+        with self.client.pipeline() as pipe:
+            loaded, quantities = pipe.exists(meta_key).hvals(lines_key).execute()
+        if not loaded:
+            return super().counts(user)
+        return len(quantities), sum(int(qty) for qty in quantities)
+
+    def add(self, user, medicine, quantity, expected_version=None) -> Cart:
+        quantity = int(quantity)
+        if quantity < 1:
+            raise ValueError("quantity must be >= 1")
+        self._write(
+            user,
+            lambda pipe, key: pipe.hincrby(key, medicine.pk, quantity),
+            expected_version,
+        )
+        return self.get_cart(user)
+
+    def update(self, user, medicine, quantity, expected_version=None) -> Cart | None:
+        self._load(user)
+        lines_key, _ = self._keys(user)
+        if not self.client.hexists(lines_key, medicine.pk):
+            return None
+
+        def commands(pipe, key):
+            if quantity <= 0:
+                pipe.hdel(key, medicine.pk)
+            else:
+                pipe.hset(key, medicine.pk, quantity)
+
+        self._write(user, commands, expected_version)
+        return self.get_cart(user)
+
+    def remove(self, user, medicine, expected_version=None) -> Cart:
+        self._write(
+            user, lambda pipe, key: pipe.hdel(key, medicine.pk), expected_version
+        )
+        return self.get_cart(user)
+
+    def apply(self, user, operations, expected_version=None) -> Cart:
+        medicine_ids = {op["medicine_id"] for op in operations}
+        known = Medicine.objects.filter(pk__in=medicine_ids).values_list(
+            "pk", flat=True
+        )
+        missing = sorted(medicine_ids - set(known))
+        if missing:
+            raise ValueError(f"unknown medicine_id(s): {missing}")
+        for op in operations:
+            if op["op"] == Cart.OP_ADD and int(op.get("quantity", 1)) < 1:
+                raise ValueError("quantity must be >= 1")
+            if op["op"] not in (Cart.OP_ADD, Cart.OP_SET, Cart.OP_REMOVE):
+                raise ValueError(f"unknown op '{op['op']}'")
+
+        def commands(pipe, key):
+            for op in operations:
+                mid = op["medicine_id"]
+                quantity = int(op.get("quantity", 1))
+                if op["op"] == Cart.OP_ADD:
+                    pipe.hincrby(key, mid, quantity)
+                elif op["op"] == Cart.OP_SET and quantity > 0:
+                    pipe.hset(key, mid, quantity)
+                else:
+                    pipe.hdel(key, mid)
+
+        self._write(user, commands, expected_version)
+        return self.get_cart(user)
+
+    def preflight(self, user) -> dict:
+        if not self.client.exists(self._keys(user)[1]):
+            return super().preflight(user)
+        # the unsaved lines, priced from the current medicine rows
+        cart = self.get_cart(user)
+        return preflight_cart(cart, lines=self.items(cart))
+
+    def persist(self, user) -> Cart | None:
+        """
+        Write the Redis lines of ``user`` to CartItem rows and recalculate the
+        cart. Carts that were never loaded into Redis are left untouched.
+        """
+        # clear the flag first: a change made while persisting marks it again
+        self.client.srem(self.DIRTY_KEY, user.pk)
+        try:
+            with transaction.atomic():
+                return self._write_back(user)
+        except Exception:
+            # nothing was saved: leave the cart to the next flush
+            self.client.sadd(self.DIRTY_KEY, user.pk)
+            raise
+
+    def _write_back(self, user) -> Cart | None:
+        lines_key, meta_key = self._keys(user)
+        if not self.client.exists(meta_key):
+            return super().persist(user)
+        quantities = {
+            int(mid): int(qty) for mid, qty in self.client.hgetall(lines_key).items()
+        }
+        cart = super().get_cart(user)
+        items = {it.medicine_id: it for it in CartItem.objects.filter(cart=cart)}
+        medicines = Medicine.objects.in_bulk(quantities)
+        # lines of deleted medicines are dropped, lines missing in Redis removed
+        target = {mid: 0 for mid in items}
+        target.update({mid: qty for mid, qty in quantities.items() if mid in medicines})
+        cart._write_lines(items, target, medicines, refresh=set(medicines))
+        cart.recalculate()
+        return cart
+
+    def clear(self, user) -> None:
+        lines_key, meta_key = self._keys(user)
+        with self.client.pipeline() as pipe:
+            pipe.delete(lines_key, meta_key)
+            pipe.srem(self.DIRTY_KEY, user.pk)
+            pipe.execute()
+        super().clear(user)
+
+    def flush(self, batch_size: int = 100) -> int:
+        """Persist up to ``batch_size`` dirty carts; returns how many were taken."""
+        from django.contrib.auth import get_user_model
+
+        user_ids = {
+            int(pk) for pk in self.client.srandmember(self.DIRTY_KEY, batch_size)
+        }
+        users = list(get_user_model().objects.filter(pk__in=user_ids))
+        gone = user_ids - {user.pk for user in users}
+        if gone:
+            self.client.srem(self.DIRTY_KEY, *gone)
+        for user in users:
+            self.persist(user)
+        return len(user_ids)
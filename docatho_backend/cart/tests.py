@@ -1,3 +1,417 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+import pytest
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from docatho_backend.cart.models import (
+    ArchivedCart,
+    Cart,
+    CartItem,
+    CartVersionConflict,
+)
+from docatho_backend.medicines.models import Medicine
+from docatho_backend.orders.models import Order
+from docatho_backend.users.models import Address
+from docatho_backend.users.tests.factories import UserFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def medicines() -> list[Medicine]:
+    return [
+        Medicine.objects.create(
+            name=f"Medicine {i}",
+            price=Decimal("10.00") * i,
+            mrp=Decimal("12.00") * i,
+            stock=10,
+        )
+        for i in range(1, 4)
+    ]
+
+
+def test_incremental_totals_match_recalculate(user, medicines):
+    cart = Cart.objects.create(user=user)
+    cart.add_item(medicines[0], quantity=1)
+    cart.add_item(medicines[1], quantity=3)
+    cart.update_item_quantity(medicines[1], 1)
+    cart.add_item(medicines[2], quantity=1)
+    cart.remove_item(medicines[0])
+
+    incremental = (
+        cart.subtotal,
+        cart.total_mrp,
+        cart.total,
+        cart.item_count,
+        cart.total_quantity,
+    )
+    cart.recalculate()
+    assert incremental == (
+        cart.subtotal,
+        cart.total_mrp,
+        cart.total,
+        cart.item_count,
+        cart.total_quantity,
+    )
+    assert (cart.item_count, cart.total_quantity) == (2, 2)
+
+
+def test_audit_cart_totals_fix(user, medicines):
+    cart = Cart.objects.create(user=user)
+    cart.add_item(medicines[0], quantity=2)
+    Cart.objects.filter(pk=cart.pk).update(subtotal=Decimal("1.00"))
+
+    call_command("audit_cart_totals", "--fix")
+
+    cart.refresh_from_db()
+    assert cart.subtotal == cart.items.get().line_total
+
+
+def test_add_item_upserts_quantity(user, medicines):
+    cart = Cart.objects.create(user=user)
+    cart.add_item(medicines[0], quantity=2)
+    item = cart.add_item(medicines[0], quantity=3)
+
+    assert item.quantity == 5
+    assert cart.items.get().quantity == 5
+    assert cart.subtotal == medicines[0].price * 5
+
+
+def test_apply_operations(user, medicines):
+    cart = Cart.objects.create(user=user)
+    cart.add_item(medicines[0], quantity=1)
+    cart.add_item(medicines[1], quantity=1)
+
+    cart.apply_operations(
+        [
+            {"op": "add", "medicine_id": medicines[0].pk, "quantity": 2},
+            {"op": "remove", "medicine_id": medicines[1].pk},
+            {"op": "set", "medicine_id": medicines[2].pk, "quantity": 4},
+            {"op": "add", "medicine_id": medicines[2].pk, "quantity": 1},
+        ]
+    )
+
+    quantities = dict(cart.items.values_list("medicine_id", "quantity"))
+    assert quantities == {medicines[0].pk: 3, medicines[2].pk: 5}
+    assert cart.subtotal == medicines[0].price * 3 + medicines[2].price * 5
+
+    with pytest.raises(ValueError):
+        cart.apply_operations([{"op": "add", "medicine_id": 999999, "quantity": 1}])
+
+
+def test_stale_cart_write_conflicts(user, medicines):
+    cart = Cart.objects.create(user=user)
+    stale = Cart.objects.get(pk=cart.pk)
+    cart.add_item(medicines[0])
+
+    with pytest.raises(CartVersionConflict):
+        stale.add_item(medicines[1])
+    assert list(cart.items.values_list("medicine_id", flat=True)) == [medicines[0].pk]
+
+    client = APIClient()
+    client.force_authenticate(user)
+    payload = {"medicine_id": medicines[1].pk, "quantity": 1}
+    response = client.post("/api/cart/add/", payload, HTTP_IF_MATCH='"0"')
+    assert response.status_code == 409
+    assert response.json()["version"] == cart.version == 1
+
+    response = client.post("/api/cart/add/", payload, HTTP_IF_MATCH=response["ETag"])
+    assert response.status_code == 200
+    assert response.json()["version"] == 2
+
+
+def test_price_change_reprices_carts(
+    user, medicines, django_capture_on_commit_callbacks
+):
+    cart = Cart.objects.create(user=user)
+    cart.add_item(medicines[0], quantity=2)
+    cart.add_item(medicines[1], quantity=1)
+
+    medicine = Medicine.objects.get(pk=medicines[0].pk)
+    medicine.price = Decimal("7.00")
+    with django_capture_on_commit_callbacks(execute=True):
+        medicine.save()
+
+    item = cart.items.get(medicine=medicine)
+    assert (item.unit_price, item.mrp) == (Decimal("7.00"), medicine.mrp)
+    cart.refresh_from_db()
+    assert cart.subtotal == Decimal("14.00") + medicines[1].price
+
+
+def test_recalculate_many_keeps_concurrent_changes(user, medicines, monkeypatch):
+    cart = Cart.objects.create(user=user)
+    cart.add_item(medicines[0], quantity=2)
+    CartItem.objects.filter(cart=cart).update(unit_price=Decimal("1.00"))
+    set_totals = Cart._set_totals
+    interleaved = []
+
+    def set_totals_after_a_mutation(self, row):
+        if not interleaved:
+            # another request adds a line after the sums were read
+            interleaved.append(1)
+            Cart.objects.get(pk=cart.pk).add_item(medicines[1], quantity=1)
+        set_totals(self, row)
+
+    monkeypatch.setattr(Cart, "_set_totals", set_totals_after_a_mutation)
+    assert Cart.recalculate_many([cart.pk]) == 1
+
+    cart.refresh_from_db()
+    assert (cart.item_count, cart.total_quantity) == (2, 3)
+    assert cart.subtotal == Decimal("2.00") + medicines[1].price
+    # one add before, the interleaved add, the recalculation
+    assert cart.version == 3
+
+
+def test_archive_carts(user, medicines):
+    other = UserFactory()
+    stale = Cart.objects.create(user=user)
+    stale.add_item(medicines[0], quantity=2)
+    Cart.objects.create(user=other)
+    Cart.objects.update(updated_at=timezone.now() - timedelta(days=60))
+    fresh = Cart.objects.create(user=UserFactory())
+
+    call_command("archive_carts", "--days", "30", "--sleep", "0")
+
+    assert list(Cart.objects.values_list("pk", flat=True)) == [fresh.pk]
+    archived = ArchivedCart.objects.get()
+    assert (archived.cart_id, archived.user_id) == (stale.pk, user.pk)
+    assert archived.lines == [[medicines[0].pk, 2, str(medicines[0].price)]]
+
+
+def test_preflight_blocks_checkout(user, medicines):
+    cart = Cart.objects.create(user=user)
+    for medicine in medicines:
+        cart.add_item(medicine, quantity=2)
+    Medicine.objects.filter(pk=medicines[0].pk).update(is_active=False)
+    Medicine.objects.filter(pk=medicines[1].pk).update(stock=1)
+    Medicine.objects.filter(pk=medicines[2].pk).update(price=Decimal("99.00"))
+    client = APIClient()
+    client.force_authenticate(user)
+
+    with CaptureQueriesContext(connection) as ctx:
+        response = client.get("/api/cart/preflight/")
+    data = response.json()
+    # a single CartItem JOIN Medicine query
+    assert len([q for q in ctx.captured_queries if "cart_cartitem" in q["sql"]]) == 1
+    assert not data["ok"]
+    assert {line["medicine_id"]: line["issues"] for line in data["issues"]} == {
+        medicines[0].pk: ["inactive"],
+        medicines[1].pk: ["out_of_stock"],
+        medicines[2].pk: ["price_changed"],
+    }
+
+    response = client.post("/api/orders/checkout/", {})
+    assert response.status_code == 409
+    assert not Order.objects.exists()
+    assert cart.items.get(medicine=medicines[2]).unit_price == Decimal("99.00")
+
+
+def _count_queries(func):
+    with CaptureQueriesContext(connection) as ctx:
+        response = func()
+    assert response.status_code == 200
+    return len([q for q in ctx.captured_queries if "SAVEPOINT" not in q["sql"]])
+
+
+def test_cart_read_path_query_count(user):
+    Address.objects.create(
+        user=user,
+        address_line1="1 Main St",
+        city="Pune",
+        state="MH",
+        postal_code="411001",
+        country="IN",
+    )
+    client = APIClient()
+    client.force_authenticate(user)
+    cart = Cart.objects.create(user=user)
+    medicine = Medicine.objects.create(name="First", price=Decimal("5.00"))
+    cart.add_item(medicine)
+
+    get_one = _count_queries(lambda: client.get("/api/cart/"))
+    for i in range(10):
+        cart.add_item(Medicine.objects.create(name=f"M{i}", price=Decimal("1.00")))
+    get_many = _count_queries(lambda: client.get("/api/cart/"))
+    add_many = _count_queries(
+        lambda: client.post(
+            "/api/cart/add/", {"medicine_id": medicine.pk, "quantity": 1}
+        )
+    )
+
+    # cart+user, items+medicines, address
+    assert get_one == get_many == 3
+    assert add_many <= 7
+
+
+@pytest.fixture
+def redis_store(settings, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    from docatho_backend.cart.storage import RedisCartStore
+
+    settings.CART_STORE = "redis"
+    client = fakeredis.FakeRedis(decode_responses=True)
+    store = RedisCartStore(client)
+    # views and commands build their own store
+    monkeypatch.setattr(
+        "docatho_backend.cart.storage.RedisCartStore", lambda client=None: store
+    )
+    return store
+
+
+def test_redis_store_writes_behind(user, medicines, redis_store):
+    client = APIClient()
+    client.force_authenticate(user)
+    Cart.objects.create(user=user).add_item(medicines[0], quantity=1)
+
+    response = client.post(
+        "/api/cart/add/", {"medicine_id": medicines[1].pk, "quantity": 2}
+    )
+    data = response.json()
+    assert data["item_count"] == 2
+    assert data["subtotal"] == str(medicines[0].price + medicines[1].price * 2)
+    # nothing written yet
+    assert Cart.objects.get(user=user).item_count == 1
+
+    call_command("flush_cart_store")
+
+    cart = Cart.objects.get(user=user)
+    assert dict(cart.items.values_list("medicine_id", "quantity")) == {
+        medicines[0].pk: 1,
+        medicines[1].pk: 2,
+    }
+    assert (cart.item_count, cart.total_quantity) == (2, 3)
+
+
+def test_redis_store_version_never_repeats(user, medicines, redis_store):
+    seen = [redis_store.add(user, medicines[0], 1).version]
+    seen.append(redis_store.add(user, medicines[1], 1).version)
+
+    redis_store.clear(user)
+    seen.append(redis_store.get_cart(user).version)
+    seen.append(redis_store.add(user, medicines[0], 1).version)
+
+    # the cart expires from Redis and is loaded again
+    redis_store.client.delete(*redis_store._keys(user))
+    seen.append(redis_store.get_cart(user).version)
+
+    assert seen == sorted(set(seen))
+    with pytest.raises(CartVersionConflict):
+        redis_store.add(user, medicines[2], 1, expected_version=seen[1])
+
+
+def test_redis_store_preflight_writes_nothing(user, medicines, redis_store):
+    client = APIClient()
+    client.force_authenticate(user)
+    Cart.objects.create(user=user).add_item(medicines[0], quantity=1)
+    client.post("/api/cart/add/", {"medicine_id": medicines[1].pk, "quantity": 20})
+
+    with CaptureQueriesContext(connection) as ctx:
+        data = client.get("/api/cart/preflight/").json()
+    assert not [
+        q for q in ctx.captured_queries if q["sql"].startswith(("INSERT", "UPDATE"))
+    ]
+    # the unsaved line is checked, and stays unsaved
+    assert data["item_count"] == 2
+    assert [line["issues"] for line in data["issues"]] == [["out_of_stock"]]
+    assert Cart.objects.get(user=user).item_count == 1
+    assert redis_store.client.sismember(redis_store.DIRTY_KEY, user.pk)
+
+
+def test_redis_store_keeps_failed_carts_dirty(
+    user, medicines, redis_store, monkeypatch
+):
+    redis_store.add(user, medicines[0], 2)
+    recalculate = Cart.recalculate
+
+    def fail(self):
+        raise OperationalError("database is down")
+
+    monkeypatch.setattr(Cart, "recalculate", fail)
+    with pytest.raises(OperationalError):
+        redis_store.persist(user)
+    assert redis_store.client.sismember(redis_store.DIRTY_KEY, user.pk)
+    assert not CartItem.objects.exists()
+
+    monkeypatch.setattr(Cart, "recalculate", recalculate)
+    call_command("flush_cart_store")
+    assert Cart.objects.get(user=user).item_count == 1
+    assert not redis_store.client.sismember(redis_store.DIRTY_KEY, user.pk)
+
+
+@pytest.mark.parametrize("store", ["db", "redis"])
+def test_cart_badge_counts(user, medicines, store, request):
+    if store == "redis":
+        redis_store = request.getfixturevalue("redis_store")
+    Cart.objects.create(user=user).add_item(medicines[0], quantity=2)
+    empty = UserFactory()
+    client = APIClient()
+    url = "/api/cart/get_cart_items_count/"
+
+    client.force_authenticate(user)
+    assert _count_queries(lambda: client.get(url)) == 1
+    assert client.get(url).json() == {"count": 1, "quantity": 2}
+
+    client.force_authenticate(empty)
+    assert _count_queries(lambda: client.get(url)) == 1
+    assert client.get(url).json() == {"count": 0, "quantity": 0}
+    # a badge poll creates nothing
+    assert not Cart.objects.filter(user=empty).exists()
+
+    if store == "redis":
+        assert not redis_store.client.keys("cart:*")
+        # a cart loaded into Redis is counted from there alone
+        client.force_authenticate(user)
+        client.post("/api/cart/add/", {"medicine_id": medicines[1].pk, "quantity": 3})
+        assert _count_queries(lambda: client.get(url)) == 0
+        assert client.get(url).json() == {"count": 2, "quantity": 5}
+
+
+def test_cart_batch_endpoint(user, medicines):
+    cart = Cart.objects.create(user=user)
+    cart.add_item(medicines[0], quantity=1)
+    client = APIClient()
+    client.force_authenticate(user)
+
+    def batch(*operations, **headers):
+        return client.post(
+            "/api/cart/batch/",
+            {"operations": list(operations)},
+            format="json",
+            **headers,
+        )
+
+    assert batch({"op": "swap", "medicine_id": medicines[1].pk}).status_code == 400
+    assert batch().status_code == 400
+    # one bad operation rejects the whole batch
+    for bad in (
+        {"op": "add", "medicine_id": medicines[0].pk, "quantity": 0},
+        {"op": "add", "medicine_id": 999999},
+    ):
+        response = batch({"op": "add", "medicine_id": medicines[1].pk}, bad)
+        assert response.status_code == 400
+    cart.refresh_from_db()
+    assert dict(cart.items.values_list("medicine_id", "quantity")) == {
+        medicines[0].pk: 1
+    }
+    assert cart.version == 1
+
+    response = batch(
+        {"op": "add", "medicine_id": medicines[1].pk, "quantity": 2},
+        {"op": "set", "medicine_id": medicines[0].pk, "quantity": 0},
+        HTTP_IF_MATCH='"1"',
+    )
+    assert response.status_code == 200
+    assert (response.json()["item_count"], response.json()["version"]) == (1, 2)
+
+    # a stale If-Match gets the current cart back
+    response = batch(
+        {"op": "remove", "medicine_id": medicines[1].pk}, HTTP_IF_MATCH='"1"'
+    )
+    assert response.status_code == 409
+    assert response["ETag"] == '"2"'
+    assert cart.items.get().medicine_id == medicines[1].pk
@@ -8,8 +8,10 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from docatho_backend.medicines.models import Medicine
-from .models import Cart, CartItem
+from .models import CartItem, CartVersionConflict
+from .storage import get_cart_store
 from docatho_backend.cart.serializers import (
+    CartBatchSerializer,
     CartSerializer,
     CartItemSerializer,
     MedicineLiteSerializer,
@@ -23,37 +25,87 @@ class CartViewSet(viewsets.ViewSet):
     - POST   /api/cart/add/        -> add item {medicine_id, quantity}
     - PATCH  /api/cart/update/     -> update item quantity {medicine_id, quantity}
     - POST   /api/cart/remove/     -> remove item {medicine_id}
+    - POST   /api/cart/batch/      -> apply many add/set/remove operations at once
+    - GET    /api/cart/preflight/  -> validate the cart before checkout
+
+    Reads and writes go through the configured cart store (see cart/storage.py).
+
+    Responses carry the cart version in ``version`` and the ETag header.
+    Mutations sent with ``If-Match: <version>`` are applied only if the cart is
+    still at that version, otherwise 409 is returned with the current cart.
     """
 
     permission_classes = (IsAuthenticated,)
 
-    def _get_open_cart(self, user):
-        cart, _ = Cart.objects.get_or_create(user=user)
-        return cart
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.store = get_cart_store()
+
+    def _cart_response(self, cart, request, status_code=status.HTTP_200_OK):
+        """
+        Serialize the cart with a fixed number of queries: items and their
+        medicines in one query, the address in another (the user is joined
+        when the cart is loaded).
+        """
+        serializer = CartSerializer(
+            cart, context={"request": request, "items": self.store.items(cart)}
+        )
+        response = Response(serializer.data, status=status_code)
+        response["ETag"] = f'"{cart.version}"'
+        return response
+
+    def _expected_version(self, request):
+        """Version from the If-Match header, or None when not sent."""
+        value = request.headers.get("If-Match", "").strip()
+        if not value or value == "*":
+            return None
+        try:
+            return int(value.removeprefix("W/").strip('"'))
+        except ValueError as exc:
+            raise serializers.ValidationError(
+                {"detail": "If-Match must be a cart version"}
+            ) from exc
+
+    def _mutate(self, request, method, *args):
+        return method(
+            request.user, *args, expected_version=self._expected_version(request)
+        )
+
+    def handle_exception(self, exc):
+        if isinstance(exc, CartVersionConflict):
+            # the client's copy is stale: send the current cart to retry against
+            return self._cart_response(
+                self.store.get_cart(self.request.user),
+                self.request,
+                status_code=status.HTTP_409_CONFLICT,
+            )
+        return super().handle_exception(exc)
 
     def list(self, request):
         # return current cart (list endpoint used for simplicity)
-        cart = self._get_open_cart(request.user)
-        serializer = CartSerializer(cart, context={"request": request})
-        return Response(serializer.data)
+        cart = self.store.get_cart(request.user)
+        return self._cart_response(cart, request)
 
     def retrieve(self, request, pk=None):
         # allow retrieving by id if needed
-        cart = get_object_or_404(Cart, pk=pk, user=request.user)
-        serializer = CartSerializer(cart, context={"request": request})
-        return Response(serializer.data)
+        cart = self.store.get_cart(request.user)
+        if str(cart.pk) != str(pk):
+            return Response(
+                {"detail": "No Cart matches the given query."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        return self._cart_response(cart, request)
 
     # api for cart items count
     @action(detail=False, methods=["get"])
     def get_cart_items_count(self, request):
-        cart = self._get_open_cart(request.user)
-        return Response({"count": cart.items.count()})
+        count, quantity = self.store.counts(request.user)
+        return Response({"count": count, "quantity": quantity})
 
     @action(detail=False, methods=["post"])
     def add(self, request):
         medicine_id = request.data.get("medicine_id")
         quantity = int(request.data.get("quantity", 1) or 1)
-        print(medicine_id, quantity)
         if not medicine_id:
             return Response(
                 {"detail": "medicine_id is required"},
@@ -61,14 +113,12 @@ class CartViewSet(viewsets.ViewSet):
             )
 
         medicine = get_object_or_404(Medicine, pk=medicine_id)
-        cart = self._get_open_cart(request.user)
         try:
-            item = cart.add_item(medicine, quantity=quantity)
+            cart = self._mutate(request, self.store.add, medicine, quantity)
         except ValueError as exc:
             return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
 
-        serializer = CartSerializer(cart, context={"request": request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self._cart_response(cart, request)
 
     @action(detail=False, methods=["patch"], url_path="update-item")
     def update_item(self, request):
@@ -91,15 +141,12 @@ class CartViewSet(viewsets.ViewSet):
             )
 
         medicine = get_object_or_404(Medicine, pk=medicine_id)
-        cart = self._get_open_cart(request.user)
-        print(medicine, quantity)
-        item = cart.update_item_quantity(medicine, quantity)
-        if item is None:
+        cart = self._mutate(request, self.store.update, medicine, quantity)
+        if cart is None:
             return Response(
                 {"detail": "item not found in cart"}, status=status.HTTP_404_NOT_FOUND
             )
-        serializer = CartSerializer(cart, context={"request": request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self._cart_response(cart, request)
 
     @action(detail=False, methods=["post"], url_path="remove-item")
     def remove_item(self, request):
@@ -114,7 +161,31 @@ class CartViewSet(viewsets.ViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
         medicine = get_object_or_404(Medicine, pk=medicine_id)
-        cart = self._get_open_cart(request.user)
-        cart.remove_item(medicine)
-        serializer = CartSerializer(cart, context={"request": request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        cart = self._mutate(request, self.store.remove, medicine)
+        return self._cart_response(cart, request)
+
+    @action(detail=False, methods=["post"])
+    def batch(self, request):
+        """
+        Apply several cart operations in one transaction.
+        POST /api/cart/batch/
+        { operations: [{op: "add"|"set"|"remove", medicine_id, quantity}, ...] }
+        """
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            cart = self._mutate(
+                request, self.store.apply, serializer.validated_data["operations"]
+            )
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return self._cart_response(cart, request)
+
+    @action(detail=False, methods=["get"])
+    def preflight(self, request):
+        """
+        Check every line for inactive medicines, insufficient stock and price
+        drift in one query. Checkout refuses carts that do not pass.
+        GET /api/cart/preflight/
+        """
+        return Response(self.store.preflight(request.user))
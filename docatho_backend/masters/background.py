@@ -0,0 +1,51 @@
+"""
+Minimal in-process background queue for work that must not delay the request
+that triggers it. Jobs run in submission order on one daemon thread per
+process. Jobs are not durable: each caller pairs its job with a management
+command that catches up on work lost at shutdown.
+
+With settings.BACKGROUND_TASKS_EAGER the job runs inline (used by the tests).
+"""
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_queue = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def run_in_background(func, *args, **kwargs) -> None:
+    if settings.BACKGROUND_TASKS_EAGER:
+        func(*args, **kwargs)
+        return
+    _start_worker()
+    _queue.put((func, args, kwargs))
+
+
+def _start_worker() -> None:
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(
+                target=_work, name="background-tasks", daemon=True
+            )
+            _worker.start()
+
+
+def _work() -> None:
+    while True:
+        func, args, kwargs = _queue.get()
+        close_old_connections()
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            logger.exception("Background task %s failed", func.__qualname__)
+        finally:
+            close_old_connections()
+            _queue.task_done()
@@ -17,6 +17,7 @@ class MedicineAdmin(admin.ModelAdmin):
         "price",
         "mrp",
         "stock",
+        "popularity",
         "created_at",
         "updated_at",
     )
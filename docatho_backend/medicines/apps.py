@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MedicinesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "docatho_backend.medicines"
+
+    def ready(self):
+        import docatho_backend.medicines.signals  # noqa: F401, PLC0415
@@ -0,0 +1,186 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+CATALOG_VERSION_KEY = "medicines:catalog-version"
+# versioned entries are never invalidated in place; the ttl only reclaims
+# entries left behind by old versions
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def get_catalog_version() -> int:
+    """Return the current catalog version, used to namespace catalog cache keys."""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        version = 1
+        cache.add(CATALOG_VERSION_KEY, version, timeout=None)
+    return version
+
+
+def bump_catalog_version() -> None:
+    """Invalidate every cached catalog entry by moving to a new version."""
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        # key missing (cold cache / eviction) -> start a fresh namespace
+        cache.set(CATALOG_VERSION_KEY, 2, timeout=None)
+
+
+def catalog_key(*parts, version=None) -> str:
+    """Cache key in the current catalog namespace, or in ``version``'s."""
+    if version is None:
+        version = get_catalog_version()
+    return ":".join(["medicines", f"v{version}", *[str(p) for p in parts]])
+
+
+def get_medicine_prices(ids) -> dict:
+    """
+    Return {id: [price, mrp, stock, is_active]} for the given medicine ids.
+
+    Rows are served from the cache when MEDICINE_PRICE_CACHE_TIMEOUT > 0,
+    the misses are loaded with a single ``id IN (...)`` query.
+    """
+    from docatho_backend.medicines.models import Medicine
+
+    timeout = settings.MEDICINE_PRICE_CACHE_TIMEOUT
+    result = {}
+    keys = {}
+    if timeout:
+        # one version read for every key of the call
+        version = get_catalog_version()
+        keys = {catalog_key("price", pk, version=version): pk for pk in ids}
+        for key, row in cache.get_many(keys).items():
+            result[keys[key]] = row
+
+    missing = [pk for pk in ids if pk not in result]
+    if missing:
+        rows = Medicine.objects.filter(pk__in=missing).values_list(
+            "id", "price", "mrp", "stock", "is_active"
+        )
+        fetched = {
+            pk: [str(price), str(mrp), stock, is_active]
+            for pk, price, mrp, stock, is_active in rows
+        }
+        result.update(fetched)
+        if timeout and fetched:
+            cache.set_many(
+                {
+                    catalog_key("price", pk, version=version): row
+                    for pk, row in fetched.items()
+                },
+                timeout=timeout,
+            )
+    return result
+
+
+def get_category_tree() -> list:
+    """
+    Nested tree of active categories, cached until the catalog changes.
+    A category under an inactive parent is hidden together with its parent.
+    """
+    from docatho_backend.medicines.models import Category
+
+    key = catalog_key("category-tree")
+    tree = cache.get(key)
+    if tree is not None:
+        return tree
+
+    nodes = {}
+    tree = []
+    # ordering by path yields parents before their children
+    for category in Category.objects.filter(is_active=True).order_by("path"):
+        node = {
+            "id": category.pk,
+            "name": category.name,
+            "image_url": category.image_url,
+            "path": category.path,
+            "depth": category.depth,
+            "children": [],
+        }
+        nodes[category.pk] = node
+        if category.parent_id is None:
+            tree.append(node)
+        elif category.parent_id in nodes:
+            nodes[category.parent_id]["children"].append(node)
+    cache.set(key, tree, timeout=CATALOG_CACHE_TIMEOUT)
+    return tree
+
+
+def get_category_path(category_id):
+    """Materialized path of a category (active or not), or None if unknown."""
+    from docatho_backend.medicines.models import Category
+
+    key = catalog_key("category-paths")
+    paths = cache.get(key)
+    if paths is None:
+        paths = dict(Category.objects.values_list("id", "path"))
+        cache.set(key, paths, timeout=CATALOG_CACHE_TIMEOUT)
+    return paths.get(category_id)
+
+
+def get_top_medicines_by_category(n: int) -> list:
+    """
+    Top ``n`` active medicines (by popularity) of every active category, computed
+    with one ROW_NUMBER() OVER (PARTITION BY category ...) query and cached until
+    the catalog changes. Categories without active medicines are omitted.
+    """
+    from docatho_backend.medicines.models import Medicine
+
+    key = catalog_key("top-medicines", n)
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    Through = Medicine.category.through
+    rows = (
+        Through.objects.filter(category__is_active=True, medicine__is_active=True)
+        .annotate(
+            rank=Window(
+                RowNumber(),
+                partition_by=[F("category_id")],
+                order_by=[F("medicine__popularity").desc(), F("medicine_id").asc()],
+            )
+        )
+        .filter(rank__lte=n)
+        .select_related("category", "medicine")
+        .only(
+            "category__name",
+            "category__image_url",
+            "medicine__name",
+            "medicine__image_url",
+            "medicine__manufacturer",
+            "medicine__price",
+            "medicine__mrp",
+            "medicine__stock",
+        )
+        .order_by("category__name", "category_id", "rank")
+    )
+
+    result = []
+    current = None
+    for row in rows:
+        if current is None or current["category"]["id"] != row.category_id:
+            current = {
+                "category": {
+                    "id": row.category.pk,
+                    "name": row.category.name,
+                    "image_url": row.category.image_url,
+                },
+                "medicines": [],
+            }
+            result.append(current)
+        medicine = row.medicine
+        current["medicines"].append(
+            {
+                "id": medicine.pk,
+                "name": medicine.name,
+                "image_url": medicine.image_url,
+                "manufacturer": medicine.manufacturer,
+                "price": str(medicine.price),
+                "mrp": str(medicine.mrp),
+                "stock": medicine.stock,
+            }
+        )
+    cache.set(key, result, timeout=CATALOG_CACHE_TIMEOUT)
+    return result
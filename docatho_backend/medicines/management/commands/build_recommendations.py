@@ -0,0 +1,52 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from docatho_backend.medicines.cache import bump_catalog_version
+from docatho_backend.medicines.recommendations import (
+    build_cooccurrence,
+    store_recommendations,
+)
+from docatho_backend.orders.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild 'frequently bought together' recommendations from paid orders. "
+        "Keeps the top-K co-purchased medicines per medicine."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--top-k", type=int, default=10, help="Neighbours kept per medicine"
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help="Only use orders placed in the last N days (default: all history)",
+        )
+        parser.add_argument(
+            "--max-basket",
+            type=int,
+            default=50,
+            help="Ignore orders with more distinct medicines than this",
+        )
+
+    def handle(self, *args, **options):
+        items = OrderItem.objects.filter(
+            order__payment_status=Order.PaymentStatus.PAID
+        ).exclude(order__status__in=[Order.Status.CANCELLED, Order.Status.RETURNED])
+        if options["days"]:
+            since = timezone.now() - timedelta(days=options["days"])
+            items = items.filter(order__placed_at__gte=since)
+
+        rows = items.values_list("order_id", "medicine_id").iterator(chunk_size=5000)
+        neighbours = build_cooccurrence(
+            rows, top_k=options["top_k"], max_basket=options["max_basket"]
+        )
+        stored = store_recommendations(neighbours)
+        bump_catalog_version()
+
+        self.stdout.write(f"Recommendations rebuilt. medicines={stored}")
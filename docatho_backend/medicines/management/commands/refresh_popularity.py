@@ -0,0 +1,92 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from docatho_backend.medicines.cache import bump_catalog_version
+from docatho_backend.medicines.models import Medicine, PopularityRun
+from docatho_backend.orders.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute Medicine.popularity from the order items of the trailing "
+        "--window-days, each day's units decayed by their age. Only orders that "
+        "are paid and neither cancelled nor returned at the time of the run "
+        "count, so orders paid late, refunded or cancelled after earlier runs "
+        "are reflected."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--half-life-days",
+            type=float,
+            default=14.0,
+            help="Days after which a sale counts for half (default 14)",
+        )
+        parser.add_argument(
+            "--window-days",
+            type=int,
+            default=90,
+            help="Days of orders counted (default 90); older sales count for "
+            "almost nothing",
+        )
+
+    def handle(self, *args, **options):
+        half_life = options["half_life_days"]
+        if half_life <= 0:
+            self.stderr.write("--half-life-days must be > 0")
+            return
+        if options["window_days"] < 1:
+            self.stderr.write("--window-days must be > 0")
+            return
+
+        now = timezone.now()
+        since = now - timedelta(days=options["window_days"])
+        items = OrderItem.objects.filter(
+            order__payment_status=Order.PaymentStatus.PAID,
+            order__placed_at__gte=since,
+            order__placed_at__lt=now,
+        ).exclude(order__status__in=[Order.Status.CANCELLED, Order.Status.RETURNED])
+
+        # one row per (medicine, day) keeps the aggregate small and lets each
+        # bucket decay by its own age
+        buckets = (
+            items.annotate(day=TruncDate("order__placed_at"))
+            .values("medicine_id", "day")
+            .annotate(units=Sum("quantity"))
+        )
+        today = timezone.localdate(now)
+        scores = defaultdict(float)
+        for row in buckets:
+            age_days = (today - row["day"]).days
+            scores[row["medicine_id"]] += row["units"] * 0.5 ** (age_days / half_life)
+
+        with transaction.atomic():
+            # medicines with no sales left in the window
+            cleared = (
+                Medicine.objects.filter(popularity__gt=0)
+                .exclude(pk__in=scores)
+                .update(popularity=0)
+            )
+            medicines = list(Medicine.objects.filter(pk__in=scores).only("popularity"))
+            for medicine in medicines:
+                medicine.popularity = scores[medicine.pk]
+            Medicine.objects.bulk_update(medicines, ["popularity"], batch_size=500)
+            PopularityRun.objects.create(
+                window_start=since,
+                window_end=now,
+                half_life_days=half_life,
+                medicines_updated=len(medicines) + cleared,
+            )
+        # QuerySet.update()/bulk_update() bypass the catalog signals
+        bump_catalog_version()
+
+        self.stdout.write(
+            f"Popularity refreshed. medicines_updated={len(medicines) + cleared} "
+            f"since={since}"
+        )
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.9 on 2026-10-19 04:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medicines", "0007_remove_medicine_slug_medicine_is_active"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PopularityRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("window_start", models.DateTimeField(blank=True, null=True)),
+                ("window_end", models.DateTimeField()),
+                ("half_life_days", models.FloatField()),
+                ("medicines_updated", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "ordering": ("-window_end",),
+            },
+        ),
+        migrations.AddField(
+            model_name="medicine",
+            name="popularity",
+            field=models.FloatField(db_index=True, default=0),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.9 on 2026-10-19 04:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medicines", "0008_medicine_popularity"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MedicineRecommendation",
+            fields=[
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "medicine",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="recommendation",
+                        serialize=False,
+                        to="medicines.medicine",
+                    ),
+                ),
+                ("related", models.JSONField(default=list)),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.9 on 2026-10-19 04:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def set_root_paths(apps, schema_editor):
+    # every existing category is a root; keep in sync with Category._build_path
+    Category = apps.get_model("medicines", "Category")
+    categories = list(Category.objects.only("pk"))
+    for category in categories:
+        category.path = f"{category.pk:06d}/"
+        category.depth = 0
+    Category.objects.bulk_update(categories, ["path", "depth"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medicines", "0009_medicinerecommendation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="depth",
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="parent",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="children",
+                to="medicines.category",
+            ),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="path",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=255
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="category",
+            index=models.Index(
+                fields=["path"],
+                name="category_path_prefix_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ),
+        migrations.RunPython(set_root_paths, migrations.RunPython.noop),
+    ]
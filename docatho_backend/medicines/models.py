@@ -1,15 +1,64 @@
 from decimal import Decimal
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
 from docatho_backend.masters.models import BaseModel
 
 
 class Category(BaseModel):
+    # width of one zero-padded pk segment in ``path``
+    PATH_SEGMENT_WIDTH = 6
+
     name = models.CharField(max_length=255)
     image_url = models.URLField(blank=True, null=True)
     is_active = models.BooleanField(default=True)
+    parent = models.ForeignKey(
+        "self",
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        related_name="children",
+    )
+    # materialized path of ancestor pks, e.g. "000003/000017/"; a subtree is
+    # every row whose path starts with the root's path
+    path = models.CharField(max_length=255, blank=True, default="", editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["path"],
+                name="category_path_prefix_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ]
 
+    def _build_path(self) -> str:
+        prefix = self.parent.path if self.parent_id else ""
+        return f"{prefix}{self.pk:0{self.PATH_SEGMENT_WIDTH}d}/"
+
+    @transaction.atomic
     def save(self, *args, **kwargs):
+        old_path = self.path
+        if self.parent_id and old_path and self.parent.path.startswith(old_path):
+            raise ValueError("a category cannot be moved under its own subtree")
+        if self.pk:
+            self.path = self._build_path()
+            self.depth = self.path.count("/") - 1
         super().save(*args, **kwargs)
+        if not old_path and not self.path:
+            # new row: the path needs the pk assigned by the insert
+            self.path = self._build_path()
+            self.depth = self.path.count("/") - 1
+            Category.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+        elif old_path and old_path != self.path:
+            # moved: rewrite the prefix of every descendant in one statement
+            Category.objects.filter(path__startswith=old_path).exclude(
+                pk=self.pk
+            ).update(
+                path=Concat(Value(self.path), Substr("path", len(old_path) + 1)),
+                depth=F("depth") + (self.path.count("/") - old_path.count("/")),
+            )
 
     def __str__(self):
         return self.name
@@ -28,3 +77,46 @@ class Medicine(BaseModel):
     stock = models.PositiveIntegerField(default=0)
     mrp = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal("0.00"))
     is_active = models.BooleanField(default=True)
+    # time-decayed units sold, maintained by the refresh_popularity command
+    popularity = models.FloatField(default=0, db_index=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # lets post_save receivers tell whether the price changed
+        instance._loaded_prices = (
+            instance.__dict__.get("price"),
+            instance.__dict__.get("mrp"),
+        )
+        return instance
+
+
+class PopularityRun(BaseModel):
+    """One execution of refresh_popularity, over the orders placed in the window."""
+
+    window_start = models.DateTimeField(null=True, blank=True)
+    window_end = models.DateTimeField()
+    half_life_days = models.FloatField()
+    medicines_updated = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ("-window_end",)
+
+    def __str__(self):
+        return f"PopularityRun<{self.pk}> {self.window_start} -> {self.window_end}"
+
+
+class MedicineRecommendation(BaseModel):
+    """Top co-purchased medicines for one medicine, rebuilt by build_recommendations."""
+
+    medicine = models.OneToOneField(
+        Medicine,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="recommendation",
+    )
+    # [[medicine_id, orders_together], ...] ordered by orders_together desc
+    related = models.JSONField(default=list)
+
+    def __str__(self):
+        return f"MedicineRecommendation<{self.medicine_id}> n={len(self.related)}"
@@ -0,0 +1,95 @@
+import pandas as pd
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from docatho_backend.medicines.cache import catalog_key
+from docatho_backend.medicines.models import Medicine, MedicineRecommendation
+
+
+def build_cooccurrence(rows, top_k: int, max_basket: int) -> dict:
+    """
+    Build the medicine x medicine co-occurrence matrix from (order_id, medicine_id)
+    rows and keep the top_k neighbours of every medicine.
+
+    The matrix is kept sparse: a self-join of the order/medicine incidence pairs on
+    order_id yields only the non-zero cells, which are then counted.
+    Returns {medicine_id: [[neighbour_id, orders_together], ...]}.
+    """
+    df = pd.DataFrame.from_records(rows, columns=["order_id", "medicine_id"])
+    if df.empty:
+        return {}
+    df = df.drop_duplicates()
+    basket_size = df.groupby("order_id")["medicine_id"].transform("size")
+    # single-item baskets carry no signal; very large ones blow up quadratically
+    df = df[(basket_size > 1) & (basket_size <= max_basket)]
+    if df.empty:
+        return {}
+
+    pairs = df.merge(df, on="order_id", suffixes=("", "_other"))
+    pairs = pairs[pairs["medicine_id"] != pairs["medicine_id_other"]]
+    counts = (
+        pairs.groupby(["medicine_id", "medicine_id_other"])
+        .size()
+        .reset_index(name="orders_together")
+        .sort_values(
+            ["medicine_id", "orders_together", "medicine_id_other"],
+            ascending=[True, False, True],
+        )
+    )
+    top = counts.groupby("medicine_id").head(top_k)
+
+    result = {}
+    for medicine_id, group in top.groupby("medicine_id"):
+        result[int(medicine_id)] = [
+            [int(other), int(n)]
+            for other, n in zip(group["medicine_id_other"], group["orders_together"])
+        ]
+    return result
+
+
+@transaction.atomic
+def store_recommendations(neighbours: dict) -> int:
+    MedicineRecommendation.objects.all().delete()
+    MedicineRecommendation.objects.bulk_create(
+        [
+            MedicineRecommendation(medicine_id=medicine_id, related=related)
+            for medicine_id, related in neighbours.items()
+        ],
+        batch_size=1000,
+    )
+    return len(neighbours)
+
+
+def get_also_bought(medicine_ids, limit: int) -> list:
+    """
+    Return up to ``limit`` active medicine ids frequently bought together with
+    ``medicine_ids`` (excluding them), best first. Neighbour lists of several
+    medicines are merged by summing their co-occurrence counts.
+    """
+    medicine_ids = set(medicine_ids)
+    key = catalog_key("also-bought", ",".join(str(i) for i in sorted(medicine_ids)))
+    timeout = settings.MEDICINE_RECOMMENDATION_CACHE_TIMEOUT
+    if timeout:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached[:limit]
+
+    scores = {}
+    for related in MedicineRecommendation.objects.filter(
+        medicine_id__in=medicine_ids
+    ).values_list("related", flat=True):
+        for other, n in related:
+            if other not in medicine_ids:
+                scores[other] = scores.get(other, 0) + n
+    active = set(
+        Medicine.objects.filter(pk__in=scores, is_active=True).values_list(
+            "id", flat=True
+        )
+    )
+    ranked = sorted(
+        (pk for pk in scores if pk in active), key=lambda pk: (-scores[pk], pk)
+    )
+    if timeout:
+        cache.set(key, ranked, timeout=timeout)
+    return ranked[:limit]
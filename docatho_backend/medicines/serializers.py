@@ -1,4 +1,5 @@
 from unicodedata import category
+from django.conf import settings
 from rest_framework import serializers
 from docatho_backend.medicines.models import Category, Medicine
 
@@ -6,7 +7,24 @@ from docatho_backend.medicines.models import Category, Medicine
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ["id", "name", "image_url", "is_active", "created_at", "updated_at"]
+        fields = [
+            "id",
+            "name",
+            "image_url",
+            "is_active",
+            "parent",
+            "path",
+            "depth",
+            "created_at",
+            "updated_at",
+        ]
+        read_only_fields = ["path", "depth"]
+
+    def save(self, **kwargs):
+        try:
+            return super().save(**kwargs)
+        except ValueError as exc:
+            raise serializers.ValidationError({"parent": str(exc)}) from exc
 
 
 class MedicineSerializer(serializers.ModelSerializer):
@@ -29,3 +47,11 @@ class MedicineSerializer(serializers.ModelSerializer):
             "created_at",
             "updated_at",
         ]
+
+
+class MedicineIdListSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.MEDICINE_PRICE_LOOKUP_MAX_IDS,
+    )
@@ -0,0 +1,18 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from docatho_backend.medicines.cache import bump_catalog_version
+from docatho_backend.medicines.models import Category, Medicine
+
+
+@receiver(post_save, sender=Medicine)
+@receiver(post_delete, sender=Medicine)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(m2m_changed, sender=Medicine.category.through)
+def invalidate_catalog_cache(sender, **kwargs):
+    # bulk QuerySet.update() bypasses signals; callers doing that must bump
+    # the catalog version themselves. Bumping after commit keeps readers from
+    # caching uncommitted state under the new version.
+    transaction.on_commit(bump_catalog_version)
@@ -1,3 +1,278 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+import pytest
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from docatho_backend.medicines import cache as cache_module
+from docatho_backend.medicines.models import (
+    Category,
+    Medicine,
+    MedicineRecommendation,
+    PopularityRun,
+)
+from docatho_backend.medicines.recommendations import (
+    build_cooccurrence,
+    get_also_bought,
+)
+from docatho_backend.orders.models import Order, OrderItem
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def api_client() -> APIClient:
+    return APIClient()
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    # ids are reused between tests, so catalog entries could leak across them
+    cache.clear()
+
+
+def test_bulk_prices(api_client: APIClient):
+    a = Medicine.objects.create(
+        name="A", price=Decimal("10.50"), mrp=Decimal("12.00"), stock=3
+    )
+    b = Medicine.objects.create(
+        name="B", price=Decimal("5.00"), mrp=Decimal("5.00"), is_active=False
+    )
+
+    with CaptureQueriesContext(connection) as ctx:
+        response = api_client.post(
+            "/api/medicines/prices/", {"ids": [a.pk, b.pk, 999999]}, format="json"
+        )
+
+    assert response.status_code == 200
+    assert len([q for q in ctx.captured_queries if q["sql"].startswith("SELECT")]) == 1
+    assert response.json() == {
+        str(a.pk): ["10.50", "12.00", 3, True],
+        str(b.pk): ["5.00", "5.00", 0, False],
+    }
+
+    response = api_client.get(f"/api/medicines/prices/?ids={a.pk}")
+    assert response.json() == {str(a.pk): ["10.50", "12.00", 3, True]}
+
+
+def _paid_order(user, medicine, quantity, placed_at, **fields):
+    order = Order.objects.create(
+        order_number=f"ORD{Order.objects.count()}",
+        user=user,
+        placed_at=placed_at,
+        **{"payment_status": Order.PaymentStatus.PAID, **fields},
+    )
+    OrderItem.objects.bulk_create(
+        [OrderItem(order=order, medicine=medicine, quantity=quantity)]
+    )
+    return order
+
+
+def test_refresh_popularity(user):
+    a = Medicine.objects.create(name="A", price=Decimal("10.00"))
+    b = Medicine.objects.create(name="B", price=Decimal("10.00"), popularity=5)
+    now = timezone.now()
+    _paid_order(user, a, 4, now - timedelta(days=14))
+    _paid_order(user, a, 100, now - timedelta(days=200))
+    late = _paid_order(
+        user, a, 3, now - timedelta(hours=1), payment_status=Order.PaymentStatus.PENDING
+    )
+
+    call_command("refresh_popularity", stdout=StringIO())
+    a.refresh_from_db()
+    b.refresh_from_db()
+    # 4 units at one half-life; the order outside the window is not counted
+    assert a.popularity == pytest.approx(2, abs=0.2)
+    assert b.popularity == 0
+
+    # paid after the previous run, though placed before it
+    Order.objects.filter(pk=late.pk).update(payment_status=Order.PaymentStatus.PAID)
+    call_command("refresh_popularity", stdout=StringIO())
+    a.refresh_from_db()
+    assert a.popularity == pytest.approx(5, abs=0.2)
+
+    Order.objects.filter(pk=late.pk).update(status=Order.Status.CANCELLED)
+    call_command("refresh_popularity", stdout=StringIO())
+    a.refresh_from_db()
+    assert a.popularity == pytest.approx(2, abs=0.2)
+    assert PopularityRun.objects.count() == 3
+
+
+def test_medicine_prices_read_the_catalog_version_once(settings, monkeypatch):
+    settings.MEDICINE_PRICE_CACHE_TIMEOUT = 60
+    ids = [
+        Medicine.objects.create(name=f"M{i}", price=Decimal("1.00")).pk
+        for i in range(5)
+    ]
+    reads = []
+    get_version = cache_module.get_catalog_version
+    monkeypatch.setattr(
+        cache_module,
+        "get_catalog_version",
+        lambda: reads.append(1) or get_version(),
+    )
+
+    assert set(cache_module.get_medicine_prices(ids)) == set(ids)
+    with CaptureQueriesContext(connection) as ctx:
+        assert set(cache_module.get_medicine_prices(ids)) == set(ids)
+    assert not ctx.captured_queries
+    assert len(reads) == 2
+
+
+def test_build_cooccurrence():
+    baskets = {
+        1: [10, 20, 20],  # a duplicate line
+        2: [10, 20, 30],
+        3: [10, 30],
+        4: [40],  # no pairs
+        5: [10, 20, 30, 40],  # over max_basket
+    }
+    rows = [(order_id, m) for order_id, medicines in baskets.items() for m in medicines]
+
+    assert build_cooccurrence(rows, top_k=5, max_basket=3) == {
+        10: [[20, 2], [30, 2]],
+        20: [[10, 2], [30, 1]],
+        30: [[10, 2], [20, 1]],
+    }
+    # ties are broken by the neighbour id
+    assert build_cooccurrence(rows, top_k=1, max_basket=3)[10] == [[20, 2]]
+    assert build_cooccurrence([], top_k=5, max_basket=3) == {}
+    assert build_cooccurrence([(1, 10)], top_k=5, max_basket=3) == {}
+
+
+def test_build_recommendations(user):
+    a, b, c = (
+        Medicine.objects.create(name=name, price=Decimal("1.00")) for name in "ABC"
+    )
+    now = timezone.now()
+    for medicines, fields in [
+        ([a, b], {}),
+        ([a, b, c], {}),
+        ([a, c], {"status": Order.Status.CANCELLED}),
+        ([b, c], {"payment_status": Order.PaymentStatus.PENDING}),
+    ]:
+        order = _paid_order(user, medicines[0], 1, now, **fields)
+        OrderItem.objects.bulk_create(
+            [OrderItem(order=order, medicine=m, quantity=1) for m in medicines[1:]]
+        )
+    MedicineRecommendation.objects.create(medicine=c, related=[[999, 1]])
+
+    call_command("build_recommendations", top_k=1, stdout=StringIO())
+
+    # only paid orders that were not cancelled count
+    stored = MedicineRecommendation.objects.values_list("medicine_id", "related")
+    assert dict(stored) == {
+        a.pk: [[b.pk, 2]],
+        b.pk: [[a.pk, 2]],
+        c.pk: [[a.pk, 1]],
+    }
+
+
+def test_get_also_bought():
+    a, b, c, d, inactive = (
+        Medicine.objects.create(name=name, price=Decimal("1.00"))
+        for name in ["A", "B", "C", "D", "E"]
+    )
+    Medicine.objects.filter(pk=inactive.pk).update(is_active=False)
+    MedicineRecommendation.objects.create(
+        medicine=a, related=[[inactive.pk, 9], [b.pk, 3], [c.pk, 1], [d.pk, 1]]
+    )
+    MedicineRecommendation.objects.create(medicine=b, related=[[a.pk, 3], [c.pk, 3]])
+
+    # counts are summed over the given medicines, which are left out
+    assert get_also_bought([a.pk, b.pk], limit=10) == [c.pk, d.pk]
+    assert get_also_bought([a.pk], limit=2) == [b.pk, c.pk]
+    with CaptureQueriesContext(connection) as ctx:
+        assert get_also_bought([a.pk], limit=10) == [b.pk, c.pk, d.pk]
+    assert not ctx.captured_queries
+
+
+def test_also_bought_view(api_client: APIClient):
+    a, b, c = (
+        Medicine.objects.create(name=name, price=Decimal("1.00")) for name in "ABC"
+    )
+    MedicineRecommendation.objects.create(medicine=a, related=[[b.pk, 2], [c.pk, 1]])
+
+    response = api_client.get(f"/api/medicines/{a.pk}/also-bought/?limit=-5")
+    assert response.status_code == 200
+    assert [m["id"] for m in response.json()] == [b.pk]
+    response = api_client.get(f"/api/medicines/{a.pk}/also-bought/")
+    assert [m["id"] for m in response.json()] == [b.pk, c.pk]
+    assert api_client.get("/api/medicines/abc/also-bought/").status_code == 404
+
+
+def test_category_paths_follow_moves():
+    root = Category.objects.create(name="Root")
+    child = Category.objects.create(name="Child", parent=root)
+    leaf = Category.objects.create(name="Leaf", parent=child)
+    other = Category.objects.create(name="Other")
+    assert (leaf.path, leaf.depth) == (f"{child.path}{leaf.pk:06d}/", 2)
+
+    # the whole subtree follows its root
+    child.parent = other
+    child.save()
+    leaf.refresh_from_db()
+    assert (child.path, child.depth) == (f"{other.path}{child.pk:06d}/", 1)
+    assert (leaf.path, leaf.depth) == (f"{child.path}{leaf.pk:06d}/", 2)
+    assert Category.objects.get(pk=root.pk).path == f"{root.pk:06d}/"
+
+    child.parent = None
+    child.save()
+    leaf.refresh_from_db()
+    assert (leaf.path, leaf.depth) == (f"{child.pk:06d}/{leaf.pk:06d}/", 1)
+
+
+def test_category_cannot_move_under_itself():
+    root = Category.objects.create(name="Root")
+    leaf = Category.objects.create(name="Leaf", parent=root)
+
+    for parent in (root, leaf):
+        root.parent = parent
+        with pytest.raises(ValueError):
+            root.save()
+    # nothing was written
+    root.refresh_from_db()
+    leaf.refresh_from_db()
+    assert root.parent_id is None
+    assert leaf.path == f"{root.pk:06d}/{leaf.pk:06d}/"
+
+
+def test_top_medicines_by_category():
+    pain = Category.objects.create(name="Pain")
+    cold = Category.objects.create(name="Cold")
+    hidden = Category.objects.create(name="Hidden", is_active=False)
+    a, b, c, d, off = (
+        Medicine.objects.create(name=name, price=Decimal("1.00"), popularity=score)
+        for name, score in [("A", 5), ("B", 9), ("C", 5), ("D", 1), ("Off", 99)]
+    )
+    Medicine.objects.filter(pk=off.pk).update(is_active=False)
+    for medicine in (a, b, c, d, off):
+        medicine.category.add(pain)
+    b.category.add(cold, hidden)
+
+    with CaptureQueriesContext(connection) as ctx:
+        top = cache_module.get_top_medicines_by_category(3)
+    assert len(ctx.captured_queries) == 1
+    # categories by name; ties on popularity go to the lower id
+    assert [
+        (group["category"]["id"], [m["id"] for m in group["medicines"]])
+        for group in top
+    ] == [(cold.pk, [b.pk]), (pain.pk, [b.pk, a.pk, c.pk])]
+    # at most n per category
+    pain_top = cache_module.get_top_medicines_by_category(1)[1]
+    assert [m["id"] for m in pain_top["medicines"]] == [b.pk]
+
+    # cached until the catalog version moves
+    Medicine.objects.filter(pk=d.pk).update(popularity=50)
+    with CaptureQueriesContext(connection) as ctx:
+        assert cache_module.get_top_medicines_by_category(3) == top
+    assert not ctx.captured_queries
+    cache_module.bump_catalog_version()
+    top = cache_module.get_top_medicines_by_category(3)
+    assert [m["id"] for m in top[1]["medicines"]] == [d.pk, b.pk, a.pk]
@@ -1,8 +1,21 @@
 from django.shortcuts import render
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
 
+from docatho_backend.medicines.cache import (
+    get_category_path,
+    get_medicine_prices,
+    get_top_medicines_by_category,
+)
 from docatho_backend.medicines.models import Category, Medicine
-from docatho_backend.medicines.serializers import CategorySerializer, MedicineSerializer
+from docatho_backend.medicines.recommendations import get_also_bought
+from docatho_backend.medicines.serializers import (
+    CategorySerializer,
+    MedicineIdListSerializer,
+    MedicineSerializer,
+)
 from rest_framework.pagination import PageNumberPagination
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
@@ -23,24 +36,125 @@ class CategoryViewset(viewsets.ModelViewSet):
     search_fields = ["name", "description"]
     ordering_fields = ["created_at", "updated_at", "name"]
 
+    @action(detail=False, methods=["get"], url_path="top-medicines")
+    def top_medicines(self, request):
+        """
+        Best selling medicines of every active category, for landing pages.
+        GET /api/medicines/categories/top-medicines/?n=5
+        """
+        try:
+            n = int(request.query_params.get("n", 5))
+        except ValueError:
+            n = 5
+        n = max(1, min(n, 20))
+        return Response(get_top_medicines_by_category(n))
+
 
 class MedicineViewset(viewsets.ModelViewSet):
     serializer_class = MedicineSerializer
     pagination_class = GenericPaginationClass
     queryset = Medicine.objects.all()
-    filter_backends = (DjangoFilterBackend, filters.SearchFilter)
+    filter_backends = (
+        DjangoFilterBackend,
+        filters.SearchFilter,
+        filters.OrderingFilter,
+    )
 
     filterset_fields = ["is_active", "name", "category"]
     search_fields = ["name", "manufacturer", "description"]
-    ordering_fields = ["created_at", "updated_at", "name", "price"]
+    ordering_fields = ["created_at", "updated_at", "name", "price", "popularity"]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # ?category_tree=<id> -> medicines in the category or any descendant
+        tree_id = self.request.query_params.get("category_tree")
+        if tree_id:
+            try:
+                path = get_category_path(int(tree_id))
+            except ValueError:
+                path = None
+            if path is None:
+                return queryset.none()
+            queryset = queryset.filter(category__path__startswith=path).distinct()
+        return queryset
+
+    @action(detail=False, methods=["get", "post"])
+    def prices(self, request):
+        """
+        Bulk price/availability lookup.
+        GET  /api/medicines/prices/?ids=1,2,3
+        POST /api/medicines/prices/  { ids: [1, 2, 3] }
+        -> { "<id>": [price, mrp, stock, is_active], ... }
+        Unknown ids are omitted from the response.
+        """
+        if request.method == "GET":
+            raw = request.query_params.get("ids", "")
+            data = {"ids": [i.strip() for i in raw.split(",") if i.strip()]}
+        else:
+            data = request.data
+        serializer = MedicineIdListSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data["ids"]))
+        return Response(get_medicine_prices(ids))
+
+    def _also_bought_response(self, medicine_ids):
+        try:
+            limit = int(self.request.query_params.get("limit", 10))
+        except ValueError:
+            limit = 10
+        limit = max(1, min(limit, 50))
+        ids = get_also_bought(medicine_ids, limit=limit)
+        medicines = Medicine.objects.filter(pk__in=ids).prefetch_related("category")
+        by_id = {m.pk: m for m in medicines}
+        ordered = [by_id[pk] for pk in ids if pk in by_id]
+        return Response(self.get_serializer(ordered, many=True).data)
+
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path="also-bought",
+        url_name="also-bought-detail",
+    )
+    def also_bought(self, request, pk=None):
+        """
+        Medicines frequently bought together with this one.
+        GET /api/medicines/<pk>/also-bought/?limit=10
+        """
+        try:
+            medicine_id = int(pk)
+        except ValueError:
+            raise NotFound()
+        return self._also_bought_response([medicine_id])
+
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path="also-bought",
+        url_name="also-bought-list",
+    )
+    def also_bought_for(self, request):
+        """
+        Medicines frequently bought together with any of the given ones (cart screen).
+        GET /api/medicines/also-bought/?ids=1,2,3&limit=10
+        """
+        raw = request.query_params.get("ids", "")
+        serializer = MedicineIdListSerializer(
+            data={"ids": [i.strip() for i in raw.split(",") if i.strip()]}
+        )
+        serializer.is_valid(raise_exception=True)
+        return self._also_bought_response(serializer.validated_data["ids"])
 
 
 class AdminMedicineViewset(viewsets.ModelViewSet):
     serializer_class = MedicineSerializer
     pagination_class = GenericPaginationClass
     queryset = Medicine.objects.all()
-    filter_backends = (DjangoFilterBackend, filters.SearchFilter)
+    filter_backends = (
+        DjangoFilterBackend,
+        filters.SearchFilter,
+        filters.OrderingFilter,
+    )
 
     filterset_fields = ["is_active", "name", "category"]
     search_fields = ["name", "manufacturer", "description"]
-    ordering_fields = ["created_at", "updated_at", "name", "price"]
+    ordering_fields = ["created_at", "updated_at", "name", "price", "popularity"]
@@ -1,7 +1,12 @@
 from django.contrib import admin
 
 
-from docatho_backend.orders.models import Order, OrderItem
+from docatho_backend.orders.models import (
+    DailySales,
+    Order,
+    OrderItem,
+    OutboxMessage,
+)
 
 
 @admin.register(Order)
@@ -19,3 +24,16 @@ class OrderItemAdmin(admin.ModelAdmin):
     ordering = ("-id",)
 
 
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ("id", "order", "topic", "status", "attempts", "available_at")
+    list_filter = ("status", "topic")
+    search_fields = ("order__order_number",)
+    ordering = ("-id",)
+
+
+@admin.register(DailySales)
+class DailySalesAdmin(admin.ModelAdmin):
+    list_display = ("day", "orders", "cancelled", "returned", "units", "gmv", "revenue")
+    date_hierarchy = "day"
+    ordering = ("-day",)
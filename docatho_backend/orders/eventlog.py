@@ -0,0 +1,182 @@
+"""
+Buffered OrderLog writing.
+
+Status changes queue their OrderLog rows here instead of inserting them in the
+request. Rows join the buffer when the change commits and are written by one
+flusher thread per process with a single bulk INSERT as soon as
+ORDER_LOG_BATCH_SIZE rows are waiting, and at least every
+ORDER_LOG_FLUSH_SECONDS otherwise. Whatever is still buffered is written at
+interpreter exit, so a worker that shuts down cleanly loses nothing; a killed
+process loses at most the rows of one interval. ``created_at`` of a row is the
+time the event was queued, so rows flushed late still sort in event order.
+
+While the database is unreachable rows are kept for later flushes, up to
+ORDER_LOG_MAX_ATTEMPTS each. A row that cannot be written for any other
+reason is written one by one apart from the rest of its batch. Rows given up
+on are logged as errors with their content ("dead letters").
+
+With settings.BACKGROUND_TASKS_EAGER rows are written as soon as they are queued.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import (
+    IntegrityError,
+    InterfaceError,
+    OperationalError,
+    close_old_connections,
+    transaction,
+)
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_buffer = []
+_buffer_lock = threading.Lock()
+# held for a whole flush, so the exit flush waits for one in progress
+_flush_lock = threading.Lock()
+_wakeup = threading.Event()
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def log_order_events(events) -> None:
+    """
+    Queue ``(order_id, message, meta)`` events for OrderLog, timestamped now.
+    They are dropped if the current transaction rolls back.
+    """
+    events = list(events)
+    if events:
+        now = timezone.now()
+        transaction.on_commit(lambda: _enqueue(events, now))
+
+
+def _enqueue(events, created_at=None) -> None:
+    from docatho_backend.orders.models import OrderLog
+
+    created_at = created_at or timezone.now()
+    logs = [
+        OrderLog(order_id=order_id, message=message, meta=meta, created_at=created_at)
+        for order_id, message, meta in events
+    ]
+    with _buffer_lock:
+        _buffer.extend(logs)
+        full = len(_buffer) >= settings.ORDER_LOG_BATCH_SIZE
+    if settings.BACKGROUND_TASKS_EAGER:
+        flush()
+        return
+    _start_flusher()
+    if full:
+        _wakeup.set()
+
+
+def flush() -> int:
+    """Write everything buffered now; returns the number of rows written."""
+    from docatho_backend.orders.models import OrderLog
+
+    with _flush_lock:
+        with _buffer_lock:
+            batch = _buffer[:]
+            _buffer.clear()
+        if not batch:
+            return 0
+        try:
+            with transaction.atomic():
+                OrderLog.objects.bulk_create(batch)
+            return len(batch)
+        except (OperationalError, InterfaceError):
+            logger.exception("Writing %d order logs failed, will retry", len(batch))
+            _requeue(batch)
+            return 0
+        except Exception:
+            # one bad row fails the whole INSERT; write the others one by one
+            logger.exception("Writing %d order logs failed", len(batch))
+
+        written = 0
+        for log in batch:
+            try:
+                with transaction.atomic():
+                    log.save()
+                written += 1
+            except (OperationalError, InterfaceError):
+                _requeue([log])
+            except IntegrityError as exc:
+                if not _is_foreign_key_violation(exc):
+                    _dead_letter(log)
+                    continue
+                logger.warning("Dropped log of missing order %s", log.order_id)
+            except Exception:
+                _dead_letter(log)
+        return written
+
+
+def _is_foreign_key_violation(exc) -> bool:
+    # SQLSTATE 23503 on PostgreSQL (psycopg 3 / psycopg2); sqlite has no code
+    cause = exc.__cause__
+    code = getattr(getattr(cause, "diag", None), "sqlstate", None) or getattr(
+        cause, "pgcode", None
+    )
+    if code:
+        return code == "23503"
+    return "FOREIGN KEY" in str(exc).upper()
+
+
+def _requeue(logs) -> None:
+    """Put rows back for the next flush, or drop them after too many tries."""
+    kept = []
+    for log in logs:
+        log._flush_attempts = getattr(log, "_flush_attempts", 0) + 1
+        if log._flush_attempts >= settings.ORDER_LOG_MAX_ATTEMPTS:
+            _dead_letter(log)
+        else:
+            kept.append(log)
+    with _buffer_lock:
+        _buffer[:0] = kept
+
+
+def _dead_letter(log) -> None:
+    logger.error(
+        "Dropped order log: order=%s created_at=%s message=%r meta=%r",
+        log.order_id,
+        log.created_at.isoformat(),
+        log.message,
+        log.meta,
+    )
+
+
+def _flush_at_exit() -> None:
+    """Last flush of the process: rows that still fail are dead-lettered."""
+    flush()
+    with _buffer_lock:
+        remaining = _buffer[:]
+        _buffer.clear()
+    for log in remaining:
+        _dead_letter(log)
+
+
+def _start_flusher() -> None:
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(
+                target=_flush_periodically, name="order-log-flusher", daemon=True
+            )
+            _flusher.start()
+
+
+def _flush_periodically() -> None:
+    while True:
+        _wakeup.wait(settings.ORDER_LOG_FLUSH_SECONDS)
+        _wakeup.clear()
+        close_old_connections()
+        try:
+            flush()
+        except Exception:
+            logger.exception("Order log flush failed")
+        finally:
+            close_old_connections()
+
+
+atexit.register(_flush_at_exit)
@@ -0,0 +1,168 @@
+"""
+``Idempotency-Key`` support for non-idempotent order actions.
+
+The first request with a given key (per user and action) runs normally and
+its response is stored; retries with the same key get the stored response
+back from one unique-index lookup, without running the action again.
+
+An action that commits its effect in its own transaction links the key to
+the order in that transaction (``bind_order``). If the request then dies
+before its response is stored, a retry after ORDER_IDEMPOTENCY_LEASE_SECONDS
+rebuilds the response from the order instead of running the action twice;
+a key left without an order is taken over and the action runs again.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+
+
+def _fingerprint(request) -> str:
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _claim(request, key, action):
+    """Returns (record, created); an expired record is replaced."""
+    fingerprint = _fingerprint(request)
+    expired_before = timezone.now() - timedelta(
+        hours=settings.ORDER_IDEMPOTENCY_KEY_TTL_HOURS
+    )
+    IdempotencyKey.objects.filter(
+        user=request.user, key=key, action=action, created_at__lt=expired_before
+    ).delete()
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(
+                user=request.user, key=key, action=action, fingerprint=fingerprint
+            )
+        return record, True
+    except IntegrityError:
+        record = IdempotencyKey.objects.get(user=request.user, key=key, action=action)
+        return record, False
+
+
+def bind_order(request, order) -> None:
+    """
+    Link the request's key to ``order``; call in the transaction that creates
+    the order. No-op for requests sent without the header.
+    """
+    record = getattr(request, "idempotency_key", None)
+    if record is not None:
+        IdempotencyKey.objects.filter(pk=record.pk).update(order=order)
+        record.order = order
+
+
+def not_replayed(response):
+    """
+    Mark ``response`` as an outcome that depends on state the client can
+    change (the cart), so a retry with the same key runs again.
+    """
+    response.idempotency_release = True
+    return response
+
+
+def _take_over(record) -> bool:
+    """Claim a stale in-progress key; False if another retry got it first."""
+    now = timezone.now()
+    taken = IdempotencyKey.objects.filter(
+        pk=record.pk, status_code=None, updated_at=record.updated_at
+    ).update(updated_at=now)
+    record.updated_at = now
+    return bool(taken)
+
+
+def _store(record, response) -> None:
+    record.status_code = response.status_code
+    # stored as rendered, so replays match the first response exactly
+    record.response = json.loads(JSONRenderer().render(response.data))
+    record.save(update_fields=["status_code", "response", "updated_at"])
+
+
+def _release(record) -> None:
+    """Forget a key whose request failed, unless its effect was committed."""
+    IdempotencyKey.objects.filter(pk=record.pk, order=None).delete()
+
+
+def idempotent(action, recover=None):
+    """
+    Decorator for ViewSet actions. Requests without the header are unaffected.
+    Must wrap views that do not run in ATOMIC_REQUESTS, so the key is visible
+    to concurrent retries while the first request is running.
+
+    Retries get the stored response (with ``Idempotent-Replayed: true``), 409
+    while the first request is still running, or 422 if the body differs.
+    5xx responses, exceptions and responses marked with ``not_replayed`` are
+    not stored, so those can be retried.
+    ``recover`` names the view method that rebuilds the response from the
+    order bound with ``bind_order``, for retries of a request that died after
+    committing.
+    """
+
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return view_method(self, request, *args, **kwargs)
+            if len(key) > 255:
+                return Response(
+                    {"detail": f"{HEADER} must be at most 255 characters"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            record, created = _claim(request, key, action)
+            if not created:
+                if record.fingerprint != _fingerprint(request):
+                    return Response(
+                        {"detail": f"{HEADER} was used with a different request"},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    )
+                if record.status_code is not None:
+                    response = Response(record.response, status=record.status_code)
+                    response["Idempotent-Replayed"] = "true"
+                    return response
+                lease = timedelta(seconds=settings.ORDER_IDEMPOTENCY_LEASE_SECONDS)
+                if record.updated_at > timezone.now() - lease or not _take_over(
+                    record
+                ):
+                    return Response(
+                        {"detail": "A request with this key is in progress"},
+                        status=status.HTTP_409_CONFLICT,
+                    )
+                if record.order_id is not None and recover is not None:
+                    # the first request committed, then died
+                    response = getattr(self, recover)(request, record.order)
+                    _store(record, response)
+                    response["Idempotent-Replayed"] = "true"
+                    return response
+
+            request.idempotency_key = record
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except Exception:
+                _release(record)
+                raise
+            if response.status_code >= 500 or getattr(
+                response, "idempotency_release", False
+            ):
+                _release(record)
+            else:
+                _store(record, response)
+            return response
+
+        return wrapper
+
+    return decorator
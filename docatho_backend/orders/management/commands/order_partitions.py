@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from docatho_backend.orders import partitions
+from docatho_backend.orders.models import OrderLog
+
+
+class Command(BaseCommand):
+    help = (
+        "Maintain the monthly partitions of orders_orderlog (PostgreSQL only, "
+        "see orders/partitions.py). --convert partitions the table once; then "
+        "run daily to create the partitions of the coming --ahead months and, "
+        "with --keep-months, detach older ones. Does nothing to an "
+        "unpartitioned table without --convert."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--convert",
+            action="store_true",
+            help="Partition the existing table (locks it while converting)",
+        )
+        parser.add_argument("--ahead", type=int, default=3)
+        parser.add_argument(
+            "--keep-months",
+            type=int,
+            default=None,
+            help="Detach partitions older than this many months",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Partitioning needs PostgreSQL")
+        table = OrderLog._meta.db_table
+        if not partitions.is_partitioned(table):
+            if not options["convert"]:
+                self.stdout.write(f"{table} is not partitioned; see --convert")
+                return
+            legacy = partitions.convert(OrderLog)
+            self.stdout.write(f"{table} partitioned; existing rows in {legacy}")
+        elif f"{table}_default" not in partitions.partitions(table):
+            # tables converted before the default partition was added
+            partitions.create_default_partition(OrderLog)
+
+        created = partitions.create_partitions(OrderLog, options["ahead"])
+        detached = []
+        if options["keep_months"] is not None:
+            detached = partitions.detach_partitions(OrderLog, options["keep_months"])
+        self.stdout.write(
+            f"Order log partitions maintained. created={len(created)} "
+            f"detached={len(detached)}"
+        )
+        for name in detached:
+            self.stdout.write(f"detached {name}; drop or archive it when done")
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from docatho_backend.orders.outbox import process_pending
+
+
+class Command(BaseCommand):
+    help = (
+        "Perform due order outbox messages (e.g. Razorpay order creation) that "
+        "were not completed right after checkout. Run periodically, or with "
+        "--loop as a long-running worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling instead of exiting when nothing is due",
+        )
+        parser.add_argument("--interval", type=float, default=1.0)
+
+    def handle(self, *args, **options):
+        processed = 0
+        while True:
+            count = process_pending(options["batch_size"])
+            processed += count
+            if not count:
+                if not options["loop"]:
+                    break
+                time.sleep(options["interval"])
+        self.stdout.write(f"Outbox processed. messages={processed}")
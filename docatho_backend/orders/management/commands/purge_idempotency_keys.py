@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from docatho_backend.orders.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Delete Idempotency-Key records older than ORDER_IDEMPOTENCY_KEY_TTL_HOURS."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(
+            hours=settings.ORDER_IDEMPOTENCY_KEY_TTL_HOURS
+        )
+        deleted = 0
+        while True:
+            ids = list(
+                IdempotencyKey.objects.filter(created_at__lt=cutoff).values_list(
+                    "pk", flat=True
+                )[: options["batch_size"]]
+            )
+            if not ids:
+                break
+            deleted += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
+        self.stdout.write(f"Idempotency keys purged. deleted={deleted}")
@@ -0,0 +1,74 @@
+from datetime import date, datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from docatho_backend.orders.models import (
+    DailyCategorySales,
+    DailyMedicineSales,
+    DailySales,
+    Order,
+)
+from docatho_backend.orders.rollups import record_sales_change
+
+UNPAID = (Order.Status.PLACED, Order.PaymentStatus.PENDING)
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the daily sales rollups from the orders, for every day or "
+        "from --since (YYYY-MM-DD) on. Run once after deploying the rollup "
+        "tables. Runs in one transaction, so reports never see a partial "
+        "rebuild."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", type=date.fromisoformat, default=None)
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        since = options["since"]
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+        # only orders that were paid contribute (see rollups.sales_state)
+        orders = Order.objects.filter(
+            payment_status__in=[
+                Order.PaymentStatus.PAID,
+                Order.PaymentStatus.REFUNDED,
+            ]
+        )
+        rollups = [DailySales, DailyMedicineSales, DailyCategorySales]
+
+        rebuilt = 0
+        with transaction.atomic():
+            if since is not None:
+                start = timezone.make_aware(datetime.combine(since, time.min))
+                orders = orders.filter(placed_at__gte=start)
+                for model in rollups:
+                    model.objects.filter(day__gte=since).delete()
+            else:
+                for model in rollups:
+                    model.objects.all().delete()
+
+            last_id = 0
+            while True:
+                batch = list(
+                    orders.filter(pk__gt=last_id)
+                    .order_by("pk")
+                    .values_list("pk", "status", "payment_status")[
+                        : options["batch_size"]
+                    ]
+                )
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+                states = {}
+                for pk, status, payment_status in batch:
+                    states.setdefault((status, payment_status), []).append(pk)
+                # the change from a new, unpaid order to the current state
+                for state, pks in states.items():
+                    record_sales_change(pks, UNPAID, state)
+                rebuilt += len(batch)
+
+        self.stdout.write(f"Sales rollups rebuilt. orders={rebuilt}")
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.9 on 2026-10-19 05:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0004_idempotencykey"),
+        ("users", "0007_alter_user_email_alter_user_phone"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["user", "-placed_at", "-id"], name="order_user_placed_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.9 on 2026-10-19 05:16
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+PREVIEW_ITEMS = 3
+
+
+def backfill_summary(apps, schema_editor):
+    Medicine = apps.get_model("medicines", "Medicine")
+    Order = apps.get_model("orders", "Order")
+    OrderItem = apps.get_model("orders", "OrderItem")
+    OrderItem.objects.update(
+        medicine_name=Subquery(
+            Medicine.objects.filter(pk=OuterRef("medicine_id")).values("name")[:1]
+        )
+    )
+    last_id = 0
+    while True:
+        orders = list(Order.objects.filter(pk__gt=last_id).order_by("pk")[:500])
+        if not orders:
+            break
+        last_id = orders[-1].pk
+        names = {}
+        for order_id, name in (
+            OrderItem.objects.filter(order__in=orders)
+            .order_by("order_id", "id")
+            .values_list("order_id", "medicine_name")
+        ):
+            names.setdefault(order_id, []).append(name)
+        for order in orders:
+            order.item_count = len(names.get(order.pk, []))
+            order.item_preview = names.get(order.pk, [])[:PREVIEW_ITEMS]
+        Order.objects.bulk_update(orders, ["item_count", "item_preview"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medicines", "0010_category_tree"),
+        ("orders", "0005_order_user_placed_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="item_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="item_preview",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name="orderitem",
+            name="medicine_name",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+        migrations.RunPython(backfill_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# BRIN indexes for time-range scans of the append-only order tables. They
+# are a few pages each, where a btree on the same column would grow with the
+# table. PostgreSQL only, and not part of the model state (Django has no
+# vendor-specific Meta indexes).
+
+from django.db import migrations
+
+INDEXES = [
+    ("order_placed_at_brin", "orders_order", "placed_at"),
+    ("orderitem_created_at_brin", "orders_orderitem", "created_at"),
+    ("transaction_created_at_brin", "orders_transaction", "created_at"),
+    ("orderlog_created_at_brin", "orders_orderlog", "created_at"),
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, table, column in INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" '
+            f'ON "{table}" USING brin ("{column}")'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, _, _ in INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction
+    atomic = False
+
+    dependencies = [
+        ("orders", "0007_sales_rollups"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
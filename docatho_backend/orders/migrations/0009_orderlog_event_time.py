@@ -0,0 +1,19 @@
+# Generated by Django 5.2.9 on 2026-10-19 05:36
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0008_brin_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="orderlog",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -2,12 +2,38 @@ from decimal import Decimal
 from typing import Optional
 
 from django.conf import settings
-from django.db import models, transaction
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models, transaction
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from docatho_backend.masters.models import BaseModel
-from docatho_backend.medicines.models import Medicine
+from docatho_backend.medicines.models import Category, Medicine
+
+from .eventlog import log_order_events
+from .rollups import record_sales_change
+
+
+class InvalidStatusTransition(ValueError):
+    """The requested status is unknown or not reachable from the current one."""
+
+
+class OrderStatusConflict(Exception):
+    """The order status was changed by another request since it was read."""
+
+
+def _status_change_event(order_id, old_status, new_status) -> tuple:
+    return (
+        order_id,
+        f"Status changed from {old_status} to {new_status}",
+        {"old_status": old_status, "new_status": new_status},
+    )
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_details(self):
+        """Everything OrderSerializer reads, in a fixed number of queries."""
+        return self.select_related("user", "address").prefetch_related("items")
 
 
 class Order(BaseModel):
@@ -26,6 +52,28 @@ class Order(BaseModel):
         FAILED = "failed", _("Failed")
         REFUNDED = "refunded", _("Refunded")
 
+    # status changes allowed by update_status and bulk_update_status
+    TRANSITIONS = {
+        Status.PLACED: {Status.CONFIRMED, Status.PROCESSING, Status.CANCELLED},
+        Status.CONFIRMED: {Status.PROCESSING, Status.CANCELLED},
+        Status.PROCESSING: {Status.OUT_FOR_DELIVERY, Status.CANCELLED},
+        Status.OUT_FOR_DELIVERY: {Status.DELIVERED, Status.RETURNED},
+        Status.DELIVERED: {Status.RETURNED},
+        Status.CANCELLED: set(),
+        Status.RETURNED: set(),
+    }
+
+    # a paid order moved to one of these is taken out of the sales rollups
+    REVERSING_STATUSES = {Status.CANCELLED, Status.RETURNED}
+    # set_payment_status retries when the order changes under it
+    PAYMENT_UPDATE_ATTEMPTS = 3
+
+    # per-order results of bulk_update_status
+    UPDATED = "updated"
+    NOT_FOUND = "not_found"
+    INVALID_TRANSITION = "invalid_transition"
+    CONFLICT = "conflict"
+
     order_number = models.CharField(max_length=64, unique=True, db_index=True)
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="orders"
@@ -67,15 +115,49 @@ class Order(BaseModel):
 
     notes = models.TextField(blank=True, null=True)
 
+    # read model for order lists, maintained with the totals (set_totals)
+    item_count = models.PositiveIntegerField(default=0)
+    item_preview = models.JSONField(default=list, blank=True)
+
+    PREVIEW_ITEMS = 3
+
+    objects = OrderQuerySet.as_manager()
+
     class Meta:
         ordering = ("-placed_at",)
+        indexes = [
+            # customer order history, keyset paginated on (placed_at, id)
+            models.Index(
+                fields=["user", "-placed_at", "-id"], name="order_user_placed_idx"
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"Order<{self.order_number}> user={self.user_id} status={self.status}"
 
     @transaction.atomic
     def recalc_totals(self) -> None:
-        items = self.items.all()
+        self.set_totals(self.items.order_by("id"))
+        self.save(
+            update_fields=[
+                "subtotal",
+                "total_mrp",
+                "discount_amount",
+                "total",
+                "item_count",
+                "item_preview",
+                "updated_at",
+            ]
+        )
+
+    def set_totals(self, items) -> None:
+        """
+        Compute the totals and the list summary (item count, first item
+        names) from ``items`` in memory, without saving.
+        """
+        items = list(items)
+        self.item_count = len(items)
+        self.item_preview = [it.medicine_name for it in items[: self.PREVIEW_ITEMS]]
         subtotal = Decimal("0.00")
         total_mrp = Decimal("0.00")
         for it in items:
@@ -93,43 +175,56 @@ class Order(BaseModel):
             + (self.delivery_fee or Decimal("0.00"))
             - self.discount_amount
         ).quantize(Decimal("0.01"))
-        self.save(
-            update_fields=[
-                "subtotal",
-                "total_mrp",
-                "discount_amount",
-                "total",
-                "updated_at",
-            ]
-        )
 
     @transaction.atomic
-    def update_status(self, new_status: str, notes: Optional[str] = None) -> None:
+    def update_status(
+        self,
+        new_status: str,
+        notes: Optional[str] = None,
+        expected_status: Optional[str] = None,
+    ) -> None:
         """
-        Update the order status with validation and automatic field updates.
+        Move the order to ``new_status`` with one conditional UPDATE, so a
+        concurrent change is detected instead of overwritten. No row lock is
+        taken.
 
         Args:
             new_status: The new status value (must be a valid Status choice)
             notes: Optional notes to add to the order
+            expected_status: The status the caller saw (defaults to self.status)
 
         Raises:
-            ValueError: If the new_status is not a valid Status choice
+            InvalidStatusTransition: If new_status is not a valid Status choice
+                or not allowed from the current status (nothing is written)
+            OrderStatusConflict: If the order is no longer in expected_status
         """
         # Validate status
         valid_statuses = [choice[0] for choice in self.Status.choices]
         if new_status not in valid_statuses:
-            raise ValueError(
+            raise InvalidStatusTransition(
                 f"Invalid status '{new_status}'. Must be one of: {', '.join(valid_statuses)}"
             )
+        old_status = expected_status or self.status
+        if new_status not in self.TRANSITIONS[old_status]:
+            raise InvalidStatusTransition(
+                f"Cannot change status from '{old_status}' to '{new_status}'"
+            )
 
-        old_status = self.status
-        self.status = new_status
+        changed = self._compare_and_set_status([self.pk], old_status, new_status, notes)
+        if not changed:
+            raise OrderStatusConflict(f"Order status is no longer '{old_status}'")
+        self.payment_status = changed[self.pk]
+        record_sales_change(
+            [self.pk],
+            (old_status, self.payment_status),
+            (new_status, self.payment_status),
+        )
 
-        # Auto-update delivered_at when status changes to DELIVERED
+        # mirror the UPDATE on this instance
+        self.status = new_status
+        self.updated_at = timezone.now()
         if new_status == self.Status.DELIVERED and not self.delivered_at:
-            self.delivered_at = timezone.now()
-
-        # Update notes if provided
+            self.delivered_at = self.updated_at
         if notes:
             existing_notes = self.notes or ""
             if existing_notes:
@@ -137,25 +232,136 @@ class Order(BaseModel):
             else:
                 self.notes = notes
 
-        # Save the order
-        update_fields = ["status", "updated_at"]
-        if new_status == self.Status.DELIVERED and self.delivered_at:
-            update_fields.append("delivered_at")
-        if notes:
-            update_fields.append("notes")
+        # written in batches after commit, off the request (see eventlog.py)
+        log_order_events([_status_change_event(self.pk, old_status, new_status)])
 
-        self.save(update_fields=update_fields)
+    @transaction.atomic
+    def set_payment_status(self, payment_status: str) -> None:
+        """
+        Record a payment outcome with an UPDATE conditional on the status and
+        payment status read just before, so the sales rollups get exactly the
+        difference; no row lock is taken first. A PLACED order that is paid
+        becomes CONFIRMED. FAILED never overwrites PAID: a late failure of an
+        earlier attempt must not undo a payment (refunds use REFUNDED).
 
-        # Create a log entry for status change
-        try:
-            OrderLog.objects.create(
-                order=self,
-                message=f"Status changed from {old_status} to {new_status}",
-                meta={"old_status": old_status, "new_status": new_status},
+        Raises:
+            OrderStatusConflict: If the order kept changing under the update
+        """
+        for _attempt in range(self.PAYMENT_UPDATE_ATTEMPTS):
+            status, old_payment_status = (
+                Order.objects.filter(pk=self.pk)
+                .values_list("status", "payment_status")
+                .get()
             )
-        except Exception:
-            # Don't fail if logging fails
-            pass
+            if old_payment_status == payment_status or (
+                old_payment_status == self.PaymentStatus.PAID
+                and payment_status == self.PaymentStatus.FAILED
+            ):
+                break
+            new_status = status
+            if (
+                payment_status == self.PaymentStatus.PAID
+                and status == self.Status.PLACED
+            ):
+                new_status = self.Status.CONFIRMED
+            if Order.objects.filter(
+                pk=self.pk, status=status, payment_status=old_payment_status
+            ).update(
+                status=new_status,
+                payment_status=payment_status,
+                updated_at=timezone.now(),
+            ):
+                record_sales_change(
+                    [self.pk],
+                    (status, old_payment_status),
+                    (new_status, payment_status),
+                )
+                break
+        else:
+            raise OrderStatusConflict("Order changed during the payment update")
+        self.refresh_from_db(fields=["status", "payment_status", "updated_at"])
+
+    @classmethod
+    @transaction.atomic
+    def bulk_update_status(
+        cls, order_ids, new_status: str, notes: Optional[str] = None, queryset=None
+    ) -> dict:
+        """
+        Move many orders to ``new_status``: one read of the current statuses
+        and one conditional UPDATE per distinct current status. The OrderLog
+        rows are queued for the buffered writer (see eventlog) when the
+        transaction commits. ``queryset`` restricts which orders may change.
+
+        Returns {order_id: UPDATED | NOT_FOUND | INVALID_TRANSITION | CONFLICT};
+        CONFLICT means the order changed status between the read and the write.
+        """
+        queryset = cls.objects.all() if queryset is None else queryset
+        current = dict(
+            queryset.filter(pk__in=order_ids).values_list("pk", "status")
+        )
+        results = {}
+        groups = {}
+        for pk in order_ids:
+            old_status = current.get(pk)
+            if old_status is None:
+                results[pk] = cls.NOT_FOUND
+            elif new_status not in cls.TRANSITIONS[old_status]:
+                results[pk] = cls.INVALID_TRANSITION
+            else:
+                groups.setdefault(old_status, []).append(pk)
+
+        events = []
+        for old_status, ids in groups.items():
+            updated = cls._compare_and_set_status(ids, old_status, new_status, notes)
+            for pk in ids:
+                results[pk] = cls.UPDATED if pk in updated else cls.CONFLICT
+            events += [
+                _status_change_event(pk, old_status, new_status)
+                for pk in sorted(updated)
+            ]
+            by_payment_status = {}
+            for pk, payment_status in updated.items():
+                by_payment_status.setdefault(payment_status, []).append(pk)
+            for payment_status, pks in by_payment_status.items():
+                record_sales_change(
+                    pks, (old_status, payment_status), (new_status, payment_status)
+                )
+        log_order_events(events)
+        return results
+
+    @classmethod
+    def _compare_and_set_status(
+        cls, order_ids, expected_status: str, new_status: str, notes=None
+    ) -> dict:
+        """
+        UPDATE ... SET status = new WHERE id IN (...) AND status = expected.
+        Returns {id: payment_status} of the changed rows, as of the UPDATE.
+        Takes no lock beforehand.
+        """
+        qn = connection.ops.quote_name
+        now = timezone.now()
+        assignments = [f"{qn('status')} = %s", f"{qn('updated_at')} = %s"]
+        params = [new_status, now]
+        if new_status == cls.Status.DELIVERED:
+            assignments.append(
+                f"{qn('delivered_at')} = COALESCE({qn('delivered_at')}, %s)"
+            )
+            params.append(now)
+        if notes:
+            assignments.append(
+                f"{qn('notes')} = CASE WHEN {qn('notes')} IS NULL "
+                f"OR {qn('notes')} = '' THEN %s ELSE {qn('notes')} || %s END"
+            )
+            params += [notes, f"\n\n{notes}"]
+        placeholders = ", ".join(["%s"] * len(order_ids))
+        sql = (
+            f"UPDATE {qn(cls._meta.db_table)} SET {', '.join(assignments)} "
+            f"WHERE {qn('id')} IN ({placeholders}) AND {qn('status')} = %s "
+            f"RETURNING {qn('id')}, {qn('payment_status')}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [*params, *order_ids, expected_status])
+            return dict(cursor.fetchall())
 
 
 class OrderItem(BaseModel):
@@ -163,6 +369,8 @@ class OrderItem(BaseModel):
     medicine = models.ForeignKey(
         Medicine, on_delete=models.PROTECT, related_name="order_items"
     )
+    # snapshot, so past orders keep the name they were placed with
+    medicine_name = models.CharField(max_length=255, blank=True, default="")
     quantity = models.PositiveIntegerField(default=1)
     # price snapshot at order time
     unit_price = models.DecimalField(
@@ -187,6 +395,8 @@ class OrderItem(BaseModel):
             self.unit_price = getattr(self.medicine, "price", Decimal("0.00"))
         if not self.mrp or self.mrp == Decimal("0.00"):
             self.mrp = getattr(self.medicine, "mrp", self.unit_price)
+        if not self.medicine_name:
+            self.medicine_name = self.medicine.name
         super().save(*args, **kwargs)
         try:
             self.order.recalc_totals()
@@ -226,6 +436,9 @@ class Transaction(BaseModel):
 
 
 class OrderLog(BaseModel):
+    # the time of the event, set when it is queued (see eventlog.py), not
+    # when the buffered row is written
+    created_at = models.DateTimeField(default=timezone.now)
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="logs")
     message = models.TextField()
     meta = models.JSONField(blank=True, null=True)
@@ -235,3 +448,136 @@ class OrderLog(BaseModel):
 
     def __str__(self) -> str:
         return f"OrderLog<{self.pk}> order={self.order_id} msg={self.message[:60]}"
+
+
+class OutboxMessage(BaseModel):
+    """
+    A side effect (e.g. a payment gateway call) recorded in the same
+    transaction as the order it belongs to and performed after commit by
+    orders.outbox.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "pending", _("Pending")
+        PROCESSING = "processing", _("Processing")
+        DONE = "done", _("Done")
+        FAILED = "failed", _("Failed")
+
+    TOPIC_RAZORPAY_ORDER = "razorpay.create_order"
+
+    order = models.ForeignKey(
+        Order, on_delete=models.CASCADE, related_name="outbox_messages"
+    )
+    topic = models.CharField(max_length=64)
+    status = models.CharField(
+        max_length=16, choices=Status.choices, default=Status.PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # next attempt for pending messages, lease expiry for processing ones
+    available_at = models.DateTimeField(default=timezone.now)
+    result = models.JSONField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default="")
+
+    class Meta:
+        ordering = ("available_at",)
+        indexes = [
+            models.Index(
+                fields=["status", "available_at"], name="outbox_status_available_idx"
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"OutboxMessage<{self.pk}> {self.topic} {self.status}"
+
+
+class IdempotencyKey(BaseModel):
+    """
+    First response to a request sent with an ``Idempotency-Key`` header, replayed
+    to retries of the same request (see orders.idempotency). ``response`` is null
+    while the first request is still running, or after it died.
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="idempotency_keys",
+    )
+    key = models.CharField(max_length=255)
+    action = models.CharField(max_length=64)
+    # sha256 of the request body; a key reused with another body is rejected
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    # set in the transaction that creates the order, so a request that dies
+    # after committing is recovered from it instead of being run again
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "key", "action"], name="idempotency_key_unique"
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"IdempotencyKey<{self.key}> {self.action} user={self.user_id}"
+
+
+class DailySales(BaseModel):
+    """
+    Paid orders by local date of placement, net of later cancellations and
+    returns. Maintained by orders.rollups as orders change.
+    """
+
+    day = models.DateField(unique=True)
+    orders = models.IntegerField(default=0)
+    cancelled = models.IntegerField(default=0)
+    returned = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    # sum of order subtotals, discounts and totals
+    gmv = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    discount = models.DecimalField(
+        max_digits=14, decimal_places=2, default=Decimal("0.00")
+    )
+    revenue = models.DecimalField(
+        max_digits=14, decimal_places=2, default=Decimal("0.00")
+    )
+
+    def __str__(self) -> str:
+        return f"DailySales<{self.day}> orders={self.orders} gmv={self.gmv}"
+
+
+class DailyMedicineSales(BaseModel):
+    day = models.DateField()
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name="+")
+    units = models.IntegerField(default=0)
+    gmv = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "medicine"], name="daily_medicine_sales_unique"
+            ),
+        ]
+
+
+class DailyCategorySales(BaseModel):
+    """A medicine in several categories counts towards each of them."""
+
+    day = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="+")
+    units = models.IntegerField(default=0)
+    gmv = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "category"], name="daily_category_sales_unique"
+            ),
+        ]
@@ -0,0 +1,132 @@
+"""
+Transactional outbox for order side effects.
+
+Checkout records an OutboxMessage in the transaction that creates the order,
+so the slow gateway call never runs inside a database transaction. After
+commit the message is processed (``process_message``); messages that fail or
+are lost with their worker are retried by ``manage.py process_outbox``.
+
+A message is claimed by moving it to PROCESSING with a lease in a short
+``SELECT ... FOR UPDATE SKIP LOCKED`` transaction; the handler then runs with
+no transaction open and the outcome is written in another short one.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OutboxMessage
+from .razorpay import RazorpayClient
+
+logger = logging.getLogger(__name__)
+
+# longer than any handler may take (the gateway timeout is 15s); a message
+# still PROCESSING after this is assumed lost and claimed again
+LEASE = timedelta(seconds=60)
+
+
+def create_razorpay_order(message) -> dict:
+    order = message.order
+    # a previous attempt may have succeeded before its outcome was recorded
+    existing = (
+        order.transactions.exclude(transaction_order_id=None)
+        .order_by("created_at")
+        .first()
+    )
+    if existing is not None:
+        return existing.raw_response
+    return RazorpayClient().create_order(order)
+
+
+HANDLERS = {
+    OutboxMessage.TOPIC_RAZORPAY_ORDER: create_razorpay_order,
+}
+
+
+def enqueue(order, topic) -> OutboxMessage:
+    """Record a message; call inside the transaction that changes ``order``."""
+    return OutboxMessage.objects.create(order=order, topic=topic)
+
+
+def _claim(limit, pk=None) -> list:
+    now = timezone.now()
+    with transaction.atomic():
+        messages = (
+            OutboxMessage.objects.select_for_update(skip_locked=True, of=("self",))
+            .select_related("order")
+            .filter(
+                status__in=[
+                    OutboxMessage.Status.PENDING,
+                    OutboxMessage.Status.PROCESSING,
+                ],
+                available_at__lte=now,
+            )
+            .order_by("available_at")
+        )
+        if pk is not None:
+            messages = messages.filter(pk=pk)
+        messages = list(messages[:limit])
+        for message in messages:
+            message.status = OutboxMessage.Status.PROCESSING
+            message.attempts += 1
+            message.available_at = now + LEASE
+            message.updated_at = now
+        OutboxMessage.objects.bulk_update(
+            messages, ["status", "attempts", "available_at", "updated_at"]
+        )
+    return messages
+
+
+def _run(message) -> None:
+    try:
+        result = HANDLERS[message.topic](message)
+    except Exception as exc:
+        logger.warning("Outbox message %s failed: %s", message.pk, exc)
+        message.last_error = str(exc)
+        if message.attempts >= settings.ORDER_OUTBOX_MAX_ATTEMPTS:
+            message.status = OutboxMessage.Status.FAILED
+        else:
+            message.status = OutboxMessage.Status.PENDING
+            message.available_at = timezone.now() + timedelta(
+                seconds=2**message.attempts
+            )
+    else:
+        message.status = OutboxMessage.Status.DONE
+        message.result = result
+    with transaction.atomic():
+        message.save(
+            update_fields=[
+                "status",
+                "available_at",
+                "result",
+                "last_error",
+                "updated_at",
+            ]
+        )
+        if (
+            message.status == OutboxMessage.Status.FAILED
+            and message.topic == OutboxMessage.TOPIC_RAZORPAY_ORDER
+        ):
+            message.order.set_payment_status(Order.PaymentStatus.FAILED)
+
+
+def process_message(pk) -> OutboxMessage | None:
+    """
+    Process one message now if it is due and not held by another worker.
+    Must be called outside a transaction. Returns the processed message.
+    """
+    messages = _claim(1, pk=pk)
+    if not messages:
+        return None
+    _run(messages[0])
+    return messages[0]
+
+
+def process_pending(limit=100) -> int:
+    """Process up to ``limit`` due messages; returns how many were processed."""
+    messages = _claim(limit)
+    for message in messages:
+        _run(message)
+    return len(messages)
@@ -1,7 +1,82 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class GenericPaginationClass(pagination.PageNumberPagination):
     page_size = 10
     page_size_query_param = "page_size"
     max_page_size = 100
+
+
+class OrderHistoryPagination(pagination.BasePagination):
+    """
+    Keyset pagination over (placed_at, id), newest first. The cursor is the
+    key of the last row of the previous page, so every page is an index range
+    scan (see the order_user_placed_idx index) whatever its depth.
+    """
+
+    page_size = 10
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            placed_at, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(placed_at__lt=placed_at) | Q(placed_at=placed_at, pk__lt=pk)
+            )
+        rows = list(queryset.order_by("-placed_at", "-id")[: self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        self.last = rows[-1] if rows else None
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def encode_cursor(self, order) -> str:
+        raw = f"{order.placed_at.isoformat()}|{order.pk}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+            placed_at, pk = raw.rsplit("|", 1)
+            return datetime.fromisoformat(placed_at), int(pk)
+        except (ValueError, UnicodeDecodeError):
+            raise NotFound("Invalid cursor")
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.last)
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
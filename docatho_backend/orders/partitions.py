@@ -0,0 +1,246 @@
+"""
+Optional monthly range partitioning of OrderLog on PostgreSQL.
+
+OrderLog is append-only, nothing references it and it is read by order or by
+time, so it is split into one partition per local calendar month of
+``created_at`` (``orders_orderlog_p202610`` ...). ``convert`` turns the
+existing table into the partition holding every row up to the end of the
+current month, without copying them. A DEFAULT partition catches rows of
+any month whose partition is missing. ``manage.py order_partitions`` runs the
+conversion once and, run daily, keeps partitions for the coming months (moving
+rows the default partition caught into them) and detaches old ones, which
+remain as plain tables for archiving or dropping.
+
+Order, OrderItem and Transaction stay unpartitioned: PostgreSQL requires the
+partition key in every primary key and unique constraint, so the foreign keys
+to orders_order(id) could not be kept, and the lookups of items and
+transactions by order or gateway id would have to visit every partition.
+Their time-range scans use the BRIN indexes of migration 0008 instead.
+"""
+import logging
+import re
+from datetime import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def _qn(name) -> str:
+    return connection.ops.quote_name(name)
+
+
+def month_start(day) -> datetime:
+    """Local midnight of the first day of ``day``'s month, as an aware datetime."""
+    return timezone.make_aware(datetime(day.year, day.month, 1))
+
+
+def add_months(start, months) -> datetime:
+    month = start.month - 1 + months
+    return month_start(datetime(start.year + month // 12, month % 12 + 1, 1))
+
+
+def partition_name(table, start) -> str:
+    return f"{table}_p{start:%Y%m}"
+
+
+def is_partitioned(table) -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c "
+            "ON c.oid = p.partrelid WHERE c.relname = %s",
+            [table],
+        )
+        return cursor.fetchone() is not None
+
+
+def partitions(table) -> list:
+    """Names of the attached partitions of ``table``, oldest month first."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s ORDER BY c.relname",
+            [table],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+@transaction.atomic
+def convert(model, column="created_at") -> str:
+    """
+    Replace ``model``'s table with one partitioned by month on ``column``.
+    The old table is renamed ``<table>_legacy`` and attached as the partition
+    for everything before next month. Takes an exclusive lock on the table
+    for the duration. Returns the legacy partition name.
+    """
+    table = model._meta.db_table
+    legacy = f"{table}_legacy"
+    cutoff = add_months(month_start(timezone.localdate()), 1)
+    pk = model._meta.pk.column
+    with connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {_qn(table)} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(f"ALTER TABLE {_qn(table)} RENAME TO {_qn(legacy)}")
+        # a partition may not own an identity column; the parent gets a new one
+        cursor.execute(
+            f"ALTER TABLE {_qn(legacy)} ALTER COLUMN {_qn(pk)} DROP IDENTITY IF EXISTS"
+        )
+        cursor.execute(f"ALTER TABLE {_qn(legacy)} ALTER COLUMN {_qn(pk)} DROP DEFAULT")
+        cursor.execute(
+            f"CREATE TABLE {_qn(table)} (LIKE {_qn(legacy)} INCLUDING DEFAULTS) "
+            f"PARTITION BY RANGE ({_qn(column)})"
+        )
+        cursor.execute(
+            f"ALTER TABLE {_qn(table)} ALTER COLUMN {_qn(pk)} "
+            f"ADD GENERATED BY DEFAULT AS IDENTITY"
+        )
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, %s), "
+            f"COALESCE((SELECT MAX({_qn(pk)}) FROM {_qn(legacy)}), 0) + 1, false)",
+            [table, pk],
+        )
+        # the partition key must be part of the primary key
+        cursor.execute(
+            f"ALTER TABLE {_qn(table)} ADD CONSTRAINT {_qn(f'{table}_part_pkey')} "
+            f"PRIMARY KEY ({_qn(pk)}, {_qn(column)})"
+        )
+        for field in model._meta.concrete_fields:
+            if field.is_relation:
+                remote = field.target_field
+                cursor.execute(
+                    f"ALTER TABLE {_qn(table)} ADD CONSTRAINT "
+                    f"{_qn(f'{table}_{field.column}_part_fk')} "
+                    f"FOREIGN KEY ({_qn(field.column)}) REFERENCES "
+                    f"{_qn(remote.model._meta.db_table)} ({_qn(remote.column)}) "
+                    f"DEFERRABLE INITIALLY DEFERRED"
+                )
+                cursor.execute(
+                    f"CREATE INDEX {_qn(f'{table}_{field.column}_part')} "
+                    f"ON {_qn(table)} ({_qn(field.column)})"
+                )
+        cursor.execute(
+            f"CREATE INDEX {_qn(f'{table}_{column}_brin_part')} "
+            f"ON {_qn(table)} USING brin ({_qn(column)})"
+        )
+        cursor.execute(
+            f"ALTER TABLE {_qn(table)} ATTACH PARTITION {_qn(legacy)} "
+            f"FOR VALUES FROM (MINVALUE) TO (%s)",
+            [cutoff],
+        )
+    create_default_partition(model)
+    return legacy
+
+
+def create_default_partition(model) -> None:
+    """
+    Catches rows of months whose partition was not created in time, so
+    inserts never fail; create_partitions moves them out again.
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {_qn(f'{table}_default')} "
+            f"PARTITION OF {_qn(table)} DEFAULT"
+        )
+
+
+def create_partitions(model, months_ahead=3, column="created_at") -> list:
+    """
+    Create the missing partitions from the current month through
+    ``months_ahead`` months after it. Rows the DEFAULT partition caught
+    because their month had no partition yet are moved into it. Returns the
+    names created.
+    """
+    table = model._meta.db_table
+    existing = set(partitions(table))
+    default = f"{table}_default"
+    legacy_end = _legacy_upper_bound(table)
+    first = month_start(timezone.localdate())
+    created = []
+    for i in range(months_ahead + 1):
+        lower = add_months(first, i)
+        name = partition_name(table, lower)
+        if name in existing or (legacy_end is not None and lower < legacy_end):
+            continue
+        _create_partition(
+            table,
+            name,
+            lower,
+            add_months(lower, 1),
+            column,
+            default if default in existing else None,
+        )
+        created.append(name)
+    return created
+
+
+def _legacy_upper_bound(table):
+    """Where the ``_legacy`` partition made by ``convert`` ends, if any."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_get_expr(relpartbound, oid) FROM pg_class WHERE relname = %s",
+            [f"{table}_legacy"],
+        )
+        row = cursor.fetchone()
+    match = row and re.search(r"TO \('([^']+)'\)", row[0] or "")
+    return datetime.fromisoformat(match.group(1)) if match else None
+
+
+@transaction.atomic
+def _create_partition(table, name, lower, upper, column, default) -> None:
+    in_range = f"{_qn(column)} >= %s AND {_qn(column)} < %s"
+    with connection.cursor() as cursor:
+        stray = False
+        if default is not None:
+            cursor.execute(
+                f"SELECT 1 FROM {_qn(default)} WHERE {in_range} LIMIT 1",
+                [lower, upper],
+            )
+            stray = cursor.fetchone() is not None
+        if not stray:
+            cursor.execute(
+                f"CREATE TABLE {_qn(name)} PARTITION OF {_qn(table)} "
+                f"FOR VALUES FROM (%s) TO (%s)",
+                [lower, upper],
+            )
+            return
+        logger.warning(
+            "%s holds rows for %s: partitions were not created in time", default, name
+        )
+        # a partition cannot be added while the default holds rows in its range
+        cursor.execute(f"ALTER TABLE {_qn(table)} DETACH PARTITION {_qn(default)}")
+        cursor.execute(
+            f"CREATE TABLE {_qn(name)} PARTITION OF {_qn(table)} "
+            f"FOR VALUES FROM (%s) TO (%s)",
+            [lower, upper],
+        )
+        cursor.execute(
+            f"INSERT INTO {_qn(name)} SELECT * FROM {_qn(default)} WHERE {in_range}",
+            [lower, upper],
+        )
+        cursor.execute(f"DELETE FROM {_qn(default)} WHERE {in_range}", [lower, upper])
+        cursor.execute(
+            f"ALTER TABLE {_qn(table)} ATTACH PARTITION {_qn(default)} DEFAULT"
+        )
+
+
+def detach_partitions(model, keep_months) -> list:
+    """
+    Detach the monthly partitions ending more than ``keep_months`` months ago.
+    The ``_legacy`` partition is left alone. Returns the names detached.
+    """
+    table = model._meta.db_table
+    oldest_kept = partition_name(
+        table, add_months(month_start(timezone.localdate()), -keep_months)
+    )
+    detached = []
+    with connection.cursor() as cursor:
+        for name in partitions(table):
+            if name.startswith(f"{table}_p") and name < oldest_kept:
+                cursor.execute(
+                    f"ALTER TABLE {_qn(table)} DETACH PARTITION {_qn(name)}"
+                )
+                detached.append(name)
+    return detached
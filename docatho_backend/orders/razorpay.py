@@ -94,8 +94,10 @@ class RazorpayClient:
         Updates linked Order.payment_status to PAID.
         Raises ValueError on verification failure or if matching transaction/order not found.
         """
+        # no row locks: concurrent confirmations (client and webhook) write the
+        # same values, and the order is moved with a conditional UPDATE
         tr = (
-            Transaction.objects.select_for_update()
+            Transaction.objects.select_related("order")
             .filter(transaction_order_id=razorpay_order_id)
             .first()
         )
@@ -142,10 +144,7 @@ class RazorpayClient:
         )
 
         # update order
-        order = tr.order
-        order.payment_status = order.PaymentStatus.PAID
-        order.status = order.Status.CONFIRMED
-        order.save(update_fields=["payment_status", "status", "updated_at"])
+        tr.order.set_payment_status(Order.PaymentStatus.PAID)
 
         return tr
 
@@ -212,10 +211,8 @@ class RazorpayClient:
             # update order status
             if tr and tr.order:
                 if event == "payment.captured":
-                    tr.order.payment_status = tr.order.PaymentStatus.PAID
-                    tr.order.status = tr.order.Status.CONFIRMED
+                    tr.order.set_payment_status(Order.PaymentStatus.PAID)
                 elif event == "payment.failed":
-                    tr.order.payment_status = tr.order.PaymentStatus.FAILED
-                tr.order.save(update_fields=["payment_status", "status", "updated_at"])
+                    tr.order.set_payment_status(Order.PaymentStatus.FAILED)
 
         return payload
@@ -0,0 +1,152 @@
+"""
+Daily sales rollups (DailySales, DailyMedicineSales, DailyCategorySales),
+kept current as orders change so reports read O(days) rows instead of
+aggregating the order history.
+
+What an order contributes is a function of its (status, payment_status)
+alone, see sales_state: it is counted while it is paid and neither cancelled
+nor returned, on the local date it was placed, and counted as cancelled or
+returned once it has been paid and is cancelled or returned. Every change of
+either field applies the difference between the two states
+(record_sales_change) in the transaction of the conditional UPDATE that made
+the change, so each change is counted once and ``manage.py
+rebuild_sales_rollups``, which applies the same function to the current
+orders, gives the same figures.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection
+from django.utils import timezone
+
+
+def sales_state(status, payment_status) -> tuple:
+    """
+    (counted in the sales figures, Order.Status.CANCELLED/RETURNED if counted
+    in DailySales.cancelled/returned else None) for an order in this state.
+    """
+    from docatho_backend.orders.models import Order
+
+    paid = payment_status == Order.PaymentStatus.PAID
+    was_paid = paid or payment_status == Order.PaymentStatus.REFUNDED
+    reversed_ = status in Order.REVERSING_STATUSES
+    return paid and not reversed_, status if was_paid and reversed_ else None
+
+
+def record_sales_change(order_ids, before, after) -> None:
+    """
+    Apply to the rollups the move of ``order_ids`` from the ``before`` to the
+    ``after`` (status, payment_status) state.
+    """
+    counted_before, reversal_before = sales_state(*before)
+    counted_after, reversal_after = sales_state(*after)
+    reasons = {}
+    if reversal_before != reversal_after:
+        if reversal_before:
+            reasons[reversal_before] = -1
+        if reversal_after:
+            reasons[reversal_after] = 1
+    sign = int(counted_after) - int(counted_before)
+    if sign or reasons:
+        record_sales(order_ids, sign=sign, reasons=reasons)
+
+
+def record_sales(order_ids, sign=1, reasons=None) -> None:
+    """
+    Add (``sign=1``) or remove (``sign=-1``) ``order_ids`` from the rollups in
+    three reads and at most three upserts. ``reasons`` maps
+    Order.Status.CANCELLED/RETURNED to the change of that day's count.
+    """
+    from docatho_backend.medicines.models import Medicine
+    from docatho_backend.orders.models import (
+        DailyCategorySales,
+        DailyMedicineSales,
+        DailySales,
+        Order,
+        OrderItem,
+    )
+
+    days = {}
+    daily = defaultdict(
+        lambda: {
+            "orders": 0,
+            "cancelled": 0,
+            "returned": 0,
+            "units": 0,
+            "gmv": Decimal("0.00"),
+            "discount": Decimal("0.00"),
+            "revenue": Decimal("0.00"),
+        }
+    )
+    for pk, placed_at, subtotal, discount, total in Order.objects.filter(
+        pk__in=order_ids
+    ).values_list("pk", "placed_at", "subtotal", "discount_amount", "total"):
+        day = days[pk] = timezone.localdate(placed_at)
+        row = daily[(day,)]
+        row["orders"] += sign
+        row["gmv"] += sign * subtotal
+        row["discount"] += sign * discount
+        row["revenue"] += sign * total
+        for reason, change in (reasons or {}).items():
+            row[reason] += change
+    if not days:
+        return
+    if not sign:
+        _upsert(DailySales, ["day"], daily)
+        return
+
+    medicines = defaultdict(lambda: {"units": 0, "gmv": Decimal("0.00")})
+    for order_id, medicine_id, quantity, unit_price in OrderItem.objects.filter(
+        order_id__in=days
+    ).values_list("order_id", "medicine_id", "quantity", "unit_price"):
+        day = days[order_id]
+        daily[(day,)]["units"] += sign * quantity
+        row = medicines[(day, medicine_id)]
+        row["units"] += sign * quantity
+        # OrderItem.line_total
+        row["gmv"] += sign * unit_price * quantity
+
+    categories_of = defaultdict(list)
+    for medicine_id, category_id in Medicine.category.through.objects.filter(
+        medicine_id__in={medicine_id for _, medicine_id in medicines}
+    ).values_list("medicine_id", "category_id"):
+        categories_of[medicine_id].append(category_id)
+    categories = defaultdict(lambda: {"units": 0, "gmv": Decimal("0.00")})
+    for (day, medicine_id), line in medicines.items():
+        for category_id in categories_of[medicine_id]:
+            row = categories[(day, category_id)]
+            row["units"] += line["units"]
+            row["gmv"] += line["gmv"]
+
+    _upsert(DailySales, ["day"], daily)
+    _upsert(DailyMedicineSales, ["day", "medicine_id"], medicines)
+    _upsert(DailyCategorySales, ["day", "category_id"], categories)
+
+
+def _upsert(model, keys, rows) -> None:
+    """INSERT ... ON CONFLICT (keys) DO UPDATE adding each delta to the row."""
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    columns = list(next(iter(rows.values())))
+    names = [*keys, *columns, "created_at", "updated_at"]
+    now = timezone.now()
+    values = []
+    params = []
+    # a fixed row order, so concurrent upserts cannot deadlock
+    for key, deltas in sorted(rows.items()):
+        values.append(f"({', '.join(['%s'] * len(names))})")
+        params += [*key, *(deltas[column] for column in columns), now, now]
+    increments = ", ".join(
+        f"{qn(column)} = {table}.{qn(column)} + EXCLUDED.{qn(column)}"
+        for column in columns
+    )
+    sql = (
+        f"INSERT INTO {table} ({', '.join(qn(name) for name in names)}) "
+        f"VALUES {', '.join(values)} "
+        f"ON CONFLICT ({', '.join(qn(key) for key in keys)}) DO UPDATE SET "
+        f"{increments}, {qn('updated_at')} = EXCLUDED.{qn('updated_at')}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
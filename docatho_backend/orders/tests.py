@@ -1,3 +1,573 @@
-from django.test import TestCase
+import hashlib
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+import pytest
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from docatho_backend.cart.models import Cart
+from docatho_backend.medicines.models import Category, Medicine
+from docatho_backend.orders import eventlog, partitions
+from docatho_backend.orders.eventlog import log_order_events
+from docatho_backend.orders.models import (
+    IdempotencyKey,
+    InvalidStatusTransition,
+    Order,
+    OrderItem,
+    OrderLog,
+    OrderStatusConflict,
+    OutboxMessage,
+)
+from docatho_backend.orders.razorpay import RazorpayClient
+from docatho_backend.providers.models import Provider
+from docatho_backend.users.tests.factories import UserFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    def create_order(self, order, receipt=None, notes=None):
+        return {"id": f"order_{order.order_number}", "amount": int(order.total * 100)}
+
+    monkeypatch.setattr(RazorpayClient, "create_order", create_order)
+
+
+def _query_count(ctx):
+    return len([q for q in ctx.captured_queries if "SAVEPOINT" not in q["sql"]])
+
+
+def _checkout_queries(user, lines):
+    cart, _ = Cart.objects.get_or_create(user=user)
+    cart.clear()
+    for i in range(lines):
+        medicine = Medicine.objects.create(
+            name=f"M{lines}-{i}", price=Decimal("10.00"), mrp=Decimal("12.00"), stock=5
+        )
+        cart.add_item(medicine, quantity=2)
+    client = APIClient()
+    client.force_authenticate(user)
+
+    with CaptureQueriesContext(connection) as ctx:
+        response = client.post("/api/orders/checkout/", {})
+    assert response.status_code == 201
+    order = Order.objects.get(pk=response.json()["order"]["id"])
+    assert order.items.count() == lines
+    assert order.subtotal == Decimal("20.00") * lines
+    assert order.discount_amount == Decimal("3.00") * lines
+    assert order.total == Decimal("17.00") * lines
+    return _query_count(ctx)
+
+
+def test_checkout_query_count_is_flat(user, gateway):
+    # a fixed number of queries however many lines the cart has
+    assert _checkout_queries(user, 1) == _checkout_queries(user, 30)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_checkout_calls_gateway_outside_transaction(user, monkeypatch):
+    calls = []
+
+    def create_order(self, order, receipt=None, notes=None):
+        # the order is committed and no transaction is held during the call
+        assert not connection.in_atomic_block
+        calls.append(order.pk)
+        if len(calls) == 1:
+            raise ConnectionError("gateway timeout")
+        return {"id": "order_rp_1"}
+
+    monkeypatch.setattr(RazorpayClient, "create_order", create_order)
+    Cart.objects.create(user=user).add_item(
+        Medicine.objects.create(name="A", price=Decimal("10.00"), stock=5)
+    )
+    client = APIClient()
+    client.force_authenticate(user)
+
+    response = client.post("/api/orders/checkout/", {})
+    assert response.status_code == 202
+    assert response.json()["payment_session"]["status"] == "pending"
+    order_id = response.json()["order"]["id"]
+
+    OutboxMessage.objects.update(available_at=timezone.now())
+    call_command("process_outbox")
+
+    response = client.get(f"/api/orders/{order_id}/payment-session/")
+    assert response.json() == {
+        "status": "done",
+        "razorpay_order": {"id": "order_rp_1"},
+        "error": None,
+    }
+    assert calls == [order_id, order_id]
+
+
+def test_checkout_idempotency_key(user, gateway):
+    cart = Cart.objects.create(user=user)
+    cart.add_item(Medicine.objects.create(name="A", price=Decimal("10.00"), stock=5))
+    client = APIClient()
+    client.force_authenticate(user)
+
+    first = client.post("/api/orders/checkout/", {}, HTTP_IDEMPOTENCY_KEY="k1")
+    with CaptureQueriesContext(connection) as ctx:
+        retry = client.post("/api/orders/checkout/", {}, HTTP_IDEMPOTENCY_KEY="k1")
+
+    assert first.status_code == retry.status_code == 201
+    assert retry["Idempotent-Replayed"] == "true"
+    assert retry.json() == first.json()
+    assert Order.objects.count() == 1
+    assert not [q for q in ctx.captured_queries if "orders_order" in q["sql"]]
+
+    other = client.post(
+        "/api/orders/checkout/", {"notes": "x"}, HTTP_IDEMPOTENCY_KEY="k1"
+    )
+    assert other.status_code == 422
+
+
+def test_checkout_idempotency_key_recovers_after_a_crash(user, gateway, monkeypatch):
+    cart = Cart.objects.create(user=user)
+    cart.add_item(Medicine.objects.create(name="A", price=Decimal("10.00"), stock=5))
+    client = APIClient()
+    client.force_authenticate(user)
+
+    def crash(pk):
+        raise RuntimeError("worker killed")
+
+    # the order commits, then the request dies before its response is stored
+    monkeypatch.setattr("docatho_backend.orders.views.process_message", crash)
+    with pytest.raises(RuntimeError):
+        client.post("/api/orders/checkout/", {}, HTTP_IDEMPOTENCY_KEY="k1")
+    monkeypatch.undo()
+    order = Order.objects.get()
+    assert IdempotencyKey.objects.get().order == order
+
+    # still within the lease: the first request may be running
+    assert (
+        client.post("/api/orders/checkout/", {}, HTTP_IDEMPOTENCY_KEY="k1").status_code
+        == 409
+    )
+
+    IdempotencyKey.objects.update(updated_at=timezone.now() - timedelta(minutes=5))
+    retry = client.post("/api/orders/checkout/", {}, HTTP_IDEMPOTENCY_KEY="k1")
+    assert retry.status_code == 202
+    assert retry["Idempotent-Replayed"] == "true"
+    assert retry.json()["order"]["id"] == order.pk
+    assert Order.objects.count() == 1
+    replay = client.post("/api/orders/checkout/", {}, HTTP_IDEMPOTENCY_KEY="k1")
+    assert replay.json() == retry.json()
+
+
+def test_checkout_idempotency_key_after_cart_review(user, gateway):
+    medicine = Medicine.objects.create(name="A", price=Decimal("10.00"), stock=5)
+    Cart.objects.create(user=user).add_item(medicine)
+    Medicine.objects.filter(pk=medicine.pk).update(price=Decimal("12.00"))
+    client = APIClient()
+    client.force_authenticate(user)
+
+    review = client.post("/api/orders/checkout/", {}, HTTP_IDEMPOTENCY_KEY="k1")
+    assert review.status_code == 409
+    assert not IdempotencyKey.objects.exists()
+
+    # the customer accepts the repriced cart and retries with the same key
+    response = client.post("/api/orders/checkout/", {}, HTTP_IDEMPOTENCY_KEY="k1")
+    assert response.status_code == 201
+    assert "Idempotent-Replayed" not in response
+    assert Order.objects.get().subtotal == Decimal("12.00")
+
+
+def test_stale_idempotency_key_without_order_is_taken_over(user, gateway):
+    Cart.objects.create(user=user).add_item(
+        Medicine.objects.create(name="A", price=Decimal("10.00"), stock=5)
+    )
+    # left by a request killed before it created an order
+    IdempotencyKey.objects.create(
+        user=user,
+        key="k1",
+        action="checkout",
+        fingerprint=hashlib.sha256(b"{}").hexdigest(),
+    )
+    client = APIClient()
+    client.force_authenticate(user)
+
+    assert (
+        client.post("/api/orders/checkout/", {}, HTTP_IDEMPOTENCY_KEY="k1").status_code
+        == 409
+    )
+    IdempotencyKey.objects.update(updated_at=timezone.now() - timedelta(minutes=5))
+    response = client.post("/api/orders/checkout/", {}, HTTP_IDEMPOTENCY_KEY="k1")
+    assert response.status_code == 201
+    assert "Idempotent-Replayed" not in response
+    assert IdempotencyKey.objects.get().status_code == 201
+    assert Order.objects.count() == 1
+
+
+def test_order_history_keyset_pages(user):
+    medicine = Medicine.objects.create(name="A", price=Decimal("10.00"))
+    placed_at = timezone.now()
+    orders = []
+    for i in range(25):
+        # ties on placed_at are broken by id
+        order = Order.objects.create(
+            order_number=f"ORD{i}", user=user, placed_at=placed_at
+        )
+        OrderItem.objects.bulk_create(
+            [OrderItem(order=order, medicine=medicine, quantity=1 + i % 3)]
+        )
+        orders.append(order.pk)
+    client = APIClient()
+    client.force_authenticate(user)
+
+    seen = []
+    counts = []
+    url = "/api/orders/?page_size=10"
+    while url:
+        with CaptureQueriesContext(connection) as ctx:
+            data = client.get(url).json()
+        counts.append(_query_count(ctx))
+        seen += [order["id"] for order in data["results"]]
+        url = data["next"]
+
+    assert seen == orders[::-1]
+    # orders (user and address are joined), items
+    assert counts == [2, 2, 2]
+
+
+def test_order_summary_view(user, gateway):
+    cart = Cart.objects.create(user=user)
+    for name in ["Alpha", "Beta", "Gamma", "Delta"]:
+        cart.add_item(
+            Medicine.objects.create(name=name, price=Decimal("1.00"), stock=5)
+        )
+    client = APIClient()
+    client.force_authenticate(user)
+    client.post("/api/orders/checkout/", {})
+    Medicine.objects.filter(name="Alpha").update(name="Alpha 2")
+
+    with CaptureQueriesContext(connection) as ctx:
+        data = client.get("/api/orders/?view=summary").json()
+
+    assert _query_count(ctx) == 1
+    row = data["results"][0]
+    assert (row["item_count"], row["item_preview"]) == (4, ["Alpha", "Beta", "Gamma"])
+    detail = client.get(f"/api/orders/{row['id']}/").json()
+    # names are snapshots: the rename does not reach the placed order
+    assert sorted(item["medicine_name"] for item in detail["items"]) == [
+        "Alpha",
+        "Beta",
+        "Delta",
+        "Gamma",
+    ]
+
+
+def test_bulk_update_status(user, django_capture_on_commit_callbacks):
+    user.is_staff = True
+    user.save()
+    placed, processing, delivered = [
+        Order.objects.create(order_number=f"ORD{s}", user=user, status=s)
+        for s in ["placed", "processing", "delivered"]
+    ]
+    client = APIClient()
+    client.force_authenticate(user)
+
+    with (
+        django_capture_on_commit_callbacks(execute=True),
+        CaptureQueriesContext(connection) as ctx,
+    ):
+        response = client.post(
+            "/api/admin/orders/bulk-update-status/",
+            {
+                "order_ids": [placed.pk, processing.pk, delivered.pk, 999999],
+                "status": "out_for_delivery",
+                "notes": "van 3",
+            },
+            format="json",
+        )
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "updated": 1,
+        "results": [
+            {"id": placed.pk, "result": "invalid_transition"},
+            {"id": processing.pk, "result": "updated"},
+            {"id": delivered.pk, "result": "invalid_transition"},
+            {"id": 999999, "result": "not_found"},
+        ],
+    }
+    # read statuses, one UPDATE per current status; logs are written after commit
+    assert _query_count(ctx) == 2
+    processing.refresh_from_db()
+    assert (processing.status, processing.notes) == ("out_for_delivery", "van 3")
+    assert processing.logs.get().meta == {
+        "old_status": "processing",
+        "new_status": "out_for_delivery",
+    }
+    assert not placed.logs.exists()
+
+
+def test_chemist_bulk_update_requires_chemist(user):
+    paid, unpaid = [
+        Order.objects.create(order_number=f"ORD{p}", user=user, payment_status=p)
+        for p in ["paid", "pending"]
+    ]
+    body = {"order_ids": [paid.pk, unpaid.pk], "status": "cancelled"}
+    url = "/api/providers/chemist-order-bulk-update/"
+    client = APIClient()
+    client.force_authenticate(user)
+
+    # a customer cannot move any order, not even their own
+    assert client.post(url, body, format="json").status_code == 403
+    assert not Order.objects.filter(status="cancelled").exists()
+
+    chemist = UserFactory()
+    Provider.objects.create(
+        name="Chemist", specialty="Pharmacy", user=chemist, provider_type="Chemist"
+    )
+    client.force_authenticate(chemist)
+    response = client.post(url, body, format="json")
+    assert response.status_code == 200
+    assert response.json()["results"] == [
+        {"id": paid.pk, "result": "updated"},
+        {"id": unpaid.pk, "result": "not_found"},
+    ]
+
+
+def test_update_status_compare_and_set(user, django_capture_on_commit_callbacks):
+    user.is_staff = True
+    user.save()
+    order = Order.objects.create(order_number="ORD1", user=user)
+    stale = Order.objects.get(pk=order.pk)
+    with django_capture_on_commit_callbacks(execute=True):
+        order.update_status("confirmed")
+
+    # the stale copy still says placed: its write loses instead of clobbering
+    with pytest.raises(OrderStatusConflict):
+        stale.update_status("cancelled")
+    with pytest.raises(InvalidStatusTransition):
+        order.update_status("delivered")
+    order.refresh_from_db()
+    assert order.status == "confirmed"
+    assert order.logs.count() == 1
+
+    client = APIClient()
+    client.force_authenticate(user)
+    url = f"/api/admin/orders/{order.pk}/update-status/"
+    response = client.patch(
+        url, {"status": "processing", "expected_status": "placed"}, format="json"
+    )
+    assert (response.status_code, response.json()["status"]) == (409, "confirmed")
+    response = client.patch(url, {"status": "processing"}, format="json")
+    assert (response.status_code, response.json()["status"]) == (200, "processing")
+
+    order.set_payment_status(Order.PaymentStatus.PAID)
+    assert (order.status, order.payment_status) == ("processing", "paid")
+
+
+def test_order_logs_are_buffered(user, settings, monkeypatch):
+    settings.BACKGROUND_TASKS_EAGER = False
+    monkeypatch.setattr(eventlog, "_start_flusher", lambda: None)
+    orders = [
+        Order.objects.create(order_number=f"ORD{i}", user=user) for i in range(3)
+    ]
+    log_order_events((order.pk, "note", None) for order in orders)
+    assert not OrderLog.objects.exists()
+
+    # nothing is queued until commit; the flush is one INSERT
+    eventlog._enqueue([(order.pk, "note", None) for order in orders])
+    with CaptureQueriesContext(connection) as ctx:
+        assert eventlog.flush() == 3
+    assert _query_count(ctx) == 1
+    assert OrderLog.objects.count() == 3
+    assert eventlog.flush() == 0
+
+
+def test_order_log_flush_failures(user, settings, monkeypatch, caplog):
+    settings.BACKGROUND_TASKS_EAGER = False
+    settings.ORDER_LOG_MAX_ATTEMPTS = 2
+    monkeypatch.setattr(eventlog, "_start_flusher", lambda: None)
+    order = Order.objects.create(order_number="ORD1", user=user)
+    queued_at = timezone.now() - timedelta(minutes=5)
+    eventlog._enqueue([(order.pk, "first", None)], queued_at)
+
+    # database unreachable: the row is kept for the next flush, up to the cap
+    def unreachable(*args, **kwargs):
+        raise OperationalError("connection refused")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(OrderLog.objects, "bulk_create", unreachable)
+        assert eventlog.flush() == 0
+        assert len(eventlog._buffer) == 1
+        eventlog._enqueue([(order.pk, "second", None)])
+        assert eventlog.flush() == 0
+    assert "Dropped order log" in caplog.text and "'first'" in caplog.text
+    assert [log.message for log in eventlog._buffer] == ["second"]
+
+    # a row that cannot be written does not hold back the others
+    eventlog._enqueue([(order.pk, "bad", {"x": object()})])
+    assert eventlog.flush() == 1
+    assert "'bad'" in caplog.text
+    log = order.logs.get()
+    assert log.message == "second"
+    assert log.created_at > queued_at
+
+
+def test_order_logs_are_written_at_exit(user, settings, monkeypatch, caplog):
+    settings.BACKGROUND_TASKS_EAGER = False
+    monkeypatch.setattr(eventlog, "_start_flusher", lambda: None)
+    order = Order.objects.create(order_number="ORD1", user=user)
+    queued_at = timezone.now() - timedelta(minutes=5)
+    eventlog._enqueue([(order.pk, "buffered", None)], queued_at)
+
+    eventlog._flush_at_exit()
+    # written with the time the event was queued, not the flush time
+    assert order.logs.get().created_at == queued_at
+
+    # nothing is left for a later flush: what still fails is dead-lettered
+    def unreachable(*args, **kwargs):
+        raise OperationalError("connection refused")
+
+    eventlog._enqueue([(order.pk, "late", None)])
+    monkeypatch.setattr(OrderLog.objects, "bulk_create", unreachable)
+    eventlog._flush_at_exit()
+    assert eventlog._buffer == []
+    assert "'late'" in caplog.text
+
+
+def test_sales_rollups(user, django_capture_on_commit_callbacks):
+    user.is_staff = True
+    user.save()
+    category = Category.objects.create(name="Pain")
+    medicine = Medicine.objects.create(name="A", price=Decimal("10.00"))
+    medicine.category.add(category)
+    orders = []
+    for i in range(3):
+        order = Order.objects.create(order_number=f"ORD{i}", user=user)
+        OrderItem.objects.bulk_create(
+            [
+                OrderItem(
+                    order=order,
+                    medicine=medicine,
+                    quantity=2,
+                    unit_price=Decimal("5.00"),
+                )
+            ]
+        )
+        order.recalc_totals()
+        orders.append(order)
+    with django_capture_on_commit_callbacks(execute=True):
+        for order in orders:
+            order.set_payment_status(Order.PaymentStatus.PAID)
+        # a repeated confirmation (client and webhook) is counted once
+        orders[0].set_payment_status(Order.PaymentStatus.PAID)
+        orders[0].update_status("cancelled")
+        Order.bulk_update_status([orders[1].pk], "processing")
+
+    client = APIClient()
+    client.force_authenticate(user)
+    data = client.get("/api/admin/reports/sales/").json()
+    assert data["totals"] == {
+        "orders": 2,
+        "cancelled": 1,
+        "returned": 0,
+        "units": 4,
+        "gmv": "20.00",
+        "discount": "0.00",
+        "revenue": "20.00",
+    }
+    categories = client.get("/api/admin/reports/sales/categories/").json()
+    assert categories["results"] == [
+        {"category_id": category.pk, "name": "Pain", "units": 4, "gmv": "20.00"}
+    ]
+
+    before = client.get("/api/admin/reports/sales/medicines/").json()
+    call_command("rebuild_sales_rollups", stdout=StringIO())
+    assert client.get("/api/admin/reports/sales/medicines/").json() == before
+    assert client.get("/api/admin/reports/sales/").json() == data
+
+
+def test_sales_rollups_follow_refunds_and_failures(user):
+    user.is_staff = True
+    user.save()
+    medicine = Medicine.objects.create(name="A", price=Decimal("10.00"))
+    other = Medicine.objects.create(name="B", price=Decimal("10.00"))
+    refunded, repaid, cancelled = [
+        Order.objects.create(order_number=f"ORD{i}", user=user) for i in range(3)
+    ]
+    for order in (refunded, repaid, cancelled):
+        OrderItem.objects.bulk_create(
+            [
+                OrderItem(
+                    order=order,
+                    medicine=medicine if order is repaid else other,
+                    quantity=1,
+                    unit_price=Decimal("10.00"),
+                )
+            ]
+        )
+        order.recalc_totals()
+        order.set_payment_status(Order.PaymentStatus.PAID)
+
+    refunded.set_payment_status(Order.PaymentStatus.REFUNDED)
+    # a late failure of an earlier attempt does not undo the payment
+    repaid.set_payment_status(Order.PaymentStatus.FAILED)
+    assert repaid.payment_status == Order.PaymentStatus.PAID
+    repaid.set_payment_status(Order.PaymentStatus.PAID)
+    cancelled.update_status("cancelled")
+    cancelled.set_payment_status(Order.PaymentStatus.REFUNDED)
+
+    client = APIClient()
+    client.force_authenticate(user)
+    live = client.get("/api/admin/reports/sales/").json()
+    assert live["totals"] == {
+        "orders": 1,
+        "cancelled": 1,
+        "returned": 0,
+        "units": 1,
+        "gmv": "10.00",
+        "discount": "0.00",
+        "revenue": "10.00",
+    }
+    live_medicines = client.get("/api/admin/reports/sales/medicines/").json()
+    assert [row["name"] for row in live_medicines["results"]] == ["A"]
+    call_command("rebuild_sales_rollups", stdout=StringIO())
+    assert client.get("/api/admin/reports/sales/").json() == live
+    assert client.get("/api/admin/reports/sales/medicines/").json() == live_medicines
+
+
+def test_order_log_without_partition_is_not_dropped_silently(
+    user, settings, monkeypatch, caplog
+):
+    settings.BACKGROUND_TASKS_EAGER = False
+    monkeypatch.setattr(eventlog, "_start_flusher", lambda: None)
+    order = Order.objects.create(order_number="ORD1", user=user)
+
+    def no_partition(*args, **kwargs):
+        raise IntegrityError('no partition of relation "orders_orderlog" found')
+
+    monkeypatch.setattr(OrderLog.objects, "bulk_create", no_partition)
+    monkeypatch.setattr(OrderLog, "save", no_partition)
+    eventlog._enqueue([(order.pk, "placed", None)])
+    assert eventlog.flush() == 0
+    # an error with the row's content, not the missing-order warning
+    assert [r.levelname for r in caplog.records if "Dropped" in r.message] == [
+        "ERROR"
+    ]
+    assert "'placed'" in caplog.text
+
+
+def test_order_log_partition_months():
+    start = partitions.month_start(date(2026, 11, 19))
+    assert timezone.localtime(start).isoformat() == "2026-11-01T00:00:00+05:30"
+    assert [
+        partitions.partition_name("orders_orderlog", partitions.add_months(start, i))
+        for i in (-11, 0, 2)
+    ] == [
+        "orders_orderlog_p202512",
+        "orders_orderlog_p202611",
+        "orders_orderlog_p202701",
+    ]
+    if connection.vendor != "postgresql":
+        with pytest.raises(CommandError):
+            call_command("order_partitions")
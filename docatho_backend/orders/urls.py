@@ -1,11 +1,20 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from .views import OrderViewSet, razorpay_webhook, AdminOrderList, TransactionListView
+from .views import (
+    OrderViewSet,
+    razorpay_webhook,
+    AdminOrderList,
+    AdminSalesReportViewSet,
+    TransactionListView,
+)
 
 router = DefaultRouter()
 router.register(r"orders", OrderViewSet, basename="orders")
 router.register(r"admin/orders", AdminOrderList, basename="admin-orders")
+router.register(
+    r"admin/reports/sales", AdminSalesReportViewSet, basename="admin-sales-report"
+)
 router.register(r"transactions", TransactionListView, basename="transactions")
 
 urlpatterns = [
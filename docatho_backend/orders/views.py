@@ -1,27 +1,52 @@
 from django.shortcuts import render
 from uuid import uuid4
+from datetime import timedelta
 from decimal import Decimal
 
 from django.db import transaction as db_transaction
+from django.db.models import F, Sum, prefetch_related_objects
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.decorators import method_decorator
 
 from rest_framework import serializers, status, viewsets
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 
-from docatho_backend.orders.paginators import GenericPaginationClass
+from docatho_backend.orders.paginators import (
+    GenericPaginationClass,
+    OrderHistoryPagination,
+)
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
-from .models import Order, OrderItem, Transaction
+from .idempotency import bind_order, idempotent, not_replayed
+from .models import (
+    DailyCategorySales,
+    DailyMedicineSales,
+    DailySales,
+    InvalidStatusTransition,
+    Order,
+    OrderItem,
+    OrderStatusConflict,
+    OutboxMessage,
+    Transaction,
+)
+from .outbox import enqueue, process_message
 from .razorpay import RazorpayClient
-from docatho_backend.cart.models import Cart, CartItem
+from docatho_backend.cart.models import CartItem
+from docatho_backend.cart.preflight import (
+    MRP_CHANGED,
+    PRICE_CHANGED,
+    preflight_cart,
+)
+from docatho_backend.cart.pricing import reprice_carts
+from docatho_backend.cart.storage import get_cart_store
 from docatho_backend.users.views import AddressSerializer
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
     medicine_id = serializers.IntegerField(read_only=True)
-    medicine_name = serializers.CharField(source="medicine.name", read_only=True)
 
     class Meta:
         model = OrderItem
@@ -64,6 +89,37 @@ class OrderSerializer(serializers.ModelSerializer):
         )
 
 
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """List rows rendered from the orders table alone (no items, no joins)."""
+
+    class Meta:
+        model = Order
+        fields = (
+            "id",
+            "order_number",
+            "status",
+            "payment_status",
+            "subtotal",
+            "discount_amount",
+            "total",
+            "placed_at",
+            "item_count",
+            "item_preview",
+        )
+
+
+class AdminOrderSummarySerializer(OrderSummarySerializer):
+    user_name = serializers.CharField(source="user.name", read_only=True)
+    user_phone = serializers.CharField(source="user.phone", read_only=True)
+
+    class Meta(OrderSummarySerializer.Meta):
+        fields = OrderSummarySerializer.Meta.fields + (
+            "user",
+            "user_name",
+            "user_phone",
+        )
+
+
 class AdminOrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     user_name = serializers.CharField(source="user.name", read_only=True)
@@ -109,6 +165,54 @@ class RazorpayConfirmSerializer(serializers.Serializer):
 class UpdateOrderStatusSerializer(serializers.Serializer):
     status = serializers.ChoiceField(choices=Order.Status.choices)
     notes = serializers.CharField(required=False, allow_blank=True)
+    # the status the client saw; the update is refused (409) if it has changed
+    expected_status = serializers.ChoiceField(
+        choices=Order.Status.choices, required=False
+    )
+
+
+class BulkUpdateOrderStatusSerializer(serializers.Serializer):
+    order_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=200,
+    )
+    status = serializers.ChoiceField(choices=Order.Status.choices)
+    notes = serializers.CharField(required=False, allow_blank=True)
+
+
+def status_conflict_response(order, exc):
+    """409 for a lost status update, with the status that won."""
+    current = Order.objects.filter(pk=order.pk).values_list("status", flat=True)
+    return Response(
+        {"detail": str(exc), "status": current.first()},
+        status=status.HTTP_409_CONFLICT,
+    )
+
+
+def bulk_update_status_response(request, queryset):
+    """
+    Shared by the admin and chemist bulk endpoints.
+    Body: { order_ids: [..], status, notes (optional) }
+    -> { updated: n, results: [{ id, result }] } in request order, where
+    result is updated | not_found | invalid_transition | conflict.
+    """
+    serializer = BulkUpdateOrderStatusSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    order_ids = list(dict.fromkeys(serializer.validated_data["order_ids"]))
+    results = Order.bulk_update_status(
+        order_ids,
+        serializer.validated_data["status"],
+        notes=serializer.validated_data.get("notes"),
+        queryset=queryset,
+    )
+    return Response(
+        {
+            "updated": sum(r == Order.UPDATED for r in results.values()),
+            "results": [{"id": pk, "result": results[pk]} for pk in order_ids],
+        },
+        status=status.HTTP_200_OK,
+    )
 
 
 class TransactionSerializer(serializers.ModelSerializer):
@@ -142,17 +246,36 @@ class TransactionSerializer(serializers.ModelSerializer):
         )
 
 
+@method_decorator(db_transaction.non_atomic_requests, name="dispatch")
 class OrderViewSet(viewsets.ViewSet):
+    """
+    Not wrapped in ATOMIC_REQUESTS: checkout must commit the order before the
+    payment gateway is called. Every write uses its own atomic block.
+    """
+
     permission_classes = (IsAuthenticated,)
 
     def list(self, request):
-        qs = Order.objects.filter(user=request.user).order_by("-placed_at")
-        page = self.request.query_params.get("page")
-        serializer = OrderSerializer(qs, many=True, context={"request": request})
-        return Response(serializer.data)
+        """
+        Order history, newest first, keyset paginated.
+        GET /api/orders/?page_size=<n>&cursor=<next cursor>
+        ?view=summary returns OrderSummarySerializer rows (one query per page).
+        """
+        paginator = OrderHistoryPagination()
+        orders = Order.objects.filter(user=request.user)
+        if request.query_params.get("view") == "summary":
+            serializer_class = OrderSummarySerializer
+        else:
+            serializer_class = OrderSerializer
+            orders = orders.with_details()
+        page = paginator.paginate_queryset(orders, request, self)
+        serializer = serializer_class(page, many=True, context={"request": request})
+        return paginator.get_paginated_response(serializer.data)
 
     def retrieve(self, request, pk=None):
-        order = get_object_or_404(Order, pk=pk, user=request.user)
+        order = get_object_or_404(
+            Order.objects.with_details(), pk=pk, user=request.user
+        )
         serializer = OrderSerializer(order, context={"request": request})
         return Response(serializer.data)
 
@@ -170,15 +293,19 @@ class OrderViewSet(viewsets.ViewSet):
             order.update_status(
                 new_status=serializer.validated_data["status"],
                 notes=serializer.validated_data.get("notes"),
+                expected_status=serializer.validated_data.get("expected_status"),
             )
-        except ValueError as e:
+        except InvalidStatusTransition as e:
             return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except OrderStatusConflict as e:
+            return status_conflict_response(order, e)
 
         # Return updated order
         response_serializer = OrderSerializer(order, context={"request": request})
         return Response(response_serializer.data, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=["post"])
+    @idempotent("checkout", recover="_checkout_response")
     def checkout(self, request):
         """
         Create an Order from the user's open Cart and create a Razorpay order.
@@ -187,80 +314,137 @@ class OrderViewSet(viewsets.ViewSet):
         Business rules:
          - delivery_fee is 0 (server controlled)
          - a fixed 15% discount (of subtotal) is applied to all orders
+
+        Retries sent with the same Idempotency-Key header get the first response,
+        unless the cart was empty or needed review: those run again.
         """
         serializer = CheckoutSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         data = serializer.validated_data
 
-        cart = Cart.objects.filter(user=request.user).first()
-        if not cart or not cart.items.exists():
-            return Response(
-                {"detail": "Cart is empty"}, status=status.HTTP_400_BAD_REQUEST
+        # carts held in the Redis store are written back before ordering
+        cart = get_cart_store().persist(request.user)
+        if not cart or not cart.item_count:
+            return not_replayed(
+                Response(
+                    {"detail": "Cart is empty"}, status=status.HTTP_400_BAD_REQUEST
+                )
+            )
+        # fail before creating any order or gateway order
+        preflight = preflight_cart(cart)
+        if not preflight["ok"]:
+            drifted = [
+                line["medicine_id"]
+                for line in preflight["issues"]
+                if {PRICE_CHANGED, MRP_CHANGED} & set(line["issues"])
+            ]
+            if drifted:
+                # bring the lines to current prices for the customer to review
+                reprice_carts(drifted, cart_ids=[cart.pk])
+            return not_replayed(
+                Response(
+                    {"detail": "Cart needs review", "preflight": preflight},
+                    status=status.HTTP_409_CONFLICT,
+                )
             )
 
         with db_transaction.atomic():
-            # create order (initial totals will be recalculated later)
-            order_number = f"ORD{uuid4().hex[:12].upper()}"
-            address = request.user.address
-            order = Order.objects.create(
-                order_number=order_number,
+            order = Order(
+                order_number=f"ORD{uuid4().hex[:12].upper()}",
                 user=request.user,
-                address=address,
+                address=request.user.address,
                 delivery_fee=Decimal("0.00"),  # server controlled
                 discount_amount=Decimal("0.00"),
                 notes=data.get("notes", "") or "",
             )
-
-            # move cart items into order items (snapshot prices)
-            for it in cart.items.select_related("medicine").all():
-                OrderItem.objects.create(
+            # snapshot the cart lines; saved below with one bulk INSERT, which
+            # skips OrderItem.save() and its per-line recalc_totals()
+            items = [
+                OrderItem(
                     order=order,
-                    medicine=it.medicine,
+                    medicine_id=it.medicine_id,
+                    medicine_name=it.medicine.name,
                     quantity=it.quantity,
                     unit_price=it.unit_price,
                     mrp=it.mrp,
                     prescription_required=False,
                 )
-
-            # recalc totals to compute subtotal
-            order.recalc_totals()
+                for it in cart.items.select_related("medicine").order_by("id")
+            ]
+            order.set_totals(items)
 
             # apply fixed 15% discount on subtotal (server-side rule)
             discount_percent = Decimal("15.0")
-            discount_amount = (
+            order.discount_amount = (
                 order.subtotal * (discount_percent / Decimal("100"))
             ).quantize(Decimal("0.01"))
-            # ensure discount does not exceed subtotal
-            if discount_amount > order.subtotal:
-                discount_amount = order.subtotal
-            order.discount_amount = discount_amount
-            order.delivery_fee = Decimal("0.00")
-            order.recalc_totals()
-
-            # create razorpay order
-            client = RazorpayClient()
-            try:
-                rp_order = client.create_order(order)
-            except Exception as exc:
-                return Response(
-                    {"detail": "failed to create razorpay order", "error": str(exc)},
-                    status=status.HTTP_502_BAD_GATEWAY,
-                )
+            # set_totals caps the discount at the subtotal
+            order.set_totals(items)
+            order.save()
+            # a retry of a request that dies from here on recovers this order
+            bind_order(request, order)
+            OrderItem.objects.bulk_create(items)
+            # the razorpay order is created after commit (see orders/outbox.py)
+            message = enqueue(order, OutboxMessage.TOPIC_RAZORPAY_ORDER)
 
             cart.save(update_fields=["updated_at"])
 
+        # try the gateway right away, with no transaction open; if it is slow
+        # or down the client polls payment-session while the worker retries
+        process_message(message.pk)
+        return self._checkout_response(request, order)
+
+    def _checkout_response(self, request, order):
+        session = self._payment_session(order)
+
         # return order + razorpay payload (client will use rp_order['id'] etc)
+        prefetch_related_objects([order], "items")
         out = {
             "order": OrderSerializer(order, context={"request": request}).data,
-            "razorpay_order": rp_order,
+            "razorpay_order": session["razorpay_order"],
+            "payment_session": session,
         }
-        return Response(out, status=status.HTTP_201_CREATED)
+        if session["status"] == OutboxMessage.Status.DONE:
+            return Response(out, status=status.HTTP_201_CREATED)
+        return Response(out, status=status.HTTP_202_ACCEPTED)
+
+    def _payment_session(self, order):
+        message = (
+            order.outbox_messages.filter(topic=OutboxMessage.TOPIC_RAZORPAY_ORDER)
+            .order_by("-created_at")
+            .first()
+        )
+        if message is None:
+            return {"status": None, "razorpay_order": None, "error": None}
+        done = message.status == OutboxMessage.Status.DONE
+        return {
+            "status": message.status,
+            "razorpay_order": message.result if done else None,
+            "error": None if done else message.last_error or None,
+        }
+
+    @action(detail=True, methods=["get"], url_path="payment-session")
+    def payment_session(self, request, pk=None):
+        """
+        Razorpay order of a checkout that answered 202.
+        GET /api/orders/<pk>/payment-session/
+        -> { status: pending|processing|done|failed, razorpay_order, error }
+        """
+        order = get_object_or_404(Order, pk=pk, user=request.user)
+        # a due retry is attempted here too (no-op if a worker holds it)
+        for message in order.outbox_messages.filter(
+            status=OutboxMessage.Status.PENDING, available_at__lte=timezone.now()
+        ):
+            process_message(message.pk)
+        return Response(self._payment_session(order))
 
     @action(detail=False, methods=["post"], url_path="confirm-payment")
+    @idempotent("confirm-payment")
     def confirm_payment(self, request):
         """
         Confirm payment after client-side checkout.
         Body: { razorpay_order_id, razorpay_payment_id, razorpay_signature }
+        Retries sent with the same Idempotency-Key header get the first response.
         """
         serializer = RazorpayConfirmSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -285,11 +469,7 @@ class OrderViewSet(viewsets.ViewSet):
         # empty the user's cart on successful payment
         if tr.succeeded:
             try:
-                cart = Cart.objects.filter(user=tr.order.user).first()
-                if cart and cart.items.exists():
-                    with db_transaction.atomic():
-                        cart.items.all().delete()
-                        cart.save(update_fields=["updated_at"])
+                get_cart_store().clear(tr.order.user)
             except Exception:
                 # Do not block payment confirmation response if cart clearing fails
                 pass
@@ -349,6 +529,23 @@ class AdminOrderList(viewsets.ReadOnlyModelViewSet):
     search_fields = ["order_number", "user__name", "user__phone"]
     queryset = Order.objects.all().order_by("-placed_at")
 
+    def get_queryset(self):
+        if self._summary_view():
+            return super().get_queryset().select_related("user")
+        return super().get_queryset().with_details()
+
+    def get_serializer_class(self):
+        if self._summary_view():
+            return AdminOrderSummarySerializer
+        return super().get_serializer_class()
+
+    def _summary_view(self):
+        # ?view=summary lists orders without their items
+        return (
+            self.action == "list"
+            and self.request.query_params.get("view") == "summary"
+        )
+
     def get_permissions(self):
         permissions = super().get_permissions()
         if not self.request.user.is_staff:
@@ -371,14 +568,26 @@ class AdminOrderList(viewsets.ReadOnlyModelViewSet):
             order.update_status(
                 new_status=serializer.validated_data["status"],
                 notes=serializer.validated_data.get("notes"),
+                expected_status=serializer.validated_data.get("expected_status"),
             )
-        except ValueError as e:
+        except InvalidStatusTransition as e:
             return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except OrderStatusConflict as e:
+            return status_conflict_response(order, e)
 
         # Return updated order
         response_serializer = AdminOrderSerializer(order, context={"request": request})
         return Response(response_serializer.data, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=["post"], url_path="bulk-update-status")
+    def bulk_update_status(self, request):
+        """
+        Move many orders to one status (admin only).
+        POST /api/admin/orders/bulk-update-status/
+        { order_ids: [..], status, notes (optional) }
+        """
+        return bulk_update_status_response(request, Order.objects.all())
+
 
 class TransactionSerializer(serializers.ModelSerializer):
     order_number = serializers.CharField(source="order.order_number", read_only=True)
@@ -411,6 +620,127 @@ class TransactionSerializer(serializers.ModelSerializer):
         )
 
 
+class SalesReportQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    limit = serializers.IntegerField(
+        required=False, default=20, min_value=1, max_value=200
+    )
+
+    def validate(self, attrs):
+        attrs.setdefault("end", timezone.localdate())
+        attrs.setdefault("start", attrs["end"] - timedelta(days=29))
+        if attrs["start"] > attrs["end"]:
+            raise serializers.ValidationError("start must not be after end")
+        if (attrs["end"] - attrs["start"]).days >= 366:
+            raise serializers.ValidationError("range must be at most 366 days")
+        return attrs
+
+
+def _money(value) -> str:
+    """Aggregated amount as a decimal string, like the serializers render it."""
+    return str(Decimal(value).quantize(Decimal("0.01")))
+
+
+class DailySalesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailySales
+        fields = (
+            "day",
+            "orders",
+            "cancelled",
+            "returned",
+            "units",
+            "gmv",
+            "discount",
+            "revenue",
+        )
+
+
+class AdminSalesReportViewSet(viewsets.ViewSet):
+    """
+    Sales dashboard for admin users, read from the daily rollup tables
+    (see orders/rollups.py), so the cost grows with the days in the range and
+    not with the number of orders.
+    Query params: start, end (YYYY-MM-DD, default the last 30 days), limit.
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def get_permissions(self):
+        permissions = super().get_permissions()
+        if not self.request.user.is_staff:
+            self.permission_denied(
+                self.request, message="User does not have admin privileges."
+            )
+        return permissions
+
+    def _query(self, request):
+        serializer = SalesReportQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def list(self, request):
+        """
+        GET /api/admin/reports/sales/
+        -> { start, end, totals: {...}, days: [{ day, orders, cancelled,
+             returned, units, gmv, discount, revenue }] }
+        """
+        query = self._query(request)
+        counts = ("orders", "cancelled", "returned", "units")
+        amounts = ("gmv", "discount", "revenue")
+        days = DailySales.objects.filter(
+            day__range=(query["start"], query["end"])
+        ).order_by("day")
+        totals = days.aggregate(
+            **{field: Sum(field, default=0) for field in counts},
+            **{field: Sum(field, default=Decimal("0.00")) for field in amounts},
+        )
+        for field in amounts:
+            totals[field] = _money(totals[field])
+        return Response(
+            {
+                "start": query["start"],
+                "end": query["end"],
+                "totals": totals,
+                "days": DailySalesSerializer(days, many=True).data,
+            }
+        )
+
+    @action(detail=False, methods=["get"])
+    def medicines(self, request):
+        """
+        Top medicines by GMV in the range.
+        GET /api/admin/reports/sales/medicines/
+        -> { start, end, results: [{ medicine_id, name, units, gmv }] }
+        """
+        return self._top(request, DailyMedicineSales, "medicine")
+
+    @action(detail=False, methods=["get"])
+    def categories(self, request):
+        """
+        Top categories by GMV in the range.
+        GET /api/admin/reports/sales/categories/
+        -> { start, end, results: [{ category_id, name, units, gmv }] }
+        """
+        return self._top(request, DailyCategorySales, "category")
+
+    def _top(self, request, model, dimension):
+        query = self._query(request)
+        rows = (
+            model.objects.filter(day__range=(query["start"], query["end"]))
+            .values(f"{dimension}_id", name=F(f"{dimension}__name"))
+            .annotate(units=Sum("units"), gmv=Sum("gmv"))
+            # sales that were all taken back out leave zero rows behind
+            .exclude(units=0, gmv=0)
+            .order_by("-gmv", f"{dimension}_id")[: query["limit"]]
+        )
+        results = [row | {"gmv": _money(row["gmv"])} for row in rows]
+        return Response(
+            {"start": query["start"], "end": query["end"], "results": results}
+        )
+
+
 class TransactionListView(viewsets.ReadOnlyModelViewSet):
     """
     Viewset for listing transactions with pagination (10 per page).
@@ -0,0 +1,20 @@
+from rest_framework import permissions
+
+from docatho_backend.providers.enums import ProviderType
+
+
+def is_chemist(user) -> bool:
+    provider = getattr(user, "provider", None)
+    return provider is not None and provider.provider_type == ProviderType.CHEMIST.value
+
+
+class IsStaffOrChemist(permissions.BasePermission):
+    """Staff users, or users whose Provider profile is a chemist."""
+
+    message = "User is not a chemist."
+
+    def has_permission(self, request, view):
+        user = request.user
+        return bool(
+            user and user.is_authenticated and (user.is_staff or is_chemist(user))
+        )
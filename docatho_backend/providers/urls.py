@@ -6,6 +6,7 @@ from .views import (
     VerifyOTPAPIView,
     ChemistOrderListAPIView,
     ChemistOrderUpdateAPIView,
+    ChemistOrderBulkUpdateAPIView,
     OrderDetailAPIView,
 )
 
@@ -24,6 +25,11 @@ urlpatterns = [
         ChemistOrderUpdateAPIView.as_view(),
         name="chemist-order-update",
     ),
+    path(
+        "chemist-order-bulk-update/",
+        ChemistOrderBulkUpdateAPIView.as_view(),
+        name="chemist-order-bulk-update",
+    ),
     path(
         "order-detail/<int:pk>/",
         OrderDetailAPIView.as_view(),
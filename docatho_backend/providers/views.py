@@ -9,11 +9,20 @@ from docatho_backend.users.models import User
 from docatho_backend.users.helper import generate_otp
 from docatho_backend.users.models import PhoneOtp
 from rest_framework.authtoken.models import Token
-from docatho_backend.orders.models import Order
-from docatho_backend.orders.views import OrderSerializer
+from docatho_backend.orders.models import (
+    InvalidStatusTransition,
+    Order,
+    OrderStatusConflict,
+)
+from docatho_backend.orders.views import (
+    OrderSerializer,
+    bulk_update_status_response,
+    status_conflict_response,
+)
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
 from docatho_backend.orders.paginators import GenericPaginationClass
+from docatho_backend.providers.permissions import IsStaffOrChemist
 
 
 class SendOTPAPIView(APIView):
@@ -88,7 +97,7 @@ class ChemistOrderListAPIView(ListAPIView):
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ["status"]
     serializer_class = OrderSerializer
-    queryset = Order.objects.all().order_by("-placed_at")
+    queryset = Order.objects.with_details().order_by("-placed_at")
 
 
 class ChemistOrderUpdateAPIView(APIView):
@@ -103,10 +112,42 @@ class ChemistOrderUpdateAPIView(APIView):
         order = self.get_object(pk=pk)
         serializer = OrderSerializer(order, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        # status goes through the transition table and its conditional UPDATE
+        new_status = serializer.validated_data.pop("status", None)
+        if new_status is not None and new_status != order.status:
+            try:
+                order.update_status(new_status)
+            except InvalidStatusTransition as e:
+                return Response(
+                    {"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST
+                )
+            except OrderStatusConflict as e:
+                return status_conflict_response(order, e)
+        if serializer.validated_data:
+            serializer.save()
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+class ChemistOrderBulkUpdateAPIView(APIView):
+    """
+    Move many orders to one status (staff and chemists only).
+    POST /api/providers/chemist-order-bulk-update/
+    { order_ids: [..], status, notes (optional) }
+    """
+
+    permission_classes = [IsStaffOrChemist]
+
+    def get_queryset(self):
+        if self.request.user.is_staff:
+            return Order.objects.all()
+        # orders are not assigned to chemists: they handle the paid orders
+        # waiting for dispatch; others are reported as not_found
+        return Order.objects.filter(payment_status=Order.PaymentStatus.PAID)
+
+    def post(self, request):
+        return bulk_update_status_response(request, self.get_queryset())
+
+
 class UserDetailAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = UserSerializer
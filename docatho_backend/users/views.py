@@ -21,8 +21,14 @@ from docatho_backend.users.serializers import (
     UserDetailSerializer,
     VerifyOtpSerializer,
 )
+from docatho_backend.medicines.cache import (
+    CATALOG_CACHE_TIMEOUT,
+    catalog_key,
+    get_category_tree,
+)
 from docatho_backend.medicines.models import Category
 from docatho_backend.medicines.serializers import CategorySerializer
+from django.core.cache import cache
 from docatho_backend.orders.paginators import GenericPaginationClass
 from rest_framework.authtoken.models import Token
 
@@ -356,12 +362,17 @@ class DashboardView(APIView):
             "https://docatho-media.s3.ap-south-1.amazonaws.com/ad2.png"
             "https://docatho-media.s3.ap-south-1.amazonaws.com/ad3.png"
         ]
-        categories_qs = Category.objects.filter(is_active=True)
-        categories = CategorySerializer(categories_qs, many=True).data
+        key = catalog_key("dashboard-categories")
+        categories = cache.get(key)
+        if categories is None:
+            categories_qs = Category.objects.filter(is_active=True)
+            categories = CategorySerializer(categories_qs, many=True).data
+            cache.set(key, categories, timeout=CATALOG_CACHE_TIMEOUT)
         return Response(
             {
                 "marketing_urls": marketing_urls,
                 "categories": categories,
+                "category_tree": get_category_tree(),
             },
             status=status.HTTP_200_OK,
         )